@@ -24,8 +24,11 @@
 
 import argparse
 import os
+import re
 import shutil
 
+ip_blocks = ["SQ", "SQC", "TA", "TD", "TCP", "TCC", "SPI", "CPC", "CPF"]
+
 
 def print_avail_arch(avail_arch: list):
     ret_str = "\t\tList all available metrics for analysis on specified arch:"
@@ -34,6 +37,15 @@ def print_avail_arch(avail_arch: list):
     return ret_str
 
 
+def block_or_metric(value):
+    """Check a hardware block, or a metric id as in analyze -b"""
+    if value in ip_blocks or re.match(r"^\d+(\.\d+){0,2}$", value):
+        return value
+    raise argparse.ArgumentTypeError(
+        "invalid choice: '%s' (choose a hardware block or a metric id)" % value
+    )
+
+
 def add_general_group(parser, rocprof_compute_version):
     general_group = parser.add_argument_group("General Options")
 
@@ -54,7 +66,7 @@ def add_general_group(parser, rocprof_compute_version):
         "-q", "--quiet", action="store_true", help="Reduce output and run quietly."
     )
     # Nowhere to load specs from in db mode
-    if "database" not in parser.usage:
+    if "database" not in parser.usage and "convert" not in parser.usage:
         general_group.add_argument(
             "-s", "--specs", action="store_true", help="Print system specs and exit."
         )
@@ -90,6 +102,7 @@ rocprof-compute profile --name <workload_name> [profile options] [roofline optio
 Examples:
 \trocprof-compute profile -n vcopy_all -- ./vcopy -n 1048576 -b 256
 \trocprof-compute profile -n vcopy_SPI_TCC -b SQ TCC -- ./vcopy -n 1048576 -b 256
+\trocprof-compute profile -n vcopy_SOL_L2 -b 2 17 -- ./vcopy -n 1048576 -b 256
 \trocprof-compute profile -n vcopy_kernel -k vecCopy -- ./vcopy -n 1048576 -b 256
 \trocprof-compute profile -n vcopy_disp -d 0 -- ./vcopy -n 1048576 -b 256
 \trocprof-compute profile -n vcopy_roof --roof-only -- ./vcopy -n 1048576 -b 256
@@ -162,13 +175,14 @@ Examples:
     profile_group.add_argument(
         "-b",
         "--block",
-        type=str,
+        type=block_or_metric,
         dest="ipblocks",
         metavar="",
         nargs="+",
         required=False,
-        choices=["SQ", "SQC", "TA", "TD", "TCP", "TCC", "SPI", "CPC", "CPF"],
-        help="\t\t\tHardware block filtering:\n\t\t\t   SQ\n\t\t\t   SQC\n\t\t\t   TA\n\t\t\t   TD\n\t\t\t   TCP\n\t\t\t   TCC\n\t\t\t   SPI\n\t\t\t   CPC\n\t\t\t   CPF",
+        help="\t\t\tHardware block filtering:\n\t\t\t   "
+        + "\n\t\t\t   ".join(ip_blocks)
+        + "\n\t\t\tor metric id(s) from analyze --list-metrics, to collect only\n\t\t\tthe counters those metrics need.",
     )
 
     result = shutil.which("rocscope")
@@ -228,6 +242,44 @@ Examples:
         action="store_true",
         help="\t\t\tProfile without collecting roofline data.",
     )
+    profile_group.add_argument(
+        "--columnar",
+        required=False,
+        default=False,
+        action="store_true",
+        help="\t\t\tAlso write columnar (Parquet) copies of the raw counter csv files,\n\t\t\twhich analyze loads faster. Needs pyarrow.",
+    )
+    profile_group.add_argument(
+        "--gpus",
+        type=str,
+        metavar="",
+        nargs="+",
+        dest="gpus",
+        required=False,
+        default=None,
+        help="\t\t\tRun the counter passes concurrently, each pinned to one of these GPUs.\n\t\t\tOnly for deterministic applications.",
+    )
+    profile_group.add_argument(
+        "--pipeline",
+        required=False,
+        default=False,
+        action="store_true",
+        help="\t\t\tProcess the results of each counter pass in the background,\n\t\t\twhile the app is profiled for the next pass.",
+    )
+    profile_group.add_argument(
+        "--resume",
+        required=False,
+        default=False,
+        action="store_true",
+        help="\t\t\tResume an interrupted profiling session in the workload dir,\n\t\t\tskipping the passes whose results are already there.",
+    )
+    profile_group.add_argument(
+        "--plan",
+        required=False,
+        default=False,
+        action="store_true",
+        help="\t\t\tPrint the counter passes profiling would run, then exit without profiling.",
+    )
     profile_group.add_argument(
         "remaining",
         metavar="-- [ ...]",
@@ -396,6 +448,42 @@ Examples:
         type=int,
     )
 
+    ## Convert Command Line Options
+    ## ----------------------------
+    convert_parser = subparsers.add_parser(
+        "convert",
+        help="Upgrade existing workloads with manifests and columnar copies of their raw data",
+        usage="""
+rocprof-compute convert --path <workload_path> [<workload_path> ...]
+
+-----------------------------------------------------------------------------------
+Examples:
+\trocprof-compute convert -p workloads/vcopy/mi200/
+\trocprof-compute convert -p workloads/vcopy/mi200/ workloads/mixbench/mi200/
+-----------------------------------------------------------------------------------
+        """,
+        prog="tool",
+        allow_abbrev=False,
+        formatter_class=lambda prog: argparse.RawTextHelpFormatter(
+            prog, max_help_position=40
+        ),
+    )
+    convert_parser._optionals.title = "Help"
+
+    add_general_group(convert_parser, rocprof_compute_version)
+    convert_group = convert_parser.add_argument_group("Convert Options")
+
+    convert_group.add_argument(
+        "-p",
+        "--path",
+        required=True,
+        metavar="",
+        type=str,
+        nargs="+",
+        dest="path",
+        help="\t\tSpecify the workload directories to convert (incl. multi-node ones).",
+    )
+
     ## Analyze Command Line Options
     ## ----------------------------
     analyze_parser = subparsers.add_parser(
@@ -543,6 +631,42 @@ Examples:
         metavar="",
         help="\t\tSpecify the dirctory to save analysis dataframe csv files.",
     )
+    analyze_advanced_group.add_argument(
+        "--per-dispatch",
+        dest="per_dispatch",
+        metavar="",
+        help="\t\tSave a dispatch x metric matrix of all filtered dispatches to a .parquet\n\t\tfile, or else to a directory of .npy array and .csv labels.",
+    )
+    analyze_advanced_group.add_argument(
+        "--per-kernel",
+        dest="per_kernel",
+        metavar="",
+        help="\t\tSave a kernel x metric table of all filtered kernels to a .parquet\n\t\tfile, or else to a .csv file.",
+    )
+    analyze_advanced_group.add_argument(
+        "--per-kernel-keys",
+        dest="per_kernel_keys",
+        metavar="",
+        nargs="+",
+        choices=["GPU_ID", "Node"],
+        default=[],
+        help="\t\tSplit the --per-kernel table by these keys too: GPU_ID, Node.",
+    )
+    analyze_advanced_group.add_argument(
+        "--stream",
+        metavar="",
+        type=int,
+        nargs="?",
+        const=10000,
+        default=None,
+        dest="stream",
+        help="\t\tEvaluate metrics from chunks of N dispatches (DEFAULT: 10000), in memory\n\t\tbounded by N. Medians and quantiles over more than 8192 dispatches are\n\t\tapproximate.",
+    )
+    analyze_advanced_group.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="\t\tDerive all metrics from raw data and configs, without reading or writing\n\t\tthe user's derived metrics and config caches.",
+    )
     analyze_advanced_group.add_argument(
         "--cols",
         type=int,
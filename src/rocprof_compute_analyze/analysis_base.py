@@ -29,11 +29,14 @@ from abc import ABC, abstractmethod
 from collections import OrderedDict
 from pathlib import Path
 
-from utils import file_io, parser, schema
+import pandas as pd
+
+from utils import analysis_cache, file_io, parser, schema
 from utils.utils import (
     console_debug,
     console_error,
     console_log,
+    console_warning,
     demarcate,
     is_workload_empty,
 )
@@ -64,18 +67,29 @@ class OmniAnalyze_Base:
         )
 
         ac = schema.ArchConfig()
+        cache_key = None
         if list_stats:
             ac.panel_configs = file_io.top_stats_build_in_config
         else:
             arch_panel_config = (
                 config_dir if single_panel_config else config_dir.joinpath(arch)
             )
+            if not self.__args.no_cache:
+                cache_key = analysis_cache.get_config_cache_key(
+                    arch_panel_config, filter_metrics, sys_info
+                )
+                cached_ac = analysis_cache.load_arch_config(cache_key)
+                if cached_ac is not None:
+                    self._arch_configs[arch] = cached_ac
+                    return self._arch_configs
             ac.panel_configs = file_io.load_panel_configs(arch_panel_config)
 
         # TODO: filter_metrics should/might be one per arch
         # print(ac)
 
         parser.build_dfs(archConfigs=ac, filter_metrics=filter_metrics, sys_info=sys_info)
+        if cache_key:
+            analysis_cache.save_arch_config(cache_key, ac)
         self._arch_configs[arch] = ac
         return self._arch_configs
 
@@ -110,7 +124,12 @@ class OmniAnalyze_Base:
             console_error("Unsupported arch")
 
     @demarcate
-    def load_options(self, normalization_filter):
+    def load_options(self, normalization_filter, all_normal_units=False):
+        if all_normal_units:
+            # NB: from the templates, before resolving the default unit below
+            for k, v in self._arch_configs.items():
+                v.norm_dfs = parser.build_norm_dfs(v.dfs, v.dfs_type)
+
         if not normalization_filter:
             for k, v in self._arch_configs.items():
                 parser.build_metric_value_string(
@@ -133,7 +152,7 @@ class OmniAnalyze_Base:
                 )
 
     @demarcate
-    def initalize_runs(self, normalization_filter=None):
+    def initalize_runs(self, normalization_filter=None, all_normal_units=False):
         if self.__args.list_metrics:
             self.list_metrics()
 
@@ -155,7 +174,7 @@ class OmniAnalyze_Base:
                 sys_info.iloc[0],
             )
 
-        self.load_options(normalization_filter)
+        self.load_options(normalization_filter, all_normal_units)
 
         for d in self.__args.path:
             w = schema.Workload()
@@ -174,8 +193,17 @@ class OmniAnalyze_Base:
             if self.__args.specs_correction:
                 w.sys_info = parser.correct_sys_info(mspec, self.__args.specs_correction)
             w.avail_ips = w.sys_info["ip_blocks"].item().split("|")
+            # Workloads profiled with -b metric ids only have their counters
+            filter_metrics = w.sys_info.iloc[0].get("filter_metrics")
+            if pd.notna(filter_metrics):
+                console_warning(
+                    "analysis",
+                    "{} was profiled for metrics {} only, the other metrics have "
+                    "no data".format(d[0], str(filter_metrics).replace("|", ", ")),
+                )
             w.dfs = copy.deepcopy(self._arch_configs[arch].dfs)
             w.dfs_type = self._arch_configs[arch].dfs_type
+            w.norm_dfs = copy.deepcopy(self._arch_configs[arch].norm_dfs)
             self._runs[d[0]] = w
 
         return self._runs
@@ -224,9 +252,8 @@ class OmniAnalyze_Base:
             #   sub dirs only as we assume the profiling stage generate sub dirs
             #   with node name. The 2nd way would be checkign host name in each
             #   sub dir and very those.
-            for subdir in Path(self.__args.path[0][0]).iterdir():
-                if subdir.is_dir():
-                    nodes.append(str(subdir.name))
+            for subdir in file_io.list_node_dirs(self.__args.path[0][0]):
+                nodes.append(str(subdir.name))
             print("Node list:", "  ".join(nodes))
             sys.exit(0)
 
@@ -22,9 +22,21 @@
 # SOFTWARE.
 ##############################################################################el
 
+import functools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 from rocprof_compute_analyze.analysis_base import OmniAnalyze_Base
-from utils import file_io, parser, tty
-from utils.kernel_name_shortener import kernel_name_shortener
+from utils import (
+    analysis_cache,
+    file_io,
+    filter_index,
+    kernel_name_shortener,
+    manifest,
+    parser,
+    tty,
+)
 from utils.utils import console_error, demarcate
 
 
@@ -38,40 +50,46 @@ class cli_analysis(OmniAnalyze_Base):
         super().pre_processing()
         if self.get_args().random_port:
             console_error("--gui flag is required to enable --random-port")
-        for d in self.get_args().path:
-
-            # create 'mega dataframe'
-            self._runs[d[0]].raw_pmc = file_io.create_df_pmc(
-                d[0],
-                self.get_args().nodes,
-                self.get_args().kernel_verbose,
-                self.get_args().verbose,
-            )
-
-            file_io.create_df_kernel_top_stats(
-                df_in=self._runs[d[0]].raw_pmc,
-                raw_data_dir=d[0],
-                filter_gpu_ids=self._runs[d[0]].filter_gpu_ids,
-                filter_dispatch_ids=self._runs[d[0]].filter_dispatch_ids,
-                filter_nodes=self._runs[d[0]].filter_nodes,
-                time_unit=self.get_args().time_unit,
-                max_stat_num=self.get_args().max_stat_num,
-                kernel_verbose=self.get_args().kernel_verbose,
-            )
-
-            # demangle and overwrite original 'Kernel_Name'
-            kernel_name_shortener(
-                self._runs[d[0]].raw_pmc, self.get_args().kernel_verbose
-            )
-
-            # create the loaded table
-            parser.load_table_data(
-                workload=self._runs[d[0]],
-                dir=d[0],
-                is_gui=False,
-                debug=self.get_args().debug,
-                verbose=self.get_args().verbose,
-            )
+        for option in ["per_dispatch", "per_kernel"]:
+            if getattr(self.get_args(), option) and len(self.get_args().path) > 1:
+                console_error(
+                    "--{} supports a single workload path".format(
+                        option.replace("_", "-")
+                    )
+                )
+        if self.get_args().stream:
+            for option in ["per_dispatch", "per_kernel", "debug"]:
+                if getattr(self.get_args(), option):
+                    console_error(
+                        "--stream does not support --{}".format(option.replace("_", "-"))
+                    )
+        dirs = [d[0] for d in self.get_args().path]
+        # NB:
+        #   Workloads of a comparison are prepared in worker processes, as the
+        #   loading and the metric evaluation are mostly CPU bound. Only the
+        #   derived tables are shipped back, not the raw pmc df. -g prints
+        #   while evaluating, so it stays serial. The pmc file reader threads
+        #   are split among the workers, not to oversubscribe the cores.
+        workers = min(len(dirs), os.cpu_count() or 1)
+        if workers > 1 and not self.get_args().debug:
+            # NB: fork, so workers need not re-import the rocprof-compute script
+            with ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("fork")
+            ) as pool:
+                runs = list(
+                    pool.map(
+                        prepare_run_in_worker,
+                        [self.get_args()] * len(dirs),
+                        dirs,
+                        [self._runs[dir] for dir in dirs],
+                        [max(1, file_io.pmc_read_workers // workers)] * len(dirs),
+                    )
+                )
+            for dir, workload in zip(dirs, runs):
+                self._runs[dir] = workload
+        else:
+            for dir in dirs:
+                self._runs[dir] = prepare_run(self.get_args(), dir, self._runs[dir])
 
     @demarcate
     def run_analysis(self):
@@ -95,3 +113,123 @@ class cli_analysis(OmniAnalyze_Base):
                 ],
                 self._output,
             )
+
+
+@demarcate
+def prepare_run(args, dir, workload):
+    """
+    Load the raw data of one workload and derive its tables: kernel top
+    stats, filters and metric tables, or take them from the analysis cache.
+    Return the workload.
+    """
+    # NB: --list-stats only lists kernels and dispatches, which a fresh
+    #     manifest holds, without reading the raw data
+    if (
+        args.list_stats
+        and args.nodes is None
+        and not workload.filter_gpu_ids
+        and not workload.filter_dispatch_ids
+    ):
+        pmc_manifest = manifest.load_manifest(dir)
+        top_stats = (
+            file_io.create_kernel_top_stats_from_manifest(
+                pmc_manifest,
+                args.time_unit,
+                args.kernel_verbose,
+            )
+            if pmc_manifest is not None
+            else None
+        )
+        if top_stats is not None:
+            workload.top_stats = top_stats
+            parser.load_kernel_top(workload, dir)
+            return workload
+
+    # NB:
+    #   -g prints while evaluating, and --per-dispatch/--per-kernel
+    #   need raw data, so they always derive metrics
+    cache_keys = None
+    if not (args.no_cache or args.debug or args.per_dispatch or args.per_kernel):
+        dfs, cache_keys = analysis_cache.load_dfs(dir, args, workload)
+        if dfs is not None:
+            workload.dfs = dfs
+            return workload
+
+    # NB: with filtered metrics, only load the counters they need. With
+    #     --stream, only load the key columns for kernel top stats and
+    #     filters, and stream the counters from the files later.
+    usecols = (
+        parser.build_pmc_usecols(workload.dfs, workload.dfs_type)
+        if args.filter_metrics
+        else None
+    )
+    stream_chunks = None
+    if args.stream:
+        usecols = {}
+        stream_chunks = functools.partial(
+            file_io.iter_df_pmc_chunks,
+            dir,
+            args.nodes,
+            args.kernel_verbose,
+            args.stream,
+        )
+
+    # create 'mega dataframe'
+    workload.raw_pmc = file_io.create_df_pmc(
+        dir,
+        args.nodes,
+        args.kernel_verbose,
+        args.verbose,
+        usecols,
+    )
+
+    workload.top_stats = file_io.create_df_kernel_top_stats(
+        df_in=workload.raw_pmc,
+        filter_gpu_ids=workload.filter_gpu_ids,
+        filter_dispatch_ids=workload.filter_dispatch_ids,
+        filter_nodes=workload.filter_nodes,
+        time_unit=args.time_unit,
+        max_stat_num=args.max_stat_num,
+        kernel_verbose=args.kernel_verbose,
+        filter_index=filter_index.get_filter_index(workload),
+    )
+
+    # demangle and overwrite original 'Kernel_Name'
+    kernel_name_shortener.kernel_name_shortener(workload.raw_pmc, args.kernel_verbose)
+
+    # create the loaded table
+    parser.load_table_data(
+        workload=workload,
+        dir=dir,
+        is_gui=False,
+        debug=args.debug,
+        verbose=args.verbose,
+        per_dispatch=bool(args.per_dispatch),
+        per_kernel_keys=(
+            ["Kernel_Name"] + args.per_kernel_keys if args.per_kernel else None
+        ),
+        stream_chunks=stream_chunks,
+    )
+
+    if args.per_dispatch:
+        file_io.save_per_dispatch(workload.per_dispatch, args.per_dispatch)
+    if args.per_kernel:
+        file_io.save_per_kernel(workload.per_kernel, args.per_kernel)
+
+    if cache_keys:
+        analysis_cache.save_dfs(cache_keys, workload.dfs)
+    return workload
+
+
+def prepare_run_in_worker(args, dir, workload, read_workers):
+    """
+    prepare_run() in a worker process, reading pmc files with at most
+    read_workers threads. Return the workload without its raw pmc df.
+    """
+    # NB: each forked worker has its own copy of file_io
+    file_io.pmc_read_workers = read_workers
+    workload = prepare_run(args, dir, workload)
+    kernel_name_shortener.save_disk_cache()
+    workload.raw_pmc = None
+    workload.filter_index = None
+    return workload
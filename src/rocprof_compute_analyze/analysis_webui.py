@@ -32,7 +32,7 @@ from dash import dcc, html
 from dash.dependencies import Input, Output, State
 
 from rocprof_compute_analyze.analysis_base import OmniAnalyze_Base
-from utils import file_io, parser
+from utils import file_io, filter_index, manifest, parser
 from utils.gui import build_bar_chart, build_table_chart
 from utils.utils import console_debug, console_error, demarcate
 
@@ -81,7 +81,16 @@ class webui_analysis(OmniAnalyze_Base):
             children=[
                 dbc.Spinner(
                     children=[
-                        get_header(base_data.raw_pmc, input_filters, filt_kernel_names),
+                        get_header(
+                            base_data.raw_pmc,
+                            input_filters,
+                            filt_kernel_names,
+                            (
+                                manifest.load_manifest(self.dest_dir)
+                                if self.get_args().nodes is None
+                                else None
+                            ),
+                        ),
                         html.Div(id="container", children=[]),
                     ],
                     fullscreen=True,
@@ -91,22 +100,13 @@ class webui_analysis(OmniAnalyze_Base):
             ]
         )
 
-        @self.app.callback(
-            Output("container", "children"),
-            [Input("disp-filt", "value")],
-            [Input("kernel-filt", "value")],
-            [Input("gcd-filt", "value")],
-            [Input("norm-filt", "value")],
-            [Input("top-n-filt", "value")],
-            [State("container", "children")],
-        )
-        def generate_from_filter(
-            disp_filt, kernel_filter, gcd_filter, norm_filt, top_n_filt, div_children
-        ):
-            console_debug("analysis", "gui normalization is %s" % norm_filt)
+        # The runs and panels loaded for the last filters
+        loaded = {}
 
-            base_data = self.initalize_runs()  # Re-initalizes everything
-            hbm_bw = base_data[base_run].sys_info["hbm_bw"][0]
+        def load_filtered_runs(disp_filt, kernel_filter, gcd_filter, top_n_filt):
+            # Re-initalizes everything. The metric tables of all normalization
+            # units are evaluated in one pass, so switching unit is a lookup.
+            base_data = self.initalize_runs(all_normal_units=True)
             panel_configs = copy.deepcopy(arch_configs.panel_configs)
             # Generate original raw df
             base_data[base_run].raw_pmc = file_io.create_df_pmc(
@@ -124,15 +124,16 @@ class webui_analysis(OmniAnalyze_Base):
             base_data[base_run].filter_dispatch_ids = disp_filt
             base_data[base_run].filter_top_n = top_n_filt
 
-            # Reload the pmc_kernel_top.csv for Top Stats panel
-            file_io.create_df_kernel_top_stats(
-                raw_data_dir=str(self.dest_dir),
+            # Rebuild the pmc_kernel_top.csv table for Top Stats panel
+            base_data[base_run].top_stats = file_io.create_df_kernel_top_stats(
+                df_in=base_data[base_run].raw_pmc,
                 filter_gpu_ids=base_data[base_run].filter_gpu_ids,
                 filter_dispatch_ids=base_data[base_run].filter_dispatch_ids,
-                filter_nodes=self._runs[d[0]].filter_nodes,
+                filter_nodes=base_data[base_run].filter_nodes,
                 time_unit=self.get_args().time_unit,
                 max_stat_num=base_data[base_run].filter_top_n,
                 kernel_verbose=self.get_args().kernel_verbose,
+                filter_index=filter_index.get_filter_index(base_data[base_run]),
             )
             # Only display basic metrics if no filters are applied
             if not (disp_filt or kernel_filter or gcd_filter):
@@ -143,6 +144,10 @@ class webui_analysis(OmniAnalyze_Base):
                         temp[key] = base_data[base_run].dfs[key]
 
                 base_data[base_run].dfs = temp
+                for unit_dfs in base_data[base_run].norm_dfs.values():
+                    for key in list(unit_dfs):
+                        if keep.count(key) == 0:
+                            del unit_dfs[key]
                 temp = {}
                 keep = [0, 100, 200, 300, 400]
                 for key in panel_configs:
@@ -157,6 +162,31 @@ class webui_analysis(OmniAnalyze_Base):
                 debug=self.get_args().debug,
                 verbose=self.get_args().verbose,
             )
+            return base_data, panel_configs
+
+        @self.app.callback(
+            Output("container", "children"),
+            [Input("disp-filt", "value")],
+            [Input("kernel-filt", "value")],
+            [Input("gcd-filt", "value")],
+            [Input("norm-filt", "value")],
+            [Input("top-n-filt", "value")],
+            [State("container", "children")],
+        )
+        def generate_from_filter(
+            disp_filt, kernel_filter, gcd_filter, norm_filt, top_n_filt, div_children
+        ):
+            console_debug("analysis", "gui normalization is %s" % norm_filt)
+
+            # NB: only reload when a filter other than normalization changes
+            filters = str([disp_filt, kernel_filter, gcd_filter, top_n_filt])
+            if loaded.get("filters") != filters:
+                loaded["runs"], loaded["panel_configs"] = load_filtered_runs(
+                    disp_filt, kernel_filter, gcd_filter, top_n_filt
+                )
+                loaded["filters"] = filters
+            base_data, panel_configs = loaded["runs"], loaded["panel_configs"]
+            parser.select_normal_unit(base_data[base_run], norm_filt)
 
             # ~~~~~~~~~~~~~~~~~~~~~~~
             # Generate GUI content
@@ -212,7 +242,7 @@ class webui_analysis(OmniAnalyze_Base):
                             original_df = base_data[base_run].dfs[table_config["id"]]
                             # The sys info table need to add index back
                             if t_type == "raw_csv_table" and "Info" in original_df.keys():
-                                original_df.reset_index(inplace=True)
+                                original_df = original_df.reset_index()
 
                             content = determine_chart_type(
                                 original_df=original_df,
@@ -280,15 +310,6 @@ class webui_analysis(OmniAnalyze_Base):
         super().pre_processing()
         if len(self._runs) == 1:
             args = self.get_args()
-            file_io.create_df_kernel_top_stats(
-                raw_data_dir=self.dest_dir,
-                filter_gpu_ids=self._runs[self.dest_dir].filter_gpu_ids,
-                filter_dispatch_ids=self._runs[self.dest_dir].filter_dispatch_ids,
-                filter_nodes=self._runs[d[0]].filter_nodes,
-                time_unit=args.time_unit,
-                max_stat_num=args.max_stat_num,
-                kernel_verbose=self.get_args().kernel_verbose,
-            )
             # create 'mega dataframe'
             self._runs[self.dest_dir].raw_pmc = file_io.create_df_pmc(
                 self.dest_dir,
@@ -296,6 +317,16 @@ class webui_analysis(OmniAnalyze_Base):
                 self.get_args().kernel_verbose,
                 args.verbose,
             )
+            self._runs[self.dest_dir].top_stats = file_io.create_df_kernel_top_stats(
+                df_in=self._runs[self.dest_dir].raw_pmc,
+                filter_gpu_ids=self._runs[self.dest_dir].filter_gpu_ids,
+                filter_dispatch_ids=self._runs[self.dest_dir].filter_dispatch_ids,
+                filter_nodes=self._runs[self.dest_dir].filter_nodes,
+                time_unit=args.time_unit,
+                max_stat_num=args.max_stat_num,
+                kernel_verbose=self.get_args().kernel_verbose,
+                filter_index=filter_index.get_filter_index(self._runs[self.dest_dir]),
+            )
             # create the loaded kernel stats
             parser.load_kernel_top(self._runs[self.dest_dir], self.dest_dir)
             # set architecture
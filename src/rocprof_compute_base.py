@@ -36,7 +36,7 @@ import pandas as pd
 
 import config
 from argparser import omniarg_parser
-from utils import file_io
+from utils import file_io, kernel_name_shortener
 from utils.logger import (
     setup_console_handler,
     setup_file_handler,
@@ -47,6 +47,7 @@ from utils.utils import (
     console_debug,
     console_error,
     console_log,
+    console_warning,
     demarcate,
     detect_rocprof,
     get_submodules,
@@ -209,6 +210,19 @@ class RocProfCompute:
             elif self.__args.subpath == "gpu_model":
                 self.__args.path = os.path.join(self.__args.path, self.__mspec.gpu_model)
 
+            # -b takes metric ids too, which select counters instead of blocks
+            self.__args.filter_metrics = None
+            if self.__args.ipblocks:
+                metrics = [b for b in self.__args.ipblocks if b[0].isdigit()]
+                blocks = [b for b in self.__args.ipblocks if not b[0].isdigit()]
+                self.__args.filter_metrics = metrics or None
+                self.__args.ipblocks = blocks or None
+
+            # NB: spatial multiplexing pins the counters of each pass to devices
+            #     itself, so its passes can not be pinned to --gpus
+            if self.__args.gpus and self.__args.spatial_multiplexing:
+                console_error("--gpus can not be used with --spatial-multiplexing")
+
             p = Path(self.__args.path)
             if not p.exists():
                 try:
@@ -232,6 +246,11 @@ class RocProfCompute:
                 self.__args.path, self.__args.name, self.__mspec.gpu_model
             )
 
+        # NB: --plan only buckets the counters, so nothing is profiled
+        if self.__args.plan:
+            self.__soc[self.__mspec.gpu_arch].perfmon_plan(self.__args.roof_only)
+            return
+
         # instantiate desired profiler
         if self.__profiler_mode == "rocprofv1":
             from rocprof_compute_profile.profiler_rocprof_v1 import rocprof_v1_profiler
@@ -280,6 +299,7 @@ class RocProfCompute:
             )
         )
         profiler.post_processing()
+        profiler.index_workload()
         time_end_post = time.time()
         console_debug(
             'time taken for "post_processing" was {} seconds'.format(
@@ -309,6 +329,23 @@ class RocProfCompute:
 
         return
 
+    @demarcate
+    def convert_workloads(self):
+        for dir in self.__args.path:
+            if not Path(dir).is_dir():
+                console_error("convert", "Invalid directory {}".format(dir))
+            count = file_io.save_workload_manifests(dir)
+            console_log("convert", "wrote {} manifests under {}".format(count, dir))
+            if not file_io.has_columnar_support():
+                console_warning(
+                    "convert", "pyarrow is not installed, skip the columnar copies"
+                )
+                continue
+            count = file_io.convert_workload_dir(dir)
+            console_log("convert", "wrote {} columnar copies under {}".format(count, dir))
+
+        return
+
     @demarcate
     def run_analysis(self):
         self.print_graphic()
@@ -348,6 +385,9 @@ class RocProfCompute:
 
         analyzer.set_soc(self.__soc)
         analyzer.pre_processing()
+        # NB: before run_analysis(), as the web UI never returns from it
+        kernel_name_shortener.save_disk_cache()
         analyzer.run_analysis()
+        kernel_name_shortener.save_disk_cache()
 
         return
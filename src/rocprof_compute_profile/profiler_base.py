@@ -25,15 +25,19 @@
 import glob
 import logging
 import os
+import queue
 import re
+import shutil
 import sys
 import time
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import pandas as pd
 from tqdm import tqdm
 
 import config
+from utils import file_io, manifest, session
 from utils.utils import (
     capture_subprocess_output,
     console_debug,
@@ -43,6 +47,7 @@ from utils.utils import (
     demarcate,
     gen_sysinfo,
     print_status,
+    process_prof_output,
     run_prof,
     run_rocscope,
 )
@@ -72,8 +77,14 @@ class RocProfCompute_Base:
         if type(self.__args.path) == str:
             if out is None:
                 out = self.__args.path + "/pmc_perf.csv"
-            files = glob.glob(self.__args.path + "/" + "pmc_perf_*.csv")
-            files.extend(glob.glob(self.__args.path + "/" + "SQ_*.csv"))
+            # NB: only the outputs of the current perfmon files, not those a
+            #     resumed session kept from other passes
+            files = [
+                session.get_pass_output(self.__args.path, fname)
+                for pattern in ["pmc_perf_*.txt", "SQ_*.txt"]
+                for fname in glob.glob(self.__args.path + "/perfmon/" + pattern)
+            ]
+            files = [f for f in files if os.path.isfile(f)]
         elif type(self.__args.path) == list:
             files = self.__args.path
         else:
@@ -133,6 +144,10 @@ class RocProfCompute_Base:
             duplicate_cols["Accum_VGPR"] = [
                 col for col in df.columns if col.startswith("Accum_VGPR")
             ]
+        # NB: Passes pinned to different --gpus report different GPU_IDs, the
+        #     one of the first pass is kept
+        if self.__args.gpus:
+            del duplicate_cols["GPU_ID"]
         for key, cols in duplicate_cols.items():
             _df = df[cols]
             if not test_df_column_equality(_df):
@@ -316,7 +331,22 @@ class RocProfCompute_Base:
         input_files = glob.glob(self.get_args().path + "/perfmon/*.txt")
         input_files.sort()
 
-        for fname in tqdm(input_files, disable=disable_tqdm):
+        # Journal each pass, so an interrupted session can be resumed
+        profile_session = session.start_session(
+            self.get_args().path,
+            session.get_session_key(self.__args, self.__profiler, self._soc._mspec),
+            self.__args.resume,
+        )
+
+        # Perfmon files of the passes to run concurrently, with their checksum
+        checksums = {}
+        # With --pipeline, the rocprof results of a pass are processed by a
+        # worker while the app is profiled for the next passes
+        pipeline = None
+        if self.__args.pipeline and not self.__args.gpus:
+            pipeline = ThreadPoolExecutor(max_workers=1)
+        pending_passes = []
+        for fname in tqdm(input_files, disable=disable_tqdm or bool(self.__args.gpus)):
             # Kernel filtering (in-place replacement)
             if not self.__args.kernel == None:
                 success, output = capture_subprocess_output(
@@ -356,40 +386,179 @@ class RocProfCompute_Base:
                     console_error(output)
                 else:
                     console_debug(output)
-            console_log("profiling", "Current input file: %s" % fname)
 
-            # Fetch any SoC/profiler specific profiling options
-            options = self._soc.get_profiler_options()
-            options += self.get_profiler_options(fname)
+            # Skip the passes the resumed session already profiled
+            checksum = manifest.get_file_checksum(fname)
+            if session.is_pass_done(
+                profile_session, self.get_args().path, fname, checksum
+            ):
+                console_log("profiling", "Skipping profiled input file: %s" % fname)
+                continue
+
             if (
                 self.__profiler == "rocprofv1"
                 or self.__profiler == "rocprofv2"
                 or self.__profiler == "rocprofv3"
             ):
-                start_run_prof = time.time()
-                run_prof(
-                    fname=fname,
-                    profiler_options=options,
-                    workload_dir=self.get_args().path,
-                    mspec=self._soc._mspec,
-                    loglevel=self.get_args().loglevel,
-                    format_rocprof_output=self.get_args().format_rocprof_output,
-                )
-                end_run_prof = time.time()
-                console_debug(
-                    "The time of run_prof of {} is {} m {} sec".format(
-                        fname,
-                        int((end_run_prof - start_run_prof) / 60),
-                        str((end_run_prof - start_run_prof) % 60),
+                if self.__args.gpus:
+                    if os.path.basename(fname) != "timestamps.txt":
+                        # Run below, concurrently with the other passes
+                        checksums[fname] = checksum
+                        continue
+                    # NB: the timestamps pass runs alone on the first gpu, so
+                    #     the kernel durations are not skewed by other passes
+                    console_log("profiling", "Current input file: %s" % fname)
+                    self.run_pass(fname, self.__args.gpus[0])
+                    session.record_pass(
+                        profile_session, self.get_args().path, fname, checksum
+                    )
+                    continue
+                console_log("profiling", "Current input file: %s" % fname)
+                if pipeline:
+                    self.run_pass(fname, process_output=False)
+                    pending_passes.append(
+                        (fname, checksum, pipeline.submit(self.process_pass, fname))
                     )
+                    pending_passes = self.record_passes(
+                        pending_passes, profile_session, wait=False
+                    )
+                    continue
+                self.run_pass(fname)
+                session.record_pass(
+                    profile_session, self.get_args().path, fname, checksum
                 )
 
             elif self.__profiler == "rocscope":
+                console_log("profiling", "Current input file: %s" % fname)
                 run_rocscope(self.__args, fname)
             else:
                 # TODO: Finish logic
                 console_error("Profiler not supported")
 
+        if checksums:
+            self.run_concurrent_passes(checksums, profile_session, disable_tqdm)
+        if pipeline:
+            try:
+                self.record_passes(pending_passes, profile_session, wait=True)
+            finally:
+                pipeline.shutdown(wait=True)
+            shutil.rmtree(self.get_args().path + "/out", ignore_errors=True)
+
+    def get_pass_out_dir(self, fname):
+        """
+        Return the rocprof output dir of a pass, one per pass with --gpus or
+        --pipeline
+        """
+        out_dir = self.get_args().path + "/out"
+        if self.__args.gpus or self.__args.pipeline:
+            out_dir += "/" + os.path.splitext(os.path.basename(fname))[0]
+        return out_dir
+
+    def process_pass(self, fname):
+        """Write the output csv of a pass from its rocprof results"""
+        start_process = time.time()
+        process_prof_output(
+            fname=fname,
+            workload_dir=self.get_args().path,
+            mspec=self._soc._mspec,
+            format_rocprof_output=self.get_args().format_rocprof_output,
+            out_dir=self.get_pass_out_dir(fname),
+        )
+        end_process = time.time()
+        console_debug(
+            "The time of process_prof_output of {} is {} m {} sec".format(
+                fname,
+                int((end_process - start_process) / 60),
+                str((end_process - start_process) % 60),
+            )
+        )
+
+    def record_passes(self, pending_passes, profile_session, wait):
+        """
+        Journal the pipelined passes whose output is written, all of them once
+        written if wait. Return the passes still pending.
+        """
+        still_pending = []
+        for fname, checksum, future in pending_passes:
+            if not wait and not future.done():
+                still_pending.append((fname, checksum, future))
+                continue
+            # Raises the error of the pass, if any
+            future.result()
+            session.record_pass(profile_session, self.get_args().path, fname, checksum)
+        return still_pending
+
+    def run_pass(self, fname, gpu=None, process_output=True):
+        """
+        Profile the app for one perfmon file, pinned to gpu if given. Without
+        process_output, the rocprof results are left for process_pass.
+        """
+        # Fetch any SoC/profiler specific profiling options
+        options = self._soc.get_profiler_options()
+        options += self.get_profiler_options(fname)
+
+        start_run_prof = time.time()
+        run_prof(
+            fname=fname,
+            profiler_options=options,
+            workload_dir=self.get_args().path,
+            mspec=self._soc._mspec,
+            loglevel=self.get_args().loglevel,
+            format_rocprof_output=self.get_args().format_rocprof_output,
+            out_dir=self.get_pass_out_dir(fname),
+            env=None if gpu is None else {"ROCR_VISIBLE_DEVICES": gpu},
+            process_output=process_output,
+        )
+        end_run_prof = time.time()
+        console_debug(
+            "The time of run_prof of {} is {} m {} sec".format(
+                fname,
+                int((end_run_prof - start_run_prof) / 60),
+                str((end_run_prof - start_run_prof) % 60),
+            )
+        )
+
+    def run_concurrent_passes(self, checksums, profile_session, disable_tqdm):
+        """
+        Run the passes of the perfmon files in checksums at the same time, one
+        per gpu of --gpus. Each pass sees only its gpu, and writes to its own
+        rocprof output dir.
+        """
+        # NB: The counters of one dispatch then come from runs on different
+        #     gpus, which is only sound for deterministic applications
+        free_gpus = queue.Queue()
+        for gpu in self.__args.gpus:
+            free_gpus.put(gpu)
+
+        def run_pass_on_free_gpu(fname):
+            gpu = free_gpus.get()
+            try:
+                console_log("profiling", "Current input file: %s (gpu %s)" % (fname, gpu))
+                self.run_pass(fname, gpu)
+            finally:
+                free_gpus.put(gpu)
+            return fname
+
+        executor = ThreadPoolExecutor(max_workers=len(self.__args.gpus))
+        futures = [executor.submit(run_pass_on_free_gpu, f) for f in checksums]
+        try:
+            for future in tqdm(
+                as_completed(futures), total=len(futures), disable=disable_tqdm
+            ):
+                fname = future.result()
+                session.record_pass(
+                    profile_session, self.get_args().path, fname, checksums[fname]
+                )
+        except BaseException:
+            # Let the passes that are running finish, but start no other one
+            for future in futures:
+                future.cancel()
+            raise
+        finally:
+            executor.shutdown(wait=True)
+
+        shutil.rmtree(self.get_args().path + "/out", ignore_errors=True)
+
     @abstractmethod
     def post_processing(self):
         """Perform any post-processing steps prior to profiling."""
@@ -407,8 +576,27 @@ class RocProfCompute_Base:
             roof_only=self.__args.roof_only,
             mspec=self._soc._mspec,
             soc=self._soc,
+            filter_metrics=self.__args.filter_metrics,
         )
 
+    def index_workload(self):
+        """
+        Write the manifest of the raw pmc csv files, and their columnar copies
+        with --columnar, once the passes are joined into pmc_perf.csv.
+        """
+        if not os.path.isfile(os.path.join(self.get_args().path, "pmc_perf.csv")):
+            return
+        manifest.save_manifest(self.get_args().path)
+
+        if self.__args.columnar:
+            if file_io.has_columnar_support():
+                count = file_io.convert_workload_dir(self.get_args().path)
+                console_log("profiling", "wrote %s columnar copies" % count)
+            else:
+                console_warning(
+                    "profiling", "pyarrow is not installed, skip --columnar copies"
+                )
+
 
 def test_df_column_equality(df):
     return df.eq(df.iloc[:, 0], axis=0).all(1).all()
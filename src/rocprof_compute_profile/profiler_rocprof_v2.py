@@ -44,7 +44,7 @@ class rocprof_v2_profiler(RocProfCompute_Base):
         args = [
             # v2 requires output directory argument
             "-d",
-            self.get_args().path + "/" + "out",
+            self.get_pass_out_dir(fname),
         ]
         args.extend(app_cmd)
         return args
@@ -46,7 +46,7 @@ class rocprof_v3_profiler(RocProfCompute_Base):
         args = [
             # v3 requires output directory argument
             "-d",
-            self.get_args().path + "/" + "out",
+            self.get_pass_out_dir(fname),
             "--kernel-trace",
             "--output-format",
             rocprof_out_format,
@@ -32,9 +32,17 @@ from collections import OrderedDict
 from pathlib import Path
 
 import numpy as np
+import pandas as pd
 
+import config
 from rocprof_compute_base import MI300_CHIP_IDS, SUPPORTED_ARCHS
-from utils.utils import console_debug, console_error, console_log, demarcate
+from utils import file_io, parser, schema, session
+from utils.utils import (
+    console_debug,
+    console_error,
+    console_log,
+    demarcate,
+)
 
 
 class OmniSoC_Base:
@@ -74,6 +82,9 @@ class OmniSoC_Base:
     def set_perfmon_config(self, config: dict):
         self.__perfmon_config = config
 
+    def get_perfmon_config(self):
+        return self.__perfmon_config
+
     def get_workload_perfmon_dir(self):
         return str(Path(self.__perfmon_dir).parent.absolute())
 
@@ -202,6 +213,10 @@ class OmniSoC_Base:
         # Initialize directories
         if not os.path.isdir(self.__workload_dir):
             os.makedirs(self.__workload_dir)
+        elif self.get_args().resume and session.load_session(self.__workload_dir):
+            # Keep the passes profiled so far, only the perfmon files are rewritten.
+            # Without a journal, the outputs are cleared as in a fresh run.
+            shutil.rmtree(workload_perfmon_dir, ignore_errors=True)
         elif not os.path.islink(self.__workload_dir):
             shutil.rmtree(self.__workload_dir)
         else:
@@ -209,6 +224,20 @@ class OmniSoC_Base:
 
         os.makedirs(workload_perfmon_dir)
 
+        # Coalesce and writeback workload specific perfmon
+        accumulate_counters, normal_counters = self.get_perfmon_counters(
+            roofline_perfmon_only
+        )
+        perfmon_coalesce(
+            accumulate_counters,
+            normal_counters,
+            self.__perfmon_config,
+            self.__workload_dir,
+            self.get_args().spatial_multiplexing,
+        )
+
+    def get_pmc_files_list(self, roofline_perfmon_only: bool, ipblocks: list):
+        """Return the perfmon files of the counters to profile"""
         if not roofline_perfmon_only:
             ref_pmc_files_list = glob.glob(self.__perfmon_dir + "/" + "pmc_*perf*.txt")
             ref_pmc_files_list += glob.glob(
@@ -216,16 +245,16 @@ class OmniSoC_Base:
             )
 
             # Perfmon list filtering
-            if self.__args.ipblocks != None:
-                for i in range(len(self.__args.ipblocks)):
-                    self.__args.ipblocks[i] = self.__args.ipblocks[i].lower()
+            if ipblocks != None:
+                for i in range(len(ipblocks)):
+                    ipblocks[i] = ipblocks[i].lower()
                 mpattern = "pmc_([a-zA-Z0-9_]+)_perf*"
 
                 pmc_files_list = []
                 for fname in ref_pmc_files_list:
                     fbase = os.path.splitext(os.path.basename(fname))[0]
                     ip = re.match(mpattern, fbase).group(1)
-                    if ip in self.__args.ipblocks:
+                    if ip in ipblocks:
                         pmc_files_list.append(fname)
                         console_log("fname: " + fbase + ": Added")
                     else:
@@ -237,15 +266,74 @@ class OmniSoC_Base:
         else:
             ref_pmc_files_list = glob.glob(self.__perfmon_dir + "/" + "pmc_roof_perf.txt")
             pmc_files_list = ref_pmc_files_list
+        return pmc_files_list
+
+    def get_metric_counters(self):
+        """Return the counters and collection levels of the metrics of -b"""
+        ac = schema.ArchConfig()
+        ac.panel_configs = file_io.load_panel_configs(
+            config.rocprof_compute_home.joinpath(
+                "rocprof_compute_soc", "analysis_configs", self.__arch
+            )
+        )
+        # NB: Only the per L2 channel tables need sys_info, for their row count
+        sys_info = pd.Series({"total_l2_chan": int(self._mspec.total_l2_chan)})
+        parser.build_dfs(
+            archConfigs=ac, filter_metrics=self.__args.filter_metrics, sys_info=sys_info
+        )
+        return parser.get_metric_counters(ac)
 
-        # Coalesce and writeback workload specific perfmon
-        perfmon_coalesce(
-            pmc_files_list,
-            self.__perfmon_config,
-            self.__workload_dir,
-            self.get_args().spatial_multiplexing,
+    def get_perfmon_counters(self, roofline_perfmon_only: bool):
+        """Return the accumulate counter lines and the normal counters to profile"""
+        if roofline_perfmon_only or not self.__args.filter_metrics:
+            return read_perfmon_counters(
+                self.get_pmc_files_list(roofline_perfmon_only, self.__args.ipblocks)
+            )
+
+        # Metric ids in -b select the counters their metrics need, from all
+        # perfmon files. Hardware blocks in -b add all their counters.
+        counters, coll_levels = self.get_metric_counters()
+        if self.__args.ipblocks:
+            block_accumulate_counters, block_normal_counters = read_perfmon_counters(
+                self.get_pmc_files_list(roofline_perfmon_only, self.__args.ipblocks)
+            )
+            counters.update(get_counter_key(ctr) for ctr in block_normal_counters)
+            for accus in block_accumulate_counters:
+                coll_levels.update(accus)
+        accumulate_counters, normal_counters = read_perfmon_counters(
+            self.get_pmc_files_list(roofline_perfmon_only, None)
+        )
+        return select_perfmon_counters(
+            accumulate_counters, normal_counters, counters, coll_levels
+        )
+
+    @demarcate
+    def perfmon_plan(self, roofline_perfmon_only: bool):
+        """Print the application passes profiling would run, without running them"""
+        accumulate_counters, normal_counters = self.get_perfmon_counters(
+            roofline_perfmon_only
+        )
+        min_pass_count = get_min_pass_count(
+            accumulate_counters, normal_counters, self.__perfmon_config
+        )
+        output_files = schedule_counters(
+            accumulate_counters, normal_counters, self.__perfmon_config
         )
 
+        pass_count = len(output_files) + (0 if using_v3() else 1)
+        print("Profiling plan: {} application passes".format(pass_count))
+        for f in output_files:
+            print("  " + f.file_name)
+            for block_name, block in f.blocks.items():
+                if block.elements:
+                    print("    {:<6}{}".format(block_name, " ".join(block.elements)))
+        if not using_v3():
+            print("  timestamps.txt")
+            print("    kernel timestamps only")
+        print("Fewest counter passes the counters fit in: {}".format(min_pass_count))
+        if self.get_args().spatial_multiplexing:
+            print("The passes are split over nodes and gpus by --spatial-multiplexing")
+
     # ----------------------------------------------------
     # Required methods to be implemented by child classes
     # ----------------------------------------------------
@@ -269,6 +357,16 @@ def getblock(counter):
     return counter.split("_")[0]
 
 
+def get_perfmon_block(counter):
+    """Return the perfmon_config block whose counter slots a counter uses"""
+    block = getblock(counter)
+
+    # SQ and SQC belong to the same IP block
+    if block == "SQC":
+        block = "SQ"
+    return block
+
+
 # Set with limited size
 class LimitedSet:
     def __init__(self, maxsize) -> None:
@@ -295,13 +393,7 @@ class CounterFile:
         self.blocks = {b: LimitedSet(v) for b, v in perfmon_config.items()}
 
     def add(self, counter) -> bool:
-        block = getblock(counter)
-
-        # SQ and SQC belong to the same IP block
-        if block == "SQC":
-            block = "SQ"
-
-        return self.blocks[block].add(counter)
+        return self.blocks[get_perfmon_block(counter)].add(counter)
 
 
 # TODO: This is a HACK
@@ -309,11 +401,8 @@ def using_v3():
     return "ROCPROF" in os.environ.keys() and os.environ["ROCPROF"] == "rocprofv3"
 
 
-@demarcate
-def perfmon_coalesce(pmc_files_list, perfmon_config, workload_dir, spatial_multiplexing):
-    """Sort and bucket all related performance counters to minimize required application passes"""
-    workload_perfmon_dir = workload_dir + "/perfmon"
-
+def read_perfmon_counters(pmc_files_list):
+    """Return the accumulate counter lines and the normal counters of perfmon files"""
     # Will be 2D array
     accumulate_counters = []
 
@@ -375,12 +464,82 @@ def perfmon_coalesce(pmc_files_list, perfmon_config, workload_dir, spatial_multi
             if accu in normal_counters:
                 del normal_counters[accu]
 
+    return accumulate_counters, normal_counters
+
+
+def get_counter_key(counter):
+    """Return the name metric formulas use for a perfmon counter"""
+    counter = counter.split("[")[0]
+    return counter[: -len("_sum")] if counter.endswith("_sum") else counter
+
+
+def select_perfmon_counters(accumulate_counters, normal_counters, counters, coll_levels):
+    """Keep the perfmon counters metrics are derived from"""
+    # Accumulate counter lines are collected for the levels metrics read
+    selected_accumulate_counters = [
+        accus
+        for accus in accumulate_counters
+        if any(accu in coll_levels for accu in accus)
+    ]
+    selected_normal_counters = OrderedDict(
+        (ctr, count)
+        for ctr, count in normal_counters.items()
+        if get_counter_key(ctr) in counters
+    )
+
+    # The other counters of the dropped lines are collected as normal counters
+    for accus in accumulate_counters:
+        if accus in selected_accumulate_counters:
+            continue
+        for accu in accus:
+            if (
+                accu != "SQ_ACCUM_PREV_HIRES"
+                and get_counter_key(accu) in counters
+                and not any(accu in kept for kept in selected_accumulate_counters)
+            ):
+                selected_normal_counters.setdefault(accu, 1)
+
+    return selected_accumulate_counters, selected_normal_counters
+
+
+def get_min_pass_count(accumulate_counters, normal_counters, perfmon_config):
+    """
+    Return the fewest application passes the counters fit in: one per
+    accumulate counter, and enough for the counters of the fullest block.
+    """
+    block_counters = {}
+    for ctrs in accumulate_counters:
+        for ctr in set(ctrs):
+            block = get_perfmon_block(ctr)
+            block_counters[block] = block_counters.get(block, 0) + 1
+    for ctr in normal_counters:
+        block = get_perfmon_block(ctr)
+        block_counters[block] = block_counters.get(block, 0) + 1
+    return max(
+        [len(accumulate_counters)]
+        + [math.ceil(n / perfmon_config[b]) for b, n in block_counters.items()]
+    )
+
+
+def schedule_counters(accumulate_counters, normal_counters, perfmon_config):
+    """
+    Bucket counters into CounterFiles, one per application pass, in as few
+    passes as get_min_pass_count().
+    """
+    # NB:
+    #   A counter only takes a slot of its own block, and the per block
+    #   limits of perfmon_config are independent, so the passes a block needs
+    #   do not depend on where the other blocks go. Filling the free slots of
+    #   each block first-fit, accumulate passes first, needs no more passes
+    #   than the fullest block does, i.e. the minimum. Counters keep the
+    #   order they are read in, so the perfmon files stay the same as long
+    #   as the counters do.
     output_files = []
 
-    accu_file_count = 0
     # Each accumulate counter is in a different file
     for ctrs in accumulate_counters:
-
+        # Copy the line, the perfmon counters are scheduled again by --plan
+        ctrs = list(ctrs)
         ctr_name = ctrs[ctrs.index("SQ_ACCUM_PREV_HIRES") - 1]
 
         if using_v3():
@@ -397,7 +556,6 @@ def perfmon_coalesce(pmc_files_list, perfmon_config, workload_dir, spatial_multi
         output_files.append(CounterFile(ctr_name + ".txt", perfmon_config))
         for ctr in ctrs:
             output_files[-1].add(ctr)
-        accu_file_count += 1
 
     file_count = 0
     for ctr in normal_counters.keys():
@@ -417,6 +575,24 @@ def perfmon_coalesce(pmc_files_list, perfmon_config, workload_dir, spatial_multi
             file_count += 1
             output_files[-1].add(ctr)
 
+    return output_files
+
+
+@demarcate
+def perfmon_coalesce(
+    accumulate_counters,
+    normal_counters,
+    perfmon_config,
+    workload_dir,
+    spatial_multiplexing,
+):
+    """Sort and bucket all related performance counters to minimize required application passes"""
+    workload_perfmon_dir = workload_dir + "/perfmon"
+
+    output_files = schedule_counters(accumulate_counters, normal_counters, perfmon_config)
+    accu_file_count = len(accumulate_counters)
+    file_count = len(output_files) - accu_file_count
+
     console_debug("profiling", "perfmon_coalesce file_count %s" % file_count)
 
     # TODO: rewrite the above logic for spatial_multiplexing later
@@ -0,0 +1,424 @@
+##############################################################################bl
+# MIT License
+#
+# Copyright (c) 2021 - 2024 Advanced Micro Devices, Inc. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+##############################################################################el
+
+import gzip
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from utils import (
+    file_io,
+    filter_index,
+    kernel_name_shortener,
+    manifest,
+    parser,
+    schema,
+)
+from utils.utils import console_debug, get_user_cache_dir
+
+# NB:
+#   Derived metric tables of a workload are cached in a per-user cache dir,
+#   so a repeat analyze skips loading the raw csv files and evaluating the
+#   metrics, and analyze never writes into a (maybe shared or read-only)
+#   workload dir.
+#   Entries are keyed by a hash of everything the tables derive from, so a
+#   stale entry is never hit. It only ages out under the size cap.
+#   Hashing the raw data is a full read of it, so each entry is also linked
+#   from a stat key: the workload path, and the size and mtime of its raw
+#   files. Only a stat key miss hashes the contents, which still hits for a
+#   copied or touched workload.
+#   The tables are stored as gzip json, not pickle, so loading a cache entry
+#   can never execute code. Python json round trips floats exactly.
+results_cache_dir_name = "analysis_results"
+results_link_suffix = ".link"
+
+# Bump it whenever the entry format changes
+cache_format_version = 1
+
+# Max total size of the derived metric tables cache. Least recently used
+# entries are removed first.
+cache_size_cap = 512 * 1024 * 1024
+
+# Written into workload dirs by older versions of analyze, derived from
+# pmc_perf.csv and the filters
+generated_csv_files = ["pmc_kernel_top.csv", "pmc_dispatch_info.csv"]
+
+# NB:
+#   Analysis configs are compiled once per config dir content, into a bundle
+#   of the ArchConfig with expanded metrics and template dfs, in a per-user
+#   cache dir. So startup skips the yaml parsing and build_dfs() of all
+#   panels. Set ROCPROFCOMPUTE_CACHE_DIR to move it.
+config_cache_dir_name = "analysis_configs"
+config_cache_size_cap = 256 * 1024 * 1024
+
+
+def hash_file(h, f):
+    with open(f, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+            h.update(chunk)
+
+
+def list_files(dir, suffix, skip_files=()):
+    """
+    Return the files with suffix, a str or a tuple of them, under dir,
+    hidden dirs excluded, sorted.
+    """
+    files = []
+    for root, dirs, names in os.walk(dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for name in names:
+            if name.endswith(suffix) and name not in skip_files:
+                files.append(Path(root, name))
+    return sorted(files)
+
+
+def hash_dir(h, dir, suffix, skip_files=(), checksums=None):
+    """
+    Hash the relative path and content of all files with suffix, a str or a
+    tuple of them, under dir. The content of files in checksums, as
+    [relative path: sha256], is hashed by that checksum instead.
+    """
+    for f in list_files(dir, suffix, skip_files):
+        h.update(str(f.relative_to(dir)).encode())
+        if checksums and str(f.relative_to(dir)) in checksums:
+            h.update(checksums[str(f.relative_to(dir))].encode())
+        else:
+            hash_file(h, f)
+
+
+def hash_dir_stat(h, dir, suffix, skip_files=()):
+    """
+    Hash the relative path, size and mtime of all files with suffix under dir.
+    """
+    for f in list_files(dir, suffix, skip_files):
+        st = f.stat()
+        h.update(
+            "{}:{}:{}".format(f.relative_to(dir), st.st_size, st.st_mtime_ns).encode()
+        )
+
+
+def get_manifest_checksums(dir):
+    """
+    Return the [relative path: sha256] of all raw pmc csv files under dir
+    indexed by a fresh manifest, so they are not read again to be hashed.
+    """
+    checksums = {}
+    for root, dirs, names in os.walk(dir):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        if manifest.manifest_file_name not in names:
+            continue
+        pmc_manifest = manifest.load_manifest(root)
+        if pmc_manifest is None:
+            continue
+        for name, info in pmc_manifest["files"].items():
+            checksums[os.path.relpath(os.path.join(root, name), dir)] = info["sha256"]
+    return checksums
+
+
+def get_options_key(args, workload):
+    """
+    Return a hash of every option that changes the derived tables of a
+    workload, the panel configs and the metric derivation code.
+    """
+    h = hashlib.sha256()
+    options = {
+        "format": cache_format_version,
+        "normal_unit": args.normal_unit,
+        "time_unit": args.time_unit,
+        "max_stat_num": args.max_stat_num,
+        "kernel_verbose": args.kernel_verbose,
+        "filter_metrics": args.filter_metrics,
+        "list_stats": args.list_stats,
+        "specs_correction": args.specs_correction,
+        "nodes": args.nodes,
+        "stream": args.stream,
+        "filter_kernel_ids": workload.filter_kernel_ids,
+        "filter_gpu_ids": workload.filter_gpu_ids,
+        "filter_dispatch_ids": workload.filter_dispatch_ids,
+        "filter_nodes": workload.filter_nodes,
+    }
+    h.update(json.dumps(options, sort_keys=True, default=str).encode())
+    hash_dir(h, Path(args.config_dir), ".yaml")
+    for module in (parser, file_io, filter_index, schema, kernel_name_shortener):
+        hash_file(h, module.__file__)
+    return h.hexdigest()
+
+
+def get_stat_key(workload_dir, options_key):
+    """
+    Return the stat key of a workload, from its path and the size and mtime
+    of its raw csv files.
+    """
+    h = hashlib.sha256()
+    h.update(options_key.encode())
+    h.update(os.path.abspath(workload_dir).encode())
+    hash_dir_stat(
+        h, Path(workload_dir), (".csv", file_io.columnar_suffix), generated_csv_files
+    )
+    return h.hexdigest()
+
+
+def get_cache_key(workload_dir, options_key):
+    """
+    Return the cache key of a workload, from the content of its raw csv
+    files.
+    """
+    h = hashlib.sha256()
+    h.update(options_key.encode())
+    hash_dir(
+        h,
+        Path(workload_dir),
+        (".csv", file_io.columnar_suffix),
+        generated_csv_files,
+        get_manifest_checksums(workload_dir),
+    )
+    return h.hexdigest()
+
+
+def get_config_cache_key(config_dir, filter_metrics, sys_info):
+    """
+    Return the cache key of an analysis config bundle, from the panel
+    configs, the config building code and everything build_dfs() resolves
+    from the options and sys_info.
+    """
+    h = hashlib.sha256()
+    options = {
+        "format": cache_format_version,
+        "filter_metrics": filter_metrics,
+        "total_l2_chan": sys_info.total_l2_chan,
+    }
+    h.update(json.dumps(options, sort_keys=True, default=str).encode())
+    hash_dir(h, Path(config_dir), ".yaml")
+    for module in (parser, file_io, schema):
+        hash_file(h, module.__file__)
+    return h.hexdigest()
+
+
+def encode_index(index):
+    if isinstance(index, pd.RangeIndex):
+        return {"range": [index.start, index.stop, index.step], "name": index.name}
+    return {"values": index.tolist(), "dtype": str(index.dtype), "name": index.name}
+
+
+def decode_index(d):
+    if "range" in d:
+        return pd.RangeIndex(*d["range"], name=d["name"])
+    return pd.Index(d["values"], dtype=d["dtype"], name=d["name"])
+
+
+def encode_df(df):
+    return {
+        "index": encode_index(df.index),
+        "columns": encode_index(df.columns),
+        "dtypes": [str(t) for t in df.dtypes],
+        "data": [df.iloc[:, i].tolist() for i in range(df.shape[1])],
+    }
+
+
+def decode_df(d):
+    df = pd.DataFrame(
+        {
+            i: pd.Series(values, dtype=object).astype(dtype)
+            for i, (values, dtype) in enumerate(zip(d["data"], d["dtypes"]))
+        }
+    )
+    df.index = decode_index(d["index"])
+    df.columns = decode_index(d["columns"])
+    return df
+
+
+def to_json_value(v):
+    # numpy scalars in object columns
+    if isinstance(v, np.generic):
+        return v.item()
+    raise TypeError("{} is not serializable".format(type(v)))
+
+
+def get_results_cache_dir():
+    return Path(get_user_cache_dir(), results_cache_dir_name)
+
+
+def read_entry(f):
+    """
+    Return the [id: df] of a cache entry file, or None if it is missing or
+    unreadable.
+    """
+    if not f.is_file():
+        return None
+    try:
+        with gzip.open(f, "rt") as fp:
+            entry = json.load(fp)
+        dfs = {int(id): decode_df(d) for id, d in entry.items()}
+        # mark it as recently used
+        os.utime(f)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        console_debug("analysis", "ignoring unreadable cache {}: {}".format(f, e))
+        return None
+    console_debug("analysis", "loaded derived metrics from cache {}".format(f))
+    return dfs
+
+
+def load_dfs(workload_dir, args, workload):
+    """
+    Return the cached dfs of a workload, or None on cache miss, and the
+    (stat key, cache key) to save them with.
+    """
+    cache_dir = get_results_cache_dir()
+    options_key = get_options_key(args, workload)
+    stat_key = get_stat_key(workload_dir, options_key)
+    try:
+        key = cache_dir.joinpath(stat_key + results_link_suffix).read_text().strip()
+        dfs = read_entry(cache_dir.joinpath(key + ".json.gz"))
+        if dfs is not None:
+            return dfs, (stat_key, key)
+    except (OSError, ValueError):
+        pass
+
+    key = get_cache_key(workload_dir, options_key)
+    dfs = read_entry(cache_dir.joinpath(key + ".json.gz"))
+    if dfs is not None:
+        save_link(cache_dir, stat_key, key)
+    return dfs, (stat_key, key)
+
+
+def save_dfs(keys, dfs):
+    """
+    Save the dfs of a workload to the user cache dir, under the (stat key,
+    cache key) of load_dfs().
+    """
+    stat_key, key = keys
+    cache_dir = get_results_cache_dir()
+    if save_entry(
+        cache_dir,
+        key,
+        {id: encode_df(df) for id, df in dfs.items()},
+        cache_size_cap,
+    ):
+        save_link(cache_dir, stat_key, key)
+
+
+def save_link(cache_dir, stat_key, key):
+    """
+    Link a stat key to the cache entry of key.
+    """
+    f = cache_dir.joinpath(stat_key + results_link_suffix)
+    try:
+        tmp = cache_dir.joinpath("{}.{}.tmp".format(stat_key, os.getpid()))
+        tmp.write_text(key)
+        os.replace(tmp, f)
+    except OSError as e:
+        console_debug("analysis", "skipping cache link {}: {}".format(f, e))
+
+
+def load_arch_config(key):
+    """
+    Return the cached ArchConfig of key, or None on cache miss.
+    """
+    f = Path(get_user_cache_dir(), config_cache_dir_name, key + ".json.gz")
+    if not f.is_file():
+        return None
+    try:
+        with gzip.open(f, "rt") as fp:
+            entry = json.load(fp)
+        ac = schema.ArchConfig()
+        ac.panel_configs = OrderedDict((id, c) for id, c in entry["panel_configs"])
+        ac.dfs = {int(id): decode_df(d) for id, d in entry["dfs"].items()}
+        ac.dfs_type = {int(id): t for id, t in entry["dfs_type"].items()}
+        ac.metric_list = entry["metric_list"]
+        ac.metric_counters = entry["metric_counters"]
+        # mark it as recently used
+        os.utime(f)
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        console_debug("analysis", "ignoring unreadable config cache {}: {}".format(f, e))
+        return None
+    console_debug("analysis", "loaded analysis configs from cache {}".format(f))
+    return ac
+
+
+def save_arch_config(key, ac):
+    """
+    Save an ArchConfig built by build_dfs() to the user cache dir.
+    """
+    entry = {
+        "panel_configs": list(ac.panel_configs.items()),
+        "dfs": {id: encode_df(df) for id, df in ac.dfs.items()},
+        "dfs_type": ac.dfs_type,
+        "metric_list": ac.metric_list,
+        "metric_counters": ac.metric_counters,
+    }
+    save_entry(
+        Path(get_user_cache_dir(), config_cache_dir_name),
+        key,
+        entry,
+        config_cache_size_cap,
+    )
+
+
+def save_entry(cache_dir, key, entry, size_cap):
+    """
+    Save a json entry to cache_dir, then trim cache_dir to size_cap. Return
+    whether it was saved. A read-only cache dir only skips the cache.
+    """
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        # NB: write to a temp file first, so concurrent runs never read a
+        #     partial entry
+        tmp = cache_dir.joinpath("{}.{}.tmp".format(key, os.getpid()))
+        try:
+            with gzip.open(tmp, "wt") as fp:
+                json.dump(entry, fp, default=to_json_value)
+            os.replace(tmp, cache_dir.joinpath(key + ".json.gz"))
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        trim_cache_dir(cache_dir, size_cap)
+    except (OSError, TypeError) as e:
+        console_debug("analysis", "skipping cache in {}: {}".format(cache_dir, e))
+        return False
+    return True
+
+
+def trim_cache_dir(cache_dir, size_cap=cache_size_cap):
+    """
+    Remove least recently used entries until the cache dir fits size_cap,
+    and the links to removed entries.
+    """
+    entries = sorted(cache_dir.glob("*.json.gz"), key=lambda f: f.stat().st_mtime)
+    total = sum(f.stat().st_size for f in entries)
+    removed = False
+    for f in entries:
+        if total <= size_cap:
+            break
+        total -= f.stat().st_size
+        f.unlink()
+        removed = True
+    if removed:
+        for link in cache_dir.glob("*" + results_link_suffix):
+            if not cache_dir.joinpath(link.read_text().strip() + ".json.gz").is_file():
+                link.unlink()
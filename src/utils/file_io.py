@@ -24,19 +24,30 @@
 
 import collections
 import glob
+import importlib.util
+import itertools
 import os
-import re
 import sys
+import time
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 import yaml
 
 import config
-from utils import schema
+from utils import manifest, schema
+from utils.filter_index import FilterIndex
 from utils.kernel_name_shortener import kernel_name_shortener
-from utils.utils import console_debug, console_error, demarcate
+from utils.utils import (
+    console_debug,
+    console_error,
+    console_log,
+    console_warning,
+    demarcate,
+)
 
 # TODO: use pandas chunksize or dask to read really large csv file
 # from dask import dataframe as dd
@@ -57,6 +68,24 @@ top_stats_build_in_config = {
 
 time_units = {"s": 10**9, "ms": 10**6, "us": 10**3, "ns": 1}
 
+# pmc columns always loaded, as kernel top stats and filters depend on them
+pmc_key_columns = [
+    "Node",
+    "Dispatch_ID",
+    "Kernel_Name",
+    "GPU_ID",
+    "Start_Timestamp",
+    "End_Timestamp",
+]
+
+# max number of threads reading raw pmc files
+pmc_read_workers = min(32, (os.cpu_count() or 1) + 4)
+
+# Columnar copies of the raw pmc csv files, written by --columnar and the
+# convert mode, and preferred by create_df_pmc() while not older than the csv
+columnar_suffix = ".parquet"
+columnar_compression = "zstd"
+
 
 def load_sys_info(f):
     """
@@ -88,7 +117,6 @@ def load_panel_configs(dir):
 @demarcate
 def create_df_kernel_top_stats(
     df_in,
-    raw_data_dir,
     filter_gpu_ids,
     filter_dispatch_ids,
     filter_nodes,
@@ -96,40 +124,33 @@ def create_df_kernel_top_stats(
     max_stat_num,
     kernel_verbose,
     sortby="sum",
+    filter_index=None,
 ):
     """
     Create top stats info by grouping kernels with user's filters.
+    Return the [source: df] pairs of the Top Stats tables, i.e. the kernel
+    top stats as pmc_kernel_top.csv and the dispatches as
+    pmc_dispatch_info.csv, for parser.load_kernel_top().
+    filter_index is the filter_index.FilterIndex of df_in, built if None.
     """
 
     df = df_in["pmc_perf"]
     # Demangle original KernelNames
     kernel_name_shortener(df, kernel_verbose)
 
-    # The logic below for filters are the same as in parser.apply_filters(),
-    # which can be merged together if need it.
-
-    if filter_nodes:
-        df = df.loc[df["Node"].astype(str).isin([filter_nodes])]
-
-    if filter_gpu_ids:
-        df = df.loc[df["GPU_ID"].astype(str).isin([filter_gpu_ids])]
-
-    if filter_dispatch_ids:
-        # NB: support ignoring the 1st n dispatched execution by '> n'
-        #     The better way may be parsing python slice string
-        if ">" in filter_dispatch_ids[0]:
-            m = re.match(r"\> (\d+)", filter_dispatch_ids[0])
-            df = df[df["Dispatch_ID"] > int(m.group(1))]
-        else:
-            df = df.loc[df["Dispatch_ID"].astype(str).isin(filter_dispatch_ids)]
+    # Same filters as parser.apply_filters(), except kernels
+    if filter_index is None:
+        filter_index = FilterIndex(df_in)
+    positions = filter_index.select(filter_gpu_ids, filter_dispatch_ids, filter_nodes)
+    if positions is not None:
+        df = df.iloc[positions]
 
-    # First, create a dispatches file used to populate global vars
+    # First, create a dispatches table used to populate global vars
     dispatch_info = (
         df.loc[:, ["Node", "Dispatch_ID", "Kernel_Name", "GPU_ID"]]
         if "Node" in df.columns
         else df.loc[:, ["Dispatch_ID", "Kernel_Name", "GPU_ID"]]
     )
-    dispatch_info.to_csv(os.path.join(raw_data_dir, "pmc_dispatch_info.csv"), index=False)
 
     time_stats = pd.concat(
         [df["Kernel_Name"], (df["End_Timestamp"] - df["Start_Timestamp"])],
@@ -137,7 +158,7 @@ def create_df_kernel_top_stats(
         axis=1,
     )
 
-    grouped = time_stats.groupby(by=["Kernel_Name"]).agg(
+    grouped = time_stats.groupby(by=["Kernel_Name"], observed=True).agg(
         {"ExeTime": ["count", "sum", "mean", "median"]}
     )
 
@@ -163,77 +184,419 @@ def create_df_kernel_top_stats(
     #   Sort by total time as default.
     if sortby == "sum":
         grouped = grouped.sort_values(by=("Sum" + time_unit_str), ascending=False)
-        grouped.to_csv(os.path.join(raw_data_dir, "pmc_kernel_top.csv"), index=False)
     elif sortby == "kernel":
         grouped = grouped.sort_values("Kernel_Name")
-        grouped.to_csv(os.path.join(raw_data_dir, "pmc_kernel_top.csv"), index=False)
+
+    return {
+        "pmc_kernel_top.csv": to_top_stats_table(grouped),
+        "pmc_dispatch_info.csv": to_top_stats_table(dispatch_info),
+    }
+
+
+def create_kernel_top_stats_from_manifest(pmc_manifest, time_unit, kernel_verbose):
+    """
+    Return the same Top Stats tables as create_df_kernel_top_stats() without
+    filters, from a workload manifest instead of the raw pmc df. Return None
+    if the manifest can not give them, e.g. for kernels shortened to the same
+    name.
+    """
+    if "dispatch_runs" not in pmc_manifest:
+        return None
+    kernels = pd.DataFrame(pmc_manifest["kernels"])
+    # NB: names are shortened twice, once by create_df_pmc() and once by
+    #     create_df_kernel_top_stats(), and the 2nd pass may still change them
+    kernel_name_shortener(kernels, kernel_verbose)
+    kernel_name_shortener(kernels, kernel_verbose)
+    if kernels["Kernel_Name"].duplicated().any():
+        return None
+    dispatch_info = manifest.get_dispatch_table(pmc_manifest, kernels["Kernel_Name"])
+
+    time_unit_str = "(" + time_unit + ")"
+    grouped = pd.DataFrame(
+        {"Kernel_Name": kernels["Kernel_Name"], "Count": kernels["Count"]}
+    )
+    for key in ["Sum", "Mean", "Median"]:
+        grouped[key + time_unit_str] = kernels[key].div(time_units[time_unit])
+    key = "Sum" + time_unit_str
+    grouped["Pct"] = grouped[key] / grouped[key].sum() * 100
+    grouped = grouped.sort_values(by=key, ascending=False)
+    return {
+        "pmc_kernel_top.csv": to_top_stats_table(grouped),
+        "pmc_dispatch_info.csv": to_top_stats_table(dispatch_info),
+    }
+
+
+def to_top_stats_table(df):
+    """
+    Return a Top Stats table as its csv file would load: plain columns for
+    categoricals and a fresh index, which kernel ids refer to.
+    """
+    df = df.reset_index(drop=True)
+    return df.astype(
+        {
+            c: df[c].cat.categories.dtype
+            for c in df.columns
+            if isinstance(df[c].dtype, pd.CategoricalDtype)
+        }
+    )
 
 
 @demarcate
-def create_df_pmc(raw_data_root_dir, nodes, kernel_verbose, verbose):
+def create_df_pmc(raw_data_root_dir, nodes, kernel_verbose, verbose, usecols=None):
     """
     Load all raw pmc counters and join into one df.
+    If usecols, as [coll_level: counters], is given, only load those csv
+    files and columns, plus the key columns. pmc_perf.csv is always loaded.
+    With nodes, the files of all node sub dirs are read concurrently and the
+    node dfs are concatenated once.
     """
 
-    def create_single_df_pmc(raw_data_dir, node_name, kernel_verbose, verbose):
-        dfs = []
-        coll_levels = []
-
-        df = pd.DataFrame()
-        new_df = pd.DataFrame()
-        for root, dirs, files in os.walk(raw_data_dir):
-            for f in files:
-                # print("file ", f)
-                if (f.endswith(".csv") and f.startswith("SQ")) or (
-                    f == schema.pmc_perf_file_prefix + ".csv"
-                ):
-                    tmp_df = pd.read_csv(os.path.join(root, f))
-                    # Demangle original KernelNames
-                    kernel_name_shortener(tmp_df, kernel_verbose)
-
-                    # NB:
-                    #   Idealy, the Node column should be added out of
-                    #   multiindexing level. Here, we add it into pmc_perf
-                    #   as it is the main sub-df which can be handled easily
-                    #   later.
-                    if f == "pmc_perf.csv" and node_name != None:
-                        tmp_df.insert(0, "Node", node_name)
-                    dfs.append(tmp_df)
-                    coll_levels.append(f[:-4])
-
-        final_df = pd.concat(dfs, keys=coll_levels, axis=1, copy=False)
+    def read_pmc_file(f, coll_level):
+        start = time.perf_counter()
+        cols = get_pmc_cols(coll_level, usecols)
+        if f.endswith(columnar_suffix):
+            df = read_columnar(f, cols)
+        elif cols is None:
+            df = schema.compact_pmc_df(pd.read_csv(f))
+        else:
+            df = schema.compact_pmc_df(pd.read_csv(f, usecols=lambda c: c in cols))
+        return df, time.perf_counter() - start
+
+    node_dirs = get_pmc_node_dirs(raw_data_root_dir, nodes)
+
+    # NB: pd.read_csv tokenizes and pyarrow decodes without holding the GIL,
+    #     so one thread pool over the files of all nodes overlaps the I/O and
+    #     most of the parsing. Demangling and joining stay serial.
+    node_files = [list_pmc_files(node_dir, usecols) for node_name, node_dir in node_dirs]
+    all_files = [f for pmc_files in node_files for f in pmc_files]
+    if len(all_files) > 1:
+        with ThreadPoolExecutor(
+            max_workers=min(len(all_files), pmc_read_workers)
+        ) as pool:
+            results = list(pool.map(lambda f: read_pmc_file(*f), all_files))
+    else:
+        results = [read_pmc_file(*f) for f in all_files]
+
+    node_dfs = []
+    for (node_name, node_dir), pmc_files in zip(node_dirs, node_files):
+        node_results, results = results[: len(pmc_files)], results[len(pmc_files) :]
+        start = time.perf_counter()
+        node_dfs.append(
+            join_pmc_dfs(
+                pmc_files,
+                [df for df, elapsed in node_results],
+                node_name,
+                kernel_verbose,
+            )
+        )
         if verbose >= 2:
-            console_debug("pmc_raw_data final_single_df %s" % final_df.info)
-        return final_df
+            console_debug("pmc_raw_data final_single_df %s" % node_dfs[-1].info)
+        if node_name is not None:
+            console_log(
+                "analysis",
+                "loaded node {}: {} files, {} dispatches, {:.2f}s reading, {:.2f}s "
+                "joining".format(
+                    node_name,
+                    len(pmc_files),
+                    len(node_dfs[-1]),
+                    sum(elapsed for df, elapsed in node_results),
+                    time.perf_counter() - start,
+                ),
+            )
 
-    # regular single node case
     if nodes is None:
-        return create_single_df_pmc(raw_data_root_dir, None, kernel_verbose, verbose)
+        return node_dfs[0]
+    # NB: concatenating categoricals of different categories gives objects
+    for c in node_dfs[0].columns[node_dfs[0].dtypes == "category"]:
+        categories = pd.api.types.union_categoricals(
+            [df[c] for df in node_dfs if c in df.columns]
+        ).categories
+        for df in node_dfs:
+            if c in df.columns:
+                df[c] = df[c].cat.set_categories(categories)
+    return pd.concat(node_dfs)
+
+
+def iter_df_pmc_chunks(
+    raw_data_root_dir, nodes, kernel_verbose, chunk_size, usecols=None
+):
+    """
+    Yield the df create_df_pmc() loads, in chunks of up to chunk_size
+    dispatches, with the same columns and index. Only one chunk of every
+    file is in memory at a time.
+    """
+    for node_name, node_dir in get_pmc_node_dirs(raw_data_root_dir, nodes):
+        pmc_files = list_pmc_files(node_dir, usecols)
+        readers = []
+        for f, coll_level in pmc_files:
+            cols = get_pmc_cols(coll_level, usecols)
+            if f.endswith(columnar_suffix):
+                readers.append(iter_columnar_chunks(f, cols, chunk_size))
+            else:
+                readers.append(
+                    map(
+                        schema.compact_pmc_df,
+                        pd.read_csv(
+                            f,
+                            usecols=(
+                                None if cols is None else (lambda c, cols=cols: c in cols)
+                            ),
+                            chunksize=chunk_size,
+                        ),
+                    )
+                )
+        # NB: all pmc files of a node have one row per dispatch, in the same
+        #     order, so their chunks line up
+        for tmp_dfs in itertools.zip_longest(*readers):
+            if any(df is None or len(df) != len(tmp_dfs[0]) for df in tmp_dfs):
+                console_error(
+                    "analysis",
+                    "The pmc files in {} have different numbers of dispatches: "
+                    "{}".format(node_dir, ", ".join(f for f, coll_level in pmc_files)),
+                )
+            yield join_pmc_dfs(pmc_files, list(tmp_dfs), node_name, kernel_verbose)
+
 
+def get_pmc_node_dirs(raw_data_root_dir, nodes):
+    """
+    Return the (node name, dir) pairs to load pmc files from. The node name
+    is None for the regular single node case.
+    """
+    # regular single node case
+    if nodes is None:
+        return [(None, Path(raw_data_root_dir))]
     # "empty list" means all nodes
     elif not nodes:
-        df = pd.DataFrame()
-        # todo: more err check
-        for subdir in Path(raw_data_root_dir).iterdir():
-            if subdir.is_dir():
-                new_df = create_single_df_pmc(
-                    subdir, str(subdir.name), kernel_verbose, verbose
-                )
-                df = pd.concat([df, new_df])
-        return df
-
+        node_dirs = [(d.name, d) for d in list_node_dirs(raw_data_root_dir)]
     # specified node list
     else:
-        df = pd.DataFrame()
-        # todo: more err check
-        for subdir in nodes:
-            p = Path(raw_data_root_dir)
-            new_df = create_single_df_pmc(
-                p.joinpath(subdir), subdir, kernel_verbose, verbose
+        node_dirs = [(n, Path(raw_data_root_dir, n)) for n in nodes]
+    if not node_dirs:
+        console_error("analysis", "No node directory in {}".format(raw_data_root_dir))
+    for node_name, node_dir in node_dirs:
+        if not node_dir.is_dir():
+            console_error("analysis", "Invalid node directory {}".format(node_dir))
+    return node_dirs
+
+
+def list_pmc_files(raw_data_dir, usecols=None):
+    """
+    List the (file, coll_level) pairs of all raw pmc files under a dir, or
+    only those needed by usecols.
+    """
+    pmc_files = []
+    for root, dirs, files in os.walk(raw_data_dir):
+        for f in files:
+            coll_level = is_pmc_file(os.path.join(root, f))
+            if coll_level is None:
+                continue
+            if (
+                usecols is not None
+                and coll_level != schema.pmc_perf_file_prefix
+                and coll_level not in usecols
+            ):
+                continue
+            pmc_files.append((os.path.join(root, f), coll_level))
+    return pmc_files
+
+
+def get_pmc_cols(coll_level, usecols):
+    """
+    Return the set of columns to load from a raw pmc file, or None for all.
+    """
+    if usecols is None:
+        return None
+    return set(pmc_key_columns) | set(usecols.get(coll_level, ()))
+
+
+def join_pmc_dfs(pmc_files, tmp_dfs, node_name, kernel_verbose):
+    """
+    Join the dfs read from the raw pmc files of one node into one df, with
+    the coll_level of each file as the 1st column level.
+    """
+    dfs = []
+    coll_levels = []
+
+    for (f, coll_level), tmp_df in zip(pmc_files, tmp_dfs):
+        # Demangle original KernelNames
+        kernel_name_shortener(tmp_df, kernel_verbose)
+
+        # NB:
+        #   Idealy, the Node column should be added out of
+        #   multiindexing level. Here, we add it into pmc_perf
+        #   as it is the main sub-df which can be handled easily
+        #   later.
+        if coll_level == schema.pmc_perf_file_prefix and node_name != None:
+            tmp_df.insert(
+                0,
+                "Node",
+                pd.Categorical.from_codes(np.zeros(len(tmp_df), np.int8), [node_name]),
             )
-            df = pd.concat([df, new_df])
+        dfs.append(tmp_df)
+        coll_levels.append(coll_level)
+
+    return pd.concat(dfs, keys=coll_levels, axis=1, copy=False)
+
+
+def list_node_dirs(directory):
+    """
+    List the node sub dirs of a multi-node workload dir, i.e. all sub dirs
+    but hidden ones.
+    """
+    return [
+        entry
+        for entry in Path(directory).iterdir()
+        if entry.is_dir() and not entry.name.startswith(".")
+    ]
+
+
+def is_pmc_file(f):
+    """
+    Return the collection level of a raw pmc file, i.e. pmc_perf or SQ*,
+    or None if f is not one, or is shadowed by its counterpart: a csv file is
+    shadowed by a fresh columnar copy, and a copy by a newer csv file.
+    """
+    stem, suffix = os.path.splitext(os.path.basename(f))
+    if not (stem.startswith("SQ") or stem == schema.pmc_perf_file_prefix):
+        return None
+    if suffix == ".csv":
+        return None if is_columnar_fresh(f) else stem
+    if suffix == columnar_suffix:
+        return stem if is_columnar_fresh(os.path.splitext(f)[0] + ".csv") else None
+    return None
+
+
+def is_columnar_fresh(csv_file):
+    """
+    Check whether the columnar copy of csv_file exists and is not older than
+    csv_file. A copy without its csv file is always fresh.
+    """
+    copy = os.path.splitext(csv_file)[0] + columnar_suffix
+    if not os.path.isfile(copy):
+        return False
+    if not os.path.isfile(csv_file):
+        return True
+    return os.path.getmtime(copy) >= os.path.getmtime(csv_file)
+
+
+def read_columnar(f, cols=None):
+    """
+    Read a columnar copy, memory mapped, as the same df pd.read_csv() and
+    schema.compact_pmc_df() give. If cols is given, only those columns are read.
+    """
+    try:
+        if cols is not None:
+            import pyarrow.parquet as pq
+
+            cols = [c for c in pq.read_schema(f).names if c in cols]
+        df = pd.read_parquet(f, columns=cols, memory_map=True)
+    except ImportError as e:
+        console_error("analysis", "{}\nCan not read {}.".format(e, f))
+    return schema.compact_pmc_df(df)
+
+
+def iter_columnar_chunks(f, cols, chunk_size):
+    """
+    Yield a columnar copy in chunks of chunk_size rows, but the last one,
+    indexed like the chunks of pd.read_csv(chunksize=).
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    start = 0
+
+    def to_df(table):
+        nonlocal start
+        df = schema.compact_pmc_df(table.to_pandas())
+        df.index = pd.RangeIndex(start, start + len(df))
+        start += len(df)
         return df
 
+    pf = pq.ParquetFile(f, memory_map=True)
+    if cols is not None:
+        cols = [c for c in pf.schema_arrow.names if c in cols]
+    # NB: batches end at row group boundaries too, so rebatch them
+    batches = []
+    num_rows = 0
+    for batch in pf.iter_batches(batch_size=chunk_size, columns=cols):
+        batches.append(batch)
+        num_rows += batch.num_rows
+        while num_rows >= chunk_size:
+            table = pa.Table.from_batches(batches)
+            yield to_df(table.slice(0, chunk_size))
+            batches = table.slice(chunk_size).to_batches()
+            num_rows -= chunk_size
+    if num_rows:
+        yield to_df(pa.Table.from_batches(batches))
+
+
+def has_columnar_support():
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def save_columnar_copy(csv_file):
+    """
+    Write the columnar copy of a raw pmc csv file: the compact columns of
+    schema.compact_pmc_df(), dictionary encoded categories and zstd
+    compression.
+    The csv file is kept, as profiling, roofline and the database import
+    still read it. Return False if the csv file can not be stored.
+    """
+    copy = Path(csv_file).with_suffix(columnar_suffix)
+    tmp = copy.with_name(copy.name + ".tmp")
+    df = schema.compact_pmc_df(pd.read_csv(csv_file))
+    try:
+        df.to_parquet(tmp, index=False, compression=columnar_compression)
+    except (ValueError, TypeError, NotImplementedError) as e:
+        # e.g. a column mixing numbers and strings
+        tmp.unlink(missing_ok=True)
+        console_warning("Skip columnar copy of {}: {}".format(csv_file, e))
+        return False
+    os.replace(tmp, copy)
+    return True
+
+
+def convert_workload_dir(dir):
+    """
+    Write the columnar copies of all raw pmc csv files under a workload dir,
+    which are missing or older than their csv files. Needs pyarrow.
+    Return the number of copies written.
+    """
+    count = 0
+    for root, dirs, files in os.walk(dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for f in sorted(files):
+            stem, suffix = os.path.splitext(f)
+            if suffix != ".csv" or not (
+                stem.startswith("SQ") or stem == schema.pmc_perf_file_prefix
+            ):
+                continue
+            csv_file = os.path.join(root, f)
+            if is_columnar_fresh(csv_file):
+                continue
+            if save_columnar_copy(csv_file):
+                console_debug("convert", "wrote columnar copy of {}".format(csv_file))
+                count += 1
+    return count
+
+
+def save_workload_manifests(dir):
+    """
+    Write the manifests of all workload dirs under dir, i.e. dirs with a
+    pmc_perf.csv, which are missing or stale.
+    Return the number of manifests written.
+    """
+    count = 0
+    for root, dirs, files in os.walk(dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        if schema.pmc_perf_file_prefix + ".csv" not in files:
+            continue
+        if manifest.load_manifest(root) is None:
+            manifest.save_manifest(root)
+            console_debug("convert", "wrote manifest of {}".format(root))
+            count += 1
+    return count
+
 
 def collect_wave_occu_per_cu(in_dir, out_dir, numSE):
     """
@@ -271,6 +634,62 @@ def collect_wave_occu_per_cu(in_dir, out_dir, numSE):
         all.to_csv(Path(out_dir, "wave_occu_per_cu.csv"), index=False)
 
 
+def save_parquet(df, path):
+    try:
+        df.to_parquet(path, index=False)
+    except ImportError as e:
+        console_error(
+            "analysis",
+            "{}\nOr save it without a .parquet suffix.".format(e),
+        )
+
+
+def save_per_kernel(df, path):
+    """
+    Save the [kernel x metric] df of --per-kernel, to a single Parquet file
+    if path ends with .parquet, or else to a csv file.
+    """
+    p = Path(path)
+    if p.suffix == ".parquet":
+        save_parquet(df, p)
+    else:
+        df.to_csv(p, index=False)
+    console_debug(
+        "analysis",
+        "saved {} kernels x {} columns to {}".format(len(df), df.shape[1], p),
+    )
+
+
+def save_per_dispatch(df, path):
+    """
+    Save the [dispatch x metric] df of --per-dispatch.
+    A path ending with .parquet is written as a single Parquet file, which
+    needs pyarrow or fastparquet. Any other path is a directory of:
+      - dispatches.csv: the dispatch key columns, one row per dispatch
+      - metrics.csv: the metric column names
+      - values.npy: float64 [dispatch, metric] array, in column major order,
+        so np.load(..., mmap_mode="r")[:, i] reads one metric contiguously
+    """
+    p = Path(path)
+    keys = [c for c in df.columns if c in pmc_key_columns]
+    metrics = [c for c in df.columns if c not in keys]
+
+    if p.suffix == ".parquet":
+        save_parquet(df, p)
+    else:
+        p.mkdir(parents=True, exist_ok=True)
+        df[keys].to_csv(p.joinpath("dispatches.csv"), index=False)
+        pd.DataFrame({"Metric": metrics}).to_csv(p.joinpath("metrics.csv"), index=False)
+        np.save(
+            p.joinpath("values.npy"),
+            np.asfortranarray(df[metrics].to_numpy(dtype=np.float64)),
+        )
+    console_debug(
+        "analysis",
+        "saved {} dispatches x {} metrics to {}".format(len(df), len(metrics), p),
+    )
+
+
 def is_single_panel_config(root_dir, supported_archs):
     """
     Check the root configs dir structure to decide using one config set for all
@@ -297,9 +716,8 @@ def find_1st_sub_dir(directory):
     dir_path = Path(directory)
     try:
         # Iterate over entries in the directory
-        for entry in dir_path.iterdir():
-            if entry.is_dir():  # Check if it's a directory
-                return entry
+        for entry in list_node_dirs(dir_path):
+            return entry
     except FileNotFoundError:
         print(f"The directory '{directory}' does not exist.")
     return None
@@ -0,0 +1,208 @@
+##############################################################################bl
+# MIT License
+#
+# Copyright (c) 2021 - 2024 Advanced Micro Devices, Inc. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+##############################################################################el
+
+import re
+
+import numpy as np
+import pandas as pd
+
+from utils import schema
+from utils.utils import console_error
+
+# NB:
+#   A filter index is built once per loaded raw pmc df, and shared by the
+#   Top Stats and the metric tables. It maps each Kernel_Name, GPU_ID and
+#   Node value to its row positions, through the categorical codes, and keeps
+#   the Dispatch_IDs sorted. So a selection only compares the few distinct
+#   values, or binary searches the dispatches, instead of converting the
+#   whole column to str. Selections are sorted row position arrays.
+#   Value columns are indexed on first use, so Kernel_Name must be
+#   shortened before it is selected.
+
+# Dispatch filters: "n", a "> n" style comparison, or a "start:stop" slice
+# of Dispatch_IDs, with stop excluded
+dispatch_filter_re = re.compile(
+    r"^\s*(?:(?P<id>\d+)|(?P<op>>=|<=|>|<)\s*(?P<bound>\d+)"
+    r"|(?P<start>\d*)\s*:\s*(?P<stop>\d*))\s*$"
+)
+
+
+def parse_dispatch_filter(dispatch_filter):
+    """
+    Return the [start, stop) Dispatch_ID range of a dispatch filter, with
+    None for an open end, or None if it is invalid.
+    """
+    m = dispatch_filter_re.match(str(dispatch_filter))
+    if m is None:
+        return None
+    if m.group("id") is not None:
+        return int(m.group("id")), int(m.group("id")) + 1
+    if m.group("op") is not None:
+        bound = int(m.group("bound"))
+        return {
+            ">": (bound + 1, None),
+            ">=": (bound, None),
+            "<": (None, bound),
+            "<=": (None, bound + 1),
+        }[m.group("op")]
+    return (
+        int(m.group("start")) if m.group("start") else None,
+        int(m.group("stop")) if m.group("stop") else None,
+    )
+
+
+def as_filter_list(values):
+    """
+    Return filter values, given as one value or a list of them, as a list.
+    """
+    if isinstance(values, (list, tuple)):
+        return list(values)
+    return [values]
+
+
+def intersect(positions, selected):
+    """
+    Return the row positions in both selections. None selects all rows.
+    """
+    if positions is None:
+        return selected
+    return np.intersect1d(positions, selected, assume_unique=True)
+
+
+class FilterIndex:
+    """
+    Row positions of the dispatches of a raw pmc df, by value of its
+    Kernel_Name, GPU_ID and Node columns, and by Dispatch_ID.
+    """
+
+    def __init__(self, raw_pmc):
+        self.raw_pmc = raw_pmc
+        self.rows = len(raw_pmc)
+        self.value_positions = {}
+        dispatch_ids = raw_pmc[(schema.pmc_perf_file_prefix, "Dispatch_ID")].to_numpy()
+        self.dispatch_order = np.argsort(dispatch_ids, kind="stable")
+        self.sorted_dispatch_ids = dispatch_ids[self.dispatch_order]
+
+    def get_value_positions(self, column):
+        """
+        Return the distinct values of a column, the row positions ordered by
+        value, and the bounds of the positions of each value in them.
+        """
+        if column not in self.value_positions:
+            values = self.raw_pmc[(schema.pmc_perf_file_prefix, column)]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+            else:
+                codes, uniques = pd.factorize(values)
+            order = np.argsort(codes, kind="stable")
+            # NB: missing values have code -1, and are never selected
+            bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+            self.value_positions[column] = (uniques, order, bounds)
+        return self.value_positions[column]
+
+    def has_column(self, column):
+        return (schema.pmc_perf_file_prefix, column) in self.raw_pmc.columns
+
+    def select_values(self, column, values, key=str):
+        """
+        Return the row positions where key(value) of column is in values.
+        """
+        uniques, order, bounds = self.get_value_positions(column)
+        values = set(values)
+        selected = [
+            order[bounds[code] : bounds[code + 1]]
+            for code, value in enumerate(uniques)
+            if (key(value) if key else value) in values
+        ]
+        return np.sort(np.concatenate(selected)) if selected else np.array([], int)
+
+    def select_dispatch_range(self, start, stop):
+        """
+        Return the row positions of the dispatches with a Dispatch_ID in
+        [start, stop). None is an open end.
+        """
+        lo, hi = 0, len(self.sorted_dispatch_ids)
+        if start is not None:
+            lo = np.searchsorted(self.sorted_dispatch_ids, start, "left")
+        if stop is not None:
+            hi = max(lo, np.searchsorted(self.sorted_dispatch_ids, stop, "left"))
+        return np.sort(self.dispatch_order[lo:hi])
+
+    def select(self, filter_gpu_ids=None, filter_dispatch_ids=None, filter_nodes=None):
+        """
+        Return the row positions of the dispatches left by the gpu, dispatch
+        and node filters, or None if nothing is filtered. Error out on a
+        filter value no dispatch matches, or on filters no dispatch matches
+        together.
+        """
+        positions = None
+        if filter_nodes and self.has_column("Node"):
+            nodes = as_filter_list(filter_nodes)
+            selected = self.select_values("Node", map(str, nodes))
+            if not len(selected):
+                console_error("analysis", "{} is invalid".format(filter_nodes))
+            positions = intersect(positions, selected)
+
+        if filter_gpu_ids:
+            gpu_ids = as_filter_list(filter_gpu_ids)
+            selected = self.select_values("GPU_ID", map(str, gpu_ids))
+            if not len(selected):
+                console_error(
+                    "analysis", "{} is an invalid gpu-id".format(filter_gpu_ids)
+                )
+            positions = intersect(positions, selected)
+
+        if filter_dispatch_ids:
+            selected = []
+            for dispatch_filter in as_filter_list(filter_dispatch_ids):
+                dispatch_range = parse_dispatch_filter(dispatch_filter)
+                if dispatch_range is None:
+                    console_error(
+                        "analysis",
+                        "{} is an invalid dispatch filter. Use n, > n or "
+                        "start:stop.".format(dispatch_filter),
+                    )
+                selected.append(self.select_dispatch_range(*dispatch_range))
+                if not len(selected[-1]):
+                    console_error(
+                        "analysis",
+                        "{} is an invalid dispatch id.".format(dispatch_filter),
+                    )
+            positions = intersect(positions, np.unique(np.concatenate(selected)))
+
+        if positions is not None and not len(positions):
+            console_error("analysis", "no dispatch matches all the filters")
+        return positions
+
+
+def get_filter_index(workload):
+    """
+    Return the filter index of the raw pmc df of a workload, building it on
+    first use.
+    """
+    if workload.filter_index is None or workload.filter_index.raw_pmc is not (
+        workload.raw_pmc
+    ):
+        workload.filter_index = FilterIndex(workload.raw_pmc)
+    return workload.filter_index
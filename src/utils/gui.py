@@ -129,7 +129,8 @@ def build_bar_chart(display_df, table_config, barchart_elements, norm_filt, hbm_
     # Insr Mix bar chart
     if table_config["id"] in barchart_elements["instr_mix"]:
         display_df["Avg"] = [
-            x.astype(int) if x != "" else int(0) for x in display_df["Avg"]
+            x.astype(int) if x != "" and pd.notna(x) else int(0)
+            for x in display_df["Avg"]
         ]
         df_unit = display_df["Unit"][0]
         d_figs.append(
@@ -147,7 +148,8 @@ def build_bar_chart(display_df, table_config, barchart_elements, norm_filt, hbm_
     # Multi bar chart
     elif table_config["id"] in barchart_elements["multi_bar"]:
         display_df["Avg"] = [
-            x.astype(int) if x != "" else int(0) for x in display_df["Avg"]
+            x.astype(int) if x != "" and pd.notna(x) else int(0)
+            for x in display_df["Avg"]
         ]
         df_unit = display_df["Unit"][0]
         nested_bar = multi_bar_chart(table_config["id"], display_df)
@@ -198,7 +200,8 @@ def build_bar_chart(display_df, table_config, barchart_elements, norm_filt, hbm_
     # Speed-of-light bar chart
     elif table_config["id"] in barchart_elements["sol"]:
         display_df["Avg"] = [
-            x.astype(float) if x != "" else float(0) for x in display_df["Avg"]
+            x.astype(float) if x != "" and pd.notna(x) else float(0)
+            for x in display_df["Avg"]
         ]
         if table_config["id"] == 1701:
             # special layout for L2 Cache SOL
@@ -229,7 +232,7 @@ def build_bar_chart(display_df, table_config, barchart_elements, norm_filt, hbm_
         elif table_config["id"] == 1101:
             # Special formatting reference 'Pct of Peak' value
             display_df["Pct of Peak"] = [
-                x.astype(float) if x != "" else float(0)
+                x.astype(float) if x != "" and pd.notna(x) else float(0)
                 for x in display_df["Pct of Peak"]
             ]
             d_figs.append(
@@ -25,7 +25,7 @@
 import dash_bootstrap_components as dbc
 from dash import dcc, html
 
-from utils import schema
+from utils import manifest, schema
 
 avail_normalizations = ["per_wave", "per_cycle", "per_second", "per_kernel"]
 
@@ -43,7 +43,7 @@ def create_span(input):
     return {"label": html.Span(str(input), title=str(input)), "value": str(input)}
 
 
-def get_header(raw_pmc, input_filters, kernel_names):
+def get_header(raw_pmc, input_filters, kernel_names, pmc_manifest=None):
     kernel_names = list(
         map(
             str,
@@ -51,6 +51,15 @@ def get_header(raw_pmc, input_filters, kernel_names):
         )
     )
     kernel_names = [x.strip() for x in kernel_names]
+    # NB: a fresh manifest lists the gpus and dispatches without going through
+    #     every dispatch of raw_pmc
+    dispatches = (
+        manifest.get_dispatch_table(pmc_manifest) if pmc_manifest is not None else None
+    )
+    if dispatches is None:
+        dispatches = raw_pmc[schema.pmc_perf_file_prefix]
+    gpu_ids = list(map(str, dispatches["GPU_ID"].unique()))
+    dispatch_ids = list(map(str, dispatches["Dispatch_ID"]))
     return html.Header(
         id="home",
         children=[
@@ -185,15 +194,7 @@ def get_header(raw_pmc, input_filters, kernel_names):
                                             ),
                                             dcc.Dropdown(
                                                 list_unique(
-                                                    list(
-                                                        map(
-                                                            str,
-                                                            raw_pmc[
-                                                                schema.pmc_perf_file_prefix
-                                                            ]["GPU_ID"],
-                                                        )
-                                                    ),
-                                                    True,
+                                                    gpu_ids, True
                                                 ),  # list avail gcd ids
                                                 id="gcd-filt",
                                                 multi=True,
@@ -218,14 +219,7 @@ def get_header(raw_pmc, input_filters, kernel_names):
                                                 children=["Dispatch Filter:"],
                                             ),
                                             dcc.Dropdown(
-                                                list(
-                                                    map(
-                                                        str,
-                                                        raw_pmc[
-                                                            schema.pmc_perf_file_prefix
-                                                        ]["Dispatch_ID"],
-                                                    )
-                                                ),
+                                                dispatch_ids,
                                                 id="disp-filt",
                                                 multi=True,
                                                 value=input_filters[
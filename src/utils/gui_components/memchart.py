@@ -22,6 +22,7 @@
 # SOFTWARE.
 ##############################################################################el
 
+import pandas as pd
 from dash import html
 from dash_svg import G, Path, Rect, Svg, Text
 
@@ -46,7 +47,8 @@ def insert_chart_data(mem_data, base_data):
 
     memchart_values = {}
     for i in range(0, len(alias)):
-        memchart_values[alias[i]] = values[i]
+        # NB: typed metric columns use NaN for missing values
+        memchart_values[alias[i]] = values[i] if pd.notna(values[i]) else ""
 
     return G(
         className="data",
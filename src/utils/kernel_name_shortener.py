@@ -22,22 +22,243 @@
 # SOFTWARE.
 ##############################################################################el
 
+import fcntl
+import json
 import os
 import re
 import subprocess
+from collections import OrderedDict
 
 import pandas as pd
 
-from utils.utils import console_debug, console_error, console_log
+from utils.utils import (
+    console_debug,
+    console_error,
+    console_log,
+    console_warning,
+    get_user_cache_dir,
+)
 
-cache = dict()
+cpp_filt = os.path.join("/usr", "bin", "c++filt")
+
+# NB:
+#   Kernel names are demangled in batches, by one c++filt call per batch
+#   instead of one per name. The shortened names are kept per (level, name)
+#   in a process-wide LRU, as analyze shortens the same names once per raw
+#   csv file and again for the Top Stats. They are also saved to a per-user
+#   cache file, so a repeat analysis of template-heavy apps skips c++filt.
+#   New names are only collected while analyzing, and merged into the file
+#   once per process by save_disk_cache(), under a lock, so the forked
+#   workers of a comparison do not lose each other's names.
+cache = OrderedDict()
+cache_size_cap = 100000
+
+disk_cache_file_name = "kernel_names.json"
+# Max total length of the names in the cache file. Oldest names are removed
+# first.
+disk_cache_size_cap = 32 * 1024 * 1024
+
+# Bump it whenever shortening changes the names of a level
+disk_cache_format_version = 1
+
+# Max total length of the names passed to one c++filt call, far below
+# ARG_MAX
+demangle_batch_size = 64 * 1024
+
+disk_cache = None
+# [level: [name: shortened name]] not yet saved to the cache file
+new_disk_names = {}
+
+
+def demangle(names):
+    """
+    Demangle names with c++filt, in batches. Names c++filt can not demangle
+    are returned unchanged.
+    """
+    demangled_names = []
+    batch = []
+    batch_size = 0
+    for i, name in enumerate(names):
+        batch.append(name)
+        batch_size += len(name) + 1
+        if batch_size < demangle_batch_size and i < len(names) - 1:
+            continue
+        # NB: "--" so names starting with "-" are not taken as options
+        proc = subprocess.run(
+            [cpp_filt, "--"] + batch, capture_output=True, encoding="utf-8"
+        )
+        lines = proc.stdout.split("\n")[: len(batch)]
+        if proc.returncode != 0 or len(lines) != len(batch):
+            console_error(
+                "c++filt failed to demangle {} kernel names: {}".format(
+                    len(batch), proc.stderr.strip()
+                )
+            )
+        demangled_names += [line.strip() for line in lines]
+        batch = []
+        batch_size = 0
+    return demangled_names
+
+
+def shorten_name(demangled_name, level):
+    """
+    Shorten a demangled kernel name to level nested template levels.
+    """
+    new_name = ""
+    matches = ""
+
+    names_and_args = re.compile(r"(?P<name>[( )A-Za-z0-9_]+)([ ,*<>()]+)(::)?")
+
+    # works for name Kokkos::namespace::init_lock_array_kernel_threadid(int) [clone .kd]
+    if names_and_args.search(demangled_name):
+        matches = names_and_args.findall(demangled_name)
+    else:
+        # Works for first case  '__amd_rocclr_fillBuffer.kd'
+        return demangled_name
+
+    current_level = 0
+    for name in matches:
+        ##can cause errors if a function name or argument is equal to 'clone'
+        if name[0] == "clone":
+            continue
+        if len(name) == 3:
+            if name[2] == "::":
+                continue
+
+        if current_level < level:
+            new_name += name[0]
+        # closing '>' is to be taken account by the while loop
+        if name[1].count(">") == 0:
+            if current_level < level:
+                if not (current_level == level - 1 and name[1].count("<") > 0):
+                    new_name += name[1]
+            current_level += name[1].count("<")
+
+        curr_index = 0
+        # cases include '>'  '> >, ' have to go in depth here to not lose account of commas and current level
+        while name[1].count(">") > 0 and curr_index < len(name[1]):
+            if current_level < level:
+                new_name += name[1][curr_index:]
+                current_level -= name[1][curr_index:].count(">")
+                curr_index = len(name[1])
+            elif name[1][curr_index] == (">"):
+                current_level -= 1
+            curr_index += 1
+
+    if new_name == None or new_name == "":
+        return demangled_name
+    return new_name
+
+
+def read_disk_cache():
+    """
+    Return the [level: [name: shortened name]] of the per-user cache file,
+    or an empty dict if it is missing or unreadable.
+    """
+    f = get_user_cache_dir().joinpath(disk_cache_file_name)
+    try:
+        with open(f) as fp:
+            entry = json.load(fp)
+        if entry["format"] == disk_cache_format_version:
+            return entry["names"]
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        if os.path.exists(f):
+            console_debug("analysis", "ignoring unreadable {}: {}".format(f, e))
+    return {}
+
+
+def save_disk_cache():
+    """
+    Merge the new names of this process into the per-user cache file,
+    removing the oldest names beyond disk_cache_size_cap. A read-only cache
+    dir only skips the cache.
+    """
+    if not new_disk_names:
+        return
+
+    cache_dir = get_user_cache_dir()
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        # NB: lock the read-merge-write, so concurrent runs never drop each
+        #     other's names, and write to a temp file first, so they never
+        #     read a partial cache
+        with open(cache_dir.joinpath(disk_cache_file_name + ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            names = read_disk_cache()
+            for level, level_names in new_disk_names.items():
+                names.setdefault(level, {}).update(level_names)
+            total = sum(
+                len(name) + len(short_name)
+                for level_names in names.values()
+                for name, short_name in level_names.items()
+            )
+            for level_names in names.values():
+                for name in list(level_names):
+                    if total <= disk_cache_size_cap:
+                        break
+                    total -= len(name) + len(level_names.pop(name))
+
+            tmp = cache_dir.joinpath(
+                "{}.{}.tmp".format(disk_cache_file_name, os.getpid())
+            )
+            try:
+                with open(tmp, "w") as fp:
+                    json.dump({"format": disk_cache_format_version, "names": names}, fp)
+                os.replace(tmp, cache_dir.joinpath(disk_cache_file_name))
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+    except OSError as e:
+        console_warning(
+            "analysis", "skipping kernel name cache in {}: {}".format(cache_dir, e)
+        )
+    new_disk_names.clear()
+
+
+def shorten_names(names, level):
+    """
+    Return the [name: shortened name] of names, from the LRU, the per-user
+    cache file, or c++filt. The names c++filt is called for are saved by
+    save_disk_cache().
+    """
+    global disk_cache
+
+    short_names = {}
+    misses = []
+    for name in names:
+        if (level, name) in cache:
+            cache.move_to_end((level, name))
+            short_names[name] = cache[(level, name)]
+        elif not isinstance(name, str) or "\n" in name:
+            short_names[name] = name
+        else:
+            misses.append(name)
+
+    if misses:
+        if disk_cache is None:
+            disk_cache = read_disk_cache()
+        level_names = disk_cache.setdefault(str(level), {})
+        new_names = [name for name in misses if name not in level_names]
+        if new_names:
+            demangled_names = demangle(new_names)
+            shortened_names = {
+                name: shorten_name(demangled_name, level)
+                for name, demangled_name in zip(new_names, demangled_names)
+            }
+            level_names.update(shortened_names)
+            new_disk_names.setdefault(str(level), {}).update(shortened_names)
+        for name in misses:
+            short_names[name] = level_names[name]
+            cache[(level, name)] = level_names[name]
+        while len(cache) > cache_size_cap:
+            cache.popitem(last=False)
+
+    return short_names
 
 
 # Note: shortener is now dependent on a rocprof install with llvm
 def kernel_name_shortener(df, level):
     def shorten_file(df, level):
-        global cache
-
         column_name = ""
         if "Kernel_Name" in df:
             column_name = "Kernel_Name"
@@ -45,81 +266,13 @@ def kernel_name_shortener(df, level):
             column_name = "Name"
 
         if column_name == "Kernel_Name" or column_name == "Name":
-            # loop through all indices
-            for index in df.index:
-                original_name = df.loc[index, column_name]
-                if original_name in cache:
-                    continue
-
-                cmd = [cpp_filt, original_name]
-
-                proc = subprocess.Popen(
-                    cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-                )
-
-                demangled_name, e = proc.communicate()
-                demangled_name = str(demangled_name, "UTF-8").strip()
-
-                # cache miss, add the shortened name to the dictionary
-                new_name = ""
-                matches = ""
-
-                names_and_args = re.compile(
-                    r"(?P<name>[( )A-Za-z0-9_]+)([ ,*<>()]+)(::)?"
-                )
-
-                # works for name Kokkos::namespace::init_lock_array_kernel_threadid(int) [clone .kd]
-                if names_and_args.search(demangled_name):
-                    matches = names_and_args.findall(demangled_name)
-                else:
-                    # Works for first case  '__amd_rocclr_fillBuffer.kd'
-                    cache[original_name] = new_name
-                    if new_name == None or new_name == "":
-                        cache[original_name] = demangled_name
-                    continue
-
-                current_level = 0
-                for name in matches:
-                    ##can cause errors if a function name or argument is equal to 'clone'
-                    if name[0] == "clone":
-                        continue
-                    if len(name) == 3:
-                        if name[2] == "::":
-                            continue
-
-                    if current_level < level:
-                        new_name += name[0]
-                    # closing '>' is to be taken account by the while loop
-                    if name[1].count(">") == 0:
-                        if current_level < level:
-                            if not (
-                                current_level == level - 1 and name[1].count("<") > 0
-                            ):
-                                new_name += name[1]
-                        current_level += name[1].count("<")
-
-                    curr_index = 0
-                    # cases include '>'  '> >, ' have to go in depth here to not lose account of commas and current level
-                    while name[1].count(">") > 0 and curr_index < len(name[1]):
-                        if current_level < level:
-                            new_name += name[1][curr_index:]
-                            current_level -= name[1][curr_index:].count(">")
-                            curr_index = len(name[1])
-                        elif name[1][curr_index] == (">"):
-                            current_level -= 1
-                        curr_index += 1
-
-                cache[original_name] = new_name
-                if new_name == None or new_name == "":
-                    cache[original_name] = demangled_name
-
-            df[column_name] = df[column_name].map(cache)
+            short_names = shorten_names(list(df[column_name].unique()), level)
+            df[column_name] = df[column_name].map(short_names)
 
         return df
 
     # Only shorten if valid shortening level
     if level < 5:
-        cpp_filt = os.path.join("/usr", "bin", "c++filt")
         if not os.path.isfile(cpp_filt):
             console_error(
                 "Could not resolve c++filt in expected directory: %s" % cpp_filt
@@ -127,7 +280,7 @@ def kernel_name_shortener(df, level):
 
         try:
             modified_df = shorten_file(df, level)
-            console_log("profiling", "Kernel_Name shortening complete.")
+            console_log("analysis", "Kernel_Name shortening complete.")
             return modified_df
         except pd.errors.EmptyDataError:
-            console_debug("profiling", "Skipping shortening on empty csv")
+            console_debug("analysis", "Skipping shortening on empty csv")
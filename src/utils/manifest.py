@@ -0,0 +1,223 @@
+##############################################################################bl
+# MIT License
+#
+# Copyright (c) 2021 - 2024 Advanced Micro Devices, Inc. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+##############################################################################el
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils import schema
+
+# NB:
+#   A manifest indexes the raw pmc csv files of a workload dir: their rows,
+#   columns and checksums, plus the kernel, gpu and dispatch tables analyze
+#   lists. It is written at the end of profiling and by the convert mode.
+#   Analyze only reads it, as workload dirs may be shared or read-only.
+#   Validation, listing and the analysis cache key then read one small json
+#   file instead of the raw data.
+#   A manifest is only used while all indexed files keep their size and
+#   mtime, and no pmc csv file is added or removed.
+manifest_file_name = "pmc_manifest.json"
+
+# Bump it whenever the manifest format changes
+manifest_format_version = 1
+
+# Rows of pmc_perf.csv read at a time while building a manifest
+manifest_chunk_size = 10000
+
+# pmc_perf.csv columns the kernel and dispatch tables are built from
+manifest_key_columns = [
+    "Dispatch_ID",
+    "Kernel_Name",
+    "GPU_ID",
+    "Start_Timestamp",
+    "End_Timestamp",
+]
+
+
+def list_pmc_csv_files(dir):
+    """
+    List the raw pmc csv files under a workload dir, relative to it.
+    """
+    files = []
+    for root, dirs, names in os.walk(dir):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in names:
+            stem, suffix = os.path.splitext(name)
+            if suffix == ".csv" and (
+                stem.startswith("SQ") or stem == schema.pmc_perf_file_prefix
+            ):
+                files.append(os.path.relpath(os.path.join(root, name), dir))
+    return sorted(files)
+
+
+def get_file_stat(f):
+    st = os.stat(f)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def get_file_checksum(f):
+    h = hashlib.sha256()
+    with open(f, "rb") as fp:
+        for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def build_manifest(dir):
+    """
+    Index the raw pmc csv files of a workload dir. pmc_perf.csv is read in
+    chunks, the other files one column at a time.
+    """
+    files = {}
+    manifest = {"format": manifest_format_version, "files": files}
+    for name in list_pmc_csv_files(dir):
+        f = os.path.join(dir, name)
+        info = get_file_stat(f)
+        info["sha256"] = get_file_checksum(f)
+        try:
+            info["columns"] = pd.read_csv(f, nrows=0).columns.tolist()
+        except pd.errors.EmptyDataError:
+            info["columns"] = []
+        if name != schema.pmc_perf_file_prefix + ".csv":
+            info["rows"] = len(pd.read_csv(f, usecols=[0])) if info["columns"] else 0
+        files[name] = info
+
+    pmc_perf = schema.pmc_perf_file_prefix + ".csv"
+    if pmc_perf not in files:
+        return manifest
+    if not files[pmc_perf]["columns"]:
+        files[pmc_perf]["rows"] = 0
+        manifest["complete"] = False
+        return manifest
+
+    key_dfs = []
+    complete = False
+    for chunk in pd.read_csv(os.path.join(dir, pmc_perf), chunksize=manifest_chunk_size):
+        complete = complete or not chunk.dropna().empty
+        key_dfs.append(chunk[[c for c in manifest_key_columns if c in chunk.columns]])
+    dispatches = pd.concat(key_dfs) if key_dfs else pd.DataFrame()
+    files[pmc_perf]["rows"] = len(dispatches)
+    manifest["complete"] = complete
+
+    if not all(c in dispatches.columns for c in manifest_key_columns):
+        return manifest
+
+    # Same stats as file_io.create_df_kernel_top_stats(), in ns
+    exe_time = dispatches["End_Timestamp"] - dispatches["Start_Timestamp"]
+    grouped = exe_time.groupby(dispatches["Kernel_Name"]).agg(
+        ["count", "sum", "mean", "median"]
+    )
+    manifest["kernels"] = {
+        "Kernel_Name": grouped.index.tolist(),
+        "Count": grouped["count"].tolist(),
+        "Sum": grouped["sum"].tolist(),
+        "Mean": grouped["mean"].tolist(),
+        "Median": grouped["median"].tolist(),
+    }
+    manifest["gpu_ids"] = sorted(dispatches["GPU_ID"].unique().tolist())
+
+    # Dispatches as runs of consecutive ids of one kernel on one gpu:
+    # [1st Dispatch_ID, count, index in kernels, GPU_ID]
+    ids = dispatches["Dispatch_ID"].to_numpy()
+    kernel_ids = grouped.index.get_indexer(dispatches["Kernel_Name"])
+    gpu_ids = dispatches["GPU_ID"].to_numpy()
+    starts = np.flatnonzero(
+        np.r_[
+            True,
+            (np.diff(ids) != 1) | (np.diff(kernel_ids) != 0) | (np.diff(gpu_ids) != 0),
+        ]
+    )[: len(ids)]
+    manifest["dispatch_runs"] = np.column_stack(
+        [
+            ids[starts],
+            np.diff(np.r_[starts, len(ids)]),
+            kernel_ids[starts],
+            gpu_ids[starts],
+        ]
+    ).tolist()
+    return manifest
+
+
+def save_manifest(dir):
+    """
+    Build and write the manifest of a workload dir.
+    """
+    manifest = build_manifest(dir)
+    f = os.path.join(dir, manifest_file_name)
+    with open(f + ".tmp", "w") as fp:
+        json.dump(manifest, fp)
+    os.replace(f + ".tmp", f)
+    return manifest
+
+
+def load_manifest(dir):
+    """
+    Return the manifest of a workload dir, or None if it is missing, of
+    another format, or stale.
+    """
+    try:
+        with open(os.path.join(dir, manifest_file_name)) as fp:
+            manifest = json.load(fp)
+    except (OSError, ValueError):
+        return None
+    if (
+        not isinstance(manifest, dict)
+        or manifest.get("format") != manifest_format_version
+    ):
+        return None
+    if sorted(manifest["files"]) != list_pmc_csv_files(dir):
+        return None
+    for name, info in manifest["files"].items():
+        stat = get_file_stat(os.path.join(dir, name))
+        if stat["size"] != info["size"] or stat["mtime_ns"] != info["mtime_ns"]:
+            return None
+    return manifest
+
+
+def get_dispatch_table(manifest, kernel_names=None):
+    """
+    Expand the dispatch runs of a manifest into a [Dispatch_ID, Kernel_Name,
+    GPU_ID] df, in the order of pmc_perf.csv. kernel_names replaces the names
+    of the manifest kernels, e.g. with shortened ones. Return None if the
+    manifest has no dispatch table.
+    """
+    if "dispatch_runs" not in manifest:
+        return None
+    if kernel_names is None:
+        kernel_names = manifest["kernels"]["Kernel_Name"]
+    runs = np.array(manifest["dispatch_runs"], dtype=np.int64).reshape(-1, 4)
+    first, counts, kernel_ids, gpu_ids = runs.T
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return pd.DataFrame(
+        {
+            "Dispatch_ID": np.repeat(first, counts) + offsets,
+            "Kernel_Name": np.array(kernel_names, dtype=object)[
+                np.repeat(kernel_ids, counts)
+            ],
+            "GPU_ID": np.repeat(gpu_ids, counts),
+        }
+    )
@@ -23,17 +23,20 @@
 ##############################################################################el
 
 import ast
+import functools
 import os
 import re
+import sys
+import threading
 import warnings
+from collections import OrderedDict
 from pathlib import Path
 
-import astunparse
 import numpy as np
 import pandas as pd
 
-from utils import schema
-from utils.utils import console_error, console_warning, demarcate
+from utils import filter_index, schema
+from utils.utils import console_debug, console_error, console_warning, demarcate
 
 # ------------------------------------------------------------------------------
 # Internal global definitions
@@ -103,8 +106,26 @@ supported_call = {
     "MOD": "to_mod",
     # Concat operation from the memory chart "active cus"
     "CONCAT": "to_concat",
+    # Summary stats of simple_box tables
+    "BOX": "to_box",
 }
 
+# Columns of simple_box metric tables and their quantiles. All of them come
+# from a single quantile call on the box expr, so extra percentiles, such as
+# "P90": 0.9, only cost one more entry here and in schema.supported_field.
+simple_box = {
+    "Min": 0.0,
+    "Q1": 0.25,
+    "Median": 0.5,
+    "Q3": 0.75,
+    "Max": 1.0,
+}
+
+# Max number of metric expressions kept compiled in memory. The caches are
+# process wide, so they are shared by all runs in a multi -p comparison and
+# by every GUI callback.
+metric_cache_size = 16384
+
 # ------------------------------------------------------------------------------
 
 
@@ -203,16 +224,179 @@ def to_concat(a, b):
     return str(a) + str(b)
 
 
+def to_box(a):
+    if a is None:
+        return None
+    elif isinstance(a, pd.core.series.Series):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            box = a.quantile(list(simple_box.values()))
+        box.index = list(simple_box.keys())
+        return box
+    else:
+        raise Exception("to_box: unsupported type.")
+
+
+# NB:
+#   Per-dispatch evaluation reuses the same compiled metric expressions, with
+#   these functions in place of the aggregates. Every dispatch is a sample of
+#   its own, so an aggregate returns its input as it is, and MIN/MAX of
+#   several args are element-wise.
+def per_dispatch_aggr(a, *args):
+    return a
+
+
+def per_dispatch_min(*args):
+    if len(args) == 1:
+        return args[0]
+    return functools.reduce(np.minimum, args)
+
+
+def per_dispatch_max(*args):
+    if len(args) == 1:
+        return args[0]
+    return functools.reduce(np.maximum, args)
+
+
+def per_dispatch_std(a):
+    # The std of a single sample is not defined
+    if isinstance(a, pd.core.series.Series):
+        return pd.Series(np.nan, index=a.index)
+    return np.nan
+
+
+def per_dispatch_int(a):
+    # Truncate like int() does for a single value
+    if isinstance(a, pd.core.series.Series):
+        return np.trunc(a.astype("float64"))
+    return to_int(a)
+
+
+def per_dispatch_box(a):
+    return {k: a for k in simple_box.keys()}
+
+
+per_dispatch_call = {
+    "to_min": per_dispatch_min,
+    "to_max": per_dispatch_max,
+    "to_avg": per_dispatch_aggr,
+    "to_median": per_dispatch_aggr,
+    "to_std": per_dispatch_std,
+    "to_quantile": per_dispatch_aggr,
+    "to_int": per_dispatch_int,
+    "to_box": per_dispatch_box,
+}
+
+
+def build_group_call(codes):
+    """
+    Build the functions of supported_call to evaluate metrics per group of
+    dispatches, e.g. per kernel, with codes as the group number of each
+    dispatch. Aggregates are reduced within each group and broadcast back,
+    so all values stay aligned with the dispatches, constant in a group.
+    """
+    num_groups = codes.max() + 1 if len(codes) else 0
+
+    def to_values(a):
+        return a.to_numpy(dtype=np.float64, na_value=np.nan)
+
+    def broadcast(a, group_values):
+        return pd.Series(group_values[codes], index=a.index)
+
+    # NB: mean/min/max are the most common aggregates by far, so reduce them
+    #     with numpy on the precomputed codes, not a groupby per call.
+    def group_mean(a):
+        if not isinstance(a, pd.core.series.Series):
+            return to_avg(a)
+        v = to_values(a)
+        valid = ~np.isnan(v)
+        sums = np.bincount(codes[valid], weights=v[valid], minlength=num_groups)
+        counts = np.bincount(codes[valid], minlength=num_groups)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return broadcast(a, sums / counts)
+
+    def group_extreme(ufunc, fallback):
+        def f(*args):
+            if len(args) != 1 or not isinstance(args[0], pd.core.series.Series):
+                return fallback(*args)
+            # fmin/fmax skip NaN like pandas min/max
+            group_values = np.full(num_groups, np.nan)
+            ufunc.at(group_values, codes, to_values(args[0]))
+            return broadcast(args[0], group_values)
+
+        return f
+
+    def group_aggr(how, fallback):
+        def f(a, *args):
+            if not isinstance(a, pd.core.series.Series):
+                return fallback(a, *args)
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", category=RuntimeWarning)
+                return a.groupby(codes).transform(how, *args)
+
+        return f
+
+    def group_box(a):
+        if not isinstance(a, pd.core.series.Series):
+            return to_box(a)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            box = a.groupby(codes).quantile(list(simple_box.values())).unstack()
+        box = box.reindex(range(num_groups))
+        return {
+            k: broadcast(a, box[q].to_numpy(dtype=np.float64))
+            for k, q in simple_box.items()
+        }
+
+    return {
+        "to_min": group_extreme(np.fmin, per_dispatch_min),
+        "to_max": group_extreme(np.fmax, per_dispatch_max),
+        "to_avg": group_mean,
+        "to_median": group_aggr("median", to_median),
+        "to_std": group_aggr("std", to_std),
+        "to_quantile": group_aggr("quantile", to_quantile),
+        "to_int": per_dispatch_int,
+        "to_box": group_box,
+    }
+
+
+# Fields of the per-dispatch metric matrix. The first one found is the value
+# of a metric. These ones are equal to it per dispatch, so they are skipped.
+per_dispatch_value_fields = ["Avg", "Value", "Mean", "Average", "Median"]
+per_dispatch_skip_fields = ["Min", "Max", "Minimum", "Maximum", "Q1", "Q3", "Std Dev"]
+
+
+def get_subscript_index(node):
+    """
+    Return the index of a subscript node. Python < 3.9 wraps it in ast.Index.
+    """
+    if sys.version_info < (3, 9) and isinstance(node.slice, ast.Index):
+        return node.slice.value
+    return node.slice
+
+
+def make_subscript_index(index):
+    """
+    Return index as the slice of a subscript node, for this Python version.
+    """
+    if sys.version_info < (3, 9):
+        return ast.Index(value=index)
+    return index
+
+
 class CodeTransformer(ast.NodeTransformer):
     """
-    Python AST visitor to transform user defined equation string to df format
+    Python AST visitor to transform user defined equation to df format.
+    The result is the final expression tree, ready to be compiled.
     """
 
+    def __init__(self, coll_level):
+        self.coll_level = coll_level
+        # (coll_level, counter) pairs referenced by the equation
+        self.counters = []
+
     def visit_Call(self, node):
         self.generic_visit(node)
-        # print("--- debug visit_Call --- ", node.args, node.func)
-        # print(astunparse.dump(node))
-        # print(astunparse.unparse(node))
         if isinstance(node.func, ast.Name):
             if node.func.id in supported_call:
                 node.func.id = supported_call[node.func.id]
@@ -224,25 +408,33 @@ class CodeTransformer(ast.NodeTransformer):
 
     def visit_IfExp(self, node):
         self.generic_visit(node)
-        # print("visit_IfExp", type(node.test), type(node.body), type(node.orelse), dir(node))
 
-        if isinstance(node.body, ast.Num):
+        if isinstance(node.body, ast.Constant) and isinstance(
+            node.body.value, (int, float)
+        ):
             raise Exception(
                 "Don't support body of IF with number only! Has to be expr with df['column']."
             )
 
-        new_node = ast.Expr(
-            value=ast.Call(
-                func=ast.Attribute(value=node.body, attr="where", ctx=ast.Load()),
-                args=[node.test, node.orelse],
-                keywords=[],
-            )
+        return ast.Call(
+            func=ast.Attribute(value=node.body, attr="where", ctx=ast.Load()),
+            args=[node.test, node.orelse],
+            keywords=[],
         )
-        # print("-------------")
-        # print(astunparse.dump(new_node))
-        # print("-------------")
 
-        return new_node
+    # NB:
+    # Counter names with index, such as TCC_HIT[0], are a single column in
+    # df, the target is df['TCC_HIT[0]'].
+    def visit_Subscript(self, node):
+        index = get_subscript_index(node)
+        if (
+            self.is_counter(node.value)
+            and isinstance(index, ast.Constant)
+            and isinstance(index.value, int)
+        ):
+            return self.get_counter("{}[{}]".format(node.value.id, index.value))
+        self.generic_visit(node)
+        return node
 
     # NB:
     # visit_Name is for replacing HW counter to its df expr. In this way, we
@@ -255,65 +447,75 @@ class CodeTransformer(ast.NodeTransformer):
     #   - The 'raw_pmc_df' is hack code. For other data sources, like wavefront
     #     data,We need to think about template or pass it as a parameter.
     def visit_Name(self, node):
-        self.generic_visit(node)
-        # print("-------------", node.id)
-        if (not node.id.startswith("ammolite__")) and (not node.id in supported_call):
-            new_node = ast.Subscript(
-                value=ast.Name(id="raw_pmc_df", ctx=ast.Load()),
-                slice=ast.Index(value=ast.Str(s=node.id)),
-                ctx=ast.Load(),
-            )
-
-            node = new_node
+        if self.is_counter(node):
+            return self.get_counter(node.id)
         return node
 
+    @staticmethod
+    def is_counter(node):
+        return (
+            isinstance(node, ast.Name)
+            and not node.id.startswith("ammolite__")
+            and not node.id in supported_call
+        )
 
-def build_eval_string(equation, coll_level):
+    def get_counter(self, counter):
+        """
+        Build raw_pmc_df.get(coll_level).get(counter). Use .get() to catch
+        any potential KeyErrors.
+        """
+        self.counters.append((self.coll_level, counter))
+        df = ast.Name(id="raw_pmc_df", ctx=ast.Load())
+        for key in (self.coll_level, counter):
+            df = ast.Call(
+                func=ast.Attribute(value=df, attr="get", ctx=ast.Load()),
+                args=[ast.Constant(value=key)],
+                keywords=[],
+            )
+        return df
+
+
+def build_eval_tree(equation, coll_level, transformer=None):
     """
-    Convert user defined equation string to eval executable string
+    Convert user defined equation string to eval executable expression tree
     For example,
         input: AVG(100  * SQ_ACTIVE_INST_SCA / ( GRBM_GUI_ACTIVE * $numCU ))
-        output: to_avg(100 * raw_pmc_df["pmc_perf"]["SQ_ACTIVE_INST_SCA"] / \
-                 (raw_pmc_df["pmc_perf"]["GRBM_GUI_ACTIVE"] * numCU))
+        output: to_avg(100 * raw_pmc_df.get("pmc_perf").get("SQ_ACTIVE_INST_SCA") / \
+                 (raw_pmc_df.get("pmc_perf").get("GRBM_GUI_ACTIVE") * ammolite__numCU))
         input: AVG(((TCC_EA_RDREQ_LEVEL_31 / TCC_EA_RDREQ_31) if (TCC_EA_RDREQ_31 != 0) else (0)))
-        output: to_avg((raw_pmc_df["pmc_perf"]["TCC_EA_RDREQ_LEVEL_31"] / raw_pmc_df["pmc_perf"]["TCC_EA_RDREQ_31"]).where(raw_pmc_df["pmc_perf"]["TCC_EA_RDREQ_31"] != 0, 0))
+        output: to_avg((raw_pmc_df.get("pmc_perf").get("TCC_EA_RDREQ_LEVEL_31") / raw_pmc_df.get("pmc_perf").get("TCC_EA_RDREQ_31")).where(raw_pmc_df.get("pmc_perf").get("TCC_EA_RDREQ_31") != 0, 0))
         We can not handle the below for now,
         input: AVG((0 if (TCC_EA_RDREQ_31 == 0) else (TCC_EA_RDREQ_LEVEL_31 / TCC_EA_RDREQ_31)))
         But potential workaound is,
-        output: to_avg(raw_pmc_df["pmc_perf"]["TCC_EA_RDREQ_31"].where(raw_pmc_df["pmc_perf"]["TCC_EA_RDREQ_31"] == 0, raw_pmc_df["pmc_perf"]["TCC_EA_RDREQ_LEVEL_31"] / raw_pmc_df["pmc_perf"]["TCC_EA_RDREQ_31"]))
+        output: to_avg(raw_pmc_df.get("pmc_perf").get("TCC_EA_RDREQ_31").where(raw_pmc_df.get("pmc_perf").get("TCC_EA_RDREQ_31") == 0, raw_pmc_df.get("pmc_perf").get("TCC_EA_RDREQ_LEVEL_31") / raw_pmc_df.get("pmc_perf").get("TCC_EA_RDREQ_31")))
+    Return None for empty equation. The tree is built fresh for every call,
+    so callers are free to transform it further.
     """
 
     if coll_level is None:
         raise Exception("Error: coll_level can not be None.")
 
     if not equation:
-        return ""
-
-    s = str(equation)
-    # print("input:", s)
+        return None
 
     # build-in variable starts with '$', python can not handle it.
     # replace '$' with 'ammolite__'.
     # TODO: pre-check there is no "ammolite__" in all config files.
-    s = re.sub(r"\$", "ammolite__", s)
-
-    # convert equation string to intermediate expression in df array format
-    ast_node = ast.parse(s)
-    # print(astunparse.dump(ast_node))
-    transformer = CodeTransformer()
-    transformer.visit(ast_node)
-
-    s = astunparse.unparse(ast_node)
-
-    # correct column name/label in df with [], such as TCC_HIT[0],
-    # the target is df['TCC_HIT[0]']
-    s = re.sub(r"\'\]\[(\d+)\]", r"[\g<1>]']", s)
-    # use .get() to catch any potential KeyErrors
-    s = re.sub(r"raw_pmc_df\['(.*?)']", r'raw_pmc_df.get("\1")', s)
-    # apply coll_level
-    s = re.sub(r"raw_pmc_df", "raw_pmc_df.get('" + coll_level + "')", s)
-    # print("--- build_eval_string, return: ", s)
-    return s
+    s = str(equation).strip().replace("$", "ammolite__")
+
+    if transformer is None:
+        transformer = CodeTransformer(coll_level)
+    return transformer.visit(ast.parse(s, mode="eval").body)
+
+
+@functools.lru_cache(maxsize=metric_cache_size)
+def get_eval_counters(equation, coll_level):
+    """
+    Return the (coll_level, counter) pairs referenced by the equation.
+    """
+    transformer = CodeTransformer(coll_level)
+    build_eval_tree(equation, coll_level, transformer)
+    return tuple(transformer.counters)
 
 
 def update_denom_string(equation, unit):
@@ -331,6 +533,140 @@ def update_denom_string(equation, unit):
     return s
 
 
+@functools.lru_cache(maxsize=metric_cache_size)
+def compile_eval_tree(equation, coll_level):
+    """
+    Compile user defined equation straight to code object, without any text
+    round trip. Memoized, so each distinct expression is compiled only once
+    per process.
+    """
+    tree = ast.Expression(body=build_eval_tree(equation, coll_level))
+    return compile(ast.fix_missing_locations(tree), "<metric>", "eval")
+
+
+class MetricDAG(ast.NodeTransformer):
+    """
+    Hash-consed DAG of all metric expressions. Identical sub-expressions,
+    within one metric or across all panels, are folded into one node, so
+    each of them is evaluated only once per workload.
+    Every node is compiled on its own, with its children replaced by
+    ammolite__cse[node_id] lookups into a MetricValues memo.
+    """
+
+    # NB: names and constants are cheaper to eval than to look up, so only
+    #     these node types become shared nodes.
+    node_types = (
+        ast.BinOp,
+        ast.UnaryOp,
+        ast.BoolOp,
+        ast.Compare,
+        ast.Call,
+        ast.Subscript,
+    )
+
+    def __init__(self):
+        self.codes = []
+        # the folded tree of each node, i.e. with its children as cse lookups
+        self.nodes = []
+        self.node_ids = {}
+        self.roots = {}
+        # NB: GUI callbacks run on threads, and may add to a shared DAG at
+        #     the same time
+        self.lock = threading.Lock()
+
+    def add(self, equation, coll_level):
+        """
+        Add an equation to the DAG and return the id of its root node.
+        """
+        key = (equation, coll_level)
+        if key not in self.roots:
+            with self.lock:
+                if key not in self.roots:
+                    body = self.visit(build_eval_tree(equation, coll_level))
+                    if hasattr(body, "node_id"):
+                        self.roots[key] = body.node_id
+                    else:
+                        self.roots[key] = self.add_node(body)
+        return self.roots[key]
+
+    def add_node(self, node):
+        key = ast.dump(node)
+        if key not in self.node_ids:
+            code = ast.fix_missing_locations(ast.Expression(body=node))
+            self.node_ids[key] = len(self.codes)
+            self.codes.append(compile(code, "<metric>", "eval"))
+            self.nodes.append(node)
+        return self.node_ids[key]
+
+    def generic_visit(self, node):
+        # Post-order: children are folded before their parent is keyed
+        node = super().generic_visit(node)
+        if isinstance(node, self.node_types):
+            node_id = self.add_node(node)
+            node = ast.Subscript(
+                value=ast.Name(id="ammolite__cse", ctx=ast.Load()),
+                slice=make_subscript_index(ast.Constant(value=node_id)),
+                ctx=ast.Load(),
+            )
+            node.node_id = node_id
+        return node
+
+
+class MetricValues:
+    """
+    Per-workload memo of MetricDAG node values. Node values are evaluated
+    lazily on first lookup. Errors are memoized too and raised again for
+    every metric that depends on the failed node.
+    """
+
+    def __init__(self, dag, scope):
+        self.dag = dag
+        self.scope = dict(scope)
+        self.scope["ammolite__cse"] = self
+        self.results = {}
+
+    def __getitem__(self, node_id):
+        if node_id not in self.results:
+            try:
+                value = eval(self.dag.codes[node_id], globals(), self.scope)
+                self.results[node_id] = (True, value)
+            except Exception as e:
+                self.results[node_id] = (False, e)
+        ok, value = self.results[node_id]
+        if not ok:
+            raise value
+        return value
+
+    def eval(self, equation, coll_level):
+        return self[self.dag.add(equation, coll_level)]
+
+
+# Max number of arch configs whose metric DAG is kept in memory
+metric_dag_cache_size = 4
+
+# [gpu_arch: MetricDAG] pairs, least recently used first
+metric_dags = OrderedDict()
+metric_dags_lock = threading.Lock()
+
+
+def get_metric_dag(sys_info):
+    """
+    Return the metric DAG of the arch config of a workload, shared by all
+    runs of that arch in a multi -p comparison and by GUI callbacks.
+    A DAG only holds the expressions of one arch config, and is started
+    over once it holds metric_cache_size nodes. Callers keep the returned
+    DAG for a whole evaluation, as its node ids are only valid in it.
+    """
+    with metric_dags_lock:
+        dag = metric_dags.pop(sys_info.gpu_arch, None)
+        if dag is None or len(dag.codes) >= metric_cache_size:
+            dag = MetricDAG()
+        metric_dags[sys_info.gpu_arch] = dag
+        while len(metric_dags) > metric_dag_cache_size:
+            metric_dags.popitem(last=False)
+        return dag
+
+
 def update_normUnit_string(equation, unit):
     """
     Update $normUnit in equation with runtime normalization unit.
@@ -413,6 +749,44 @@ def gen_counter_list(formula):
     return visited, counters
 
 
+def get_formula_counters(formula):
+    """
+    Return the counters a formula is derived from, through build-in vars too.
+    """
+    counters = set()
+    for counter in gen_counter_list(formula)[1]:
+        if counter in build_in_vars:
+            counters |= get_formula_counters(build_in_vars[counter])
+        else:
+            counters.add(counter)
+    return counters
+
+
+def get_metric_counters(archConfigs):
+    """
+    Return the counters the metric tables built by build_dfs() are derived
+    from, and the collection levels other than pmc_perf they are read at.
+    Counters of the build-in vars and of every normalization unit are always
+    included, since all workloads evaluate them.
+    """
+    counters = set()
+    for formula in list(build_in_vars.values()) + list(supported_denom.values()):
+        counters |= get_formula_counters(formula)
+
+    coll_levels = set()
+    for id, df in archConfigs.dfs.items():
+        if archConfigs.dfs_type[id] != "metric_table":
+            continue
+        for expr in df.columns:
+            if expr in schema.supported_field:
+                for formula in df[expr]:
+                    counters |= get_formula_counters(formula)
+        if "coll_level" in df.columns:
+            coll_levels.update(df["coll_level"])
+    coll_levels.discard(schema.pmc_perf_file_prefix)
+    return counters, coll_levels
+
+
 def calc_builtin_var(var, sys_info):
     """
     Calculate build-in variable based on sys_info:
@@ -440,14 +814,6 @@ def build_dfs(archConfigs, filter_metrics, sys_info):
     #         if not metric in avail_ip_blocks:
     #             print("{} is not a valid metric to filter".format(metric))
     #             exit(1)
-    simple_box = {
-        "Min": ["MIN(", ")"],
-        "Q1": ["QUANTILE(", ", 0.25)"],
-        "Median": ["MEDIAN(", ")"],
-        "Q3": ["QUANTILE(", ", 0.75)"],
-        "Max": ["MAX(", ")"],
-    }
-
     d = {}
     metric_list = {}
     dfs_type = {}
@@ -516,7 +882,7 @@ def build_dfs(archConfigs, filter_metrics, sys_info):
                     if "tips" in data_config["header"].keys():
                         headers.append(data_config["header"]["tips"])
 
-                    df = pd.DataFrame(columns=headers)
+                    rows = []
 
                     i = 0
                     for key, entries in data_config["metric"].items():
@@ -555,8 +921,11 @@ def build_dfs(archConfigs, filter_metrics, sys_info):
                                 # print("~~~~~~~~~~~~~~~~~")
                                 for k, v in entries.items():
                                     if k == "expr":
-                                        for bk, bv in simple_box.items():
-                                            values.append(bv[0] + v + bv[1])
+                                        # NB: every box column indexes the
+                                        #   same BOX() node, which is
+                                        #   evaluated once per workload.
+                                        for bk in simple_box.keys():
+                                            values.append("BOX({})['{}']".format(v, bk))
                                     else:
                                         if (
                                             k != "tips"
@@ -584,8 +953,7 @@ def build_dfs(archConfigs, filter_metrics, sys_info):
 
                             # print(headers, values)
                             # print(key, entries)
-                            df_new_row = pd.DataFrame([values], columns=headers)
-                            df = pd.concat([df, df_new_row])
+                            rows.append(values)
 
                         # collect metric_list
                         metric_list[metric_idx] = key
@@ -605,6 +973,9 @@ def build_dfs(archConfigs, filter_metrics, sys_info):
 
                         i += 1
 
+                    # NB: build it in one shot, appending rows one at a time
+                    #     is quadratic for the per-channel tables
+                    df = pd.DataFrame(rows, columns=headers, dtype=object)
                     df.set_index("Metric_ID", inplace=True)
                     # df.set_index('Metric', inplace=True)
                     # print(tabulate(df, headers='keys', tablefmt='fancy_grid'))
@@ -650,30 +1021,100 @@ def build_metric_value_string(dfs, dfs_type, normal_unit):
         if dfs_type[id] == "metric_table":
             for expr in df.columns:
                 if expr in schema.supported_field:
-                    # NB: apply all build-in before building the whole string
                     df[expr] = df[expr].apply(update_denom_string, unit=normal_unit)
 
-                    # NB: there should be a faster way to do with single apply
-                    if not df.empty:
-                        for i in range(df.shape[0]):
-                            row_idx_label = df.index.to_list()[i]
-                            # print(i, "row_idx_label", row_idx_label, expr)
-                            if expr.lower() != "alias":
-                                df.at[row_idx_label, expr] = build_eval_string(
-                                    df.at[row_idx_label, expr],
-                                    df.at[row_idx_label, "coll_level"],
-                                )
-
                 elif expr.lower() == "unit" or expr.lower() == "units":
                     df[expr] = df[expr].apply(update_normUnit_string, unit=normal_unit)
 
         # print(tabulate(df, headers='keys', tablefmt='fancy_grid'))
 
 
+def build_norm_dfs(dfs, dfs_type, normal_units=supported_denom.keys()):
+    """
+    Build a copy of all metric_table dfs for each normalization unit, from
+    the templates before build_metric_value_string(). Evaluated together in
+    eval_metric(), every unit independent sub-expression, e.g. the numerator
+    of each $denom, is evaluated once for all units.
+    """
+    norm_dfs = {}
+    for unit in normal_units:
+        norm_dfs[unit] = {
+            id: df.copy() for id, df in dfs.items() if dfs_type[id] == "metric_table"
+        }
+        build_metric_value_string(norm_dfs[unit], dfs_type, unit)
+    return norm_dfs
+
+
+def select_normal_unit(workload, normal_unit):
+    """
+    Switch the metric tables of an evaluated workload to another
+    normalization unit. It is a lookup, without any re-evaluation.
+    """
+    workload.dfs.update(workload.norm_dfs[normal_unit])
+
+
+def build_metric_scope(sys_info, raw_pmc_df, calls=None, build_in=None):
+    """
+    Build the names all metric expressions are evaluated against: the raw
+    pmc columns, the sys_info vars and the derived build-in vars. calls
+    replaces the functions of supported_call, e.g. with per_dispatch_call.
+    build_in gives the values of some build-in vars, instead of evaluating
+    them from raw_pmc_df.
+    """
+    scope = dict(calls or {})
+    scope["raw_pmc_df"] = raw_pmc_df
+
+    scope["ammolite__se_per_gpu"] = sys_info.se_per_gpu
+    scope["ammolite__pipes_per_gpu"] = sys_info.pipes_per_gpu
+    scope["ammolite__cu_per_gpu"] = sys_info.cu_per_gpu
+    scope["ammolite__simd_per_cu"] = sys_info.simd_per_cu  # not used
+    scope["ammolite__sqc_per_gpu"] = sys_info.sqc_per_gpu
+    scope["ammolite__lds_banks_per_cu"] = sys_info.lds_banks_per_cu
+    scope["ammolite__cur_sclk"] = sys_info.cur_sclk  # not used
+    scope["ammolite__mclk"] = sys_info.cur_mclk  # not used
+    scope["ammolite__max_sclk"] = sys_info.max_sclk
+    scope["ammolite__max_waves_per_cu"] = sys_info.max_waves_per_cu
+    scope["ammolite__hbm_bw"] = sys_info.hbm_bw
+    scope["ammolite__total_l2_chan"] = calc_builtin_var("$total_l2_chan", sys_info)
+    scope["ammolite__num_xcd"] = sys_info.num_xcd
+    scope["ammolite__wave_size"] = sys_info.wave_size
+
+    # TODO: fix all $normUnit in Unit column or title
+
+    # build and eval all derived build-in global variables
+    ammolite__build_in = {}
+
+    # first pass, we do all per-xcd values, as these are used in subsequent builtins
+    # next pass, we evaluate the builtins the depend on the per-XCD values
+    for per_xcd in (True, False):
+        keys = [key for key in build_in_vars.keys() if ("PER_XCD" in key) == per_xcd]
+        for key in keys:
+            if build_in is not None and key in build_in:
+                ammolite__build_in[key] = build_in[key]
+                continue
+            # NB: assume all built-in vars from pmc_perf.csv for now
+            try:
+                ammolite__build_in[key] = eval(
+                    compile_eval_tree(build_in_vars[key], schema.pmc_perf_file_prefix),
+                    globals(),
+                    scope,
+                )
+            except TypeError:
+                ammolite__build_in[key] = None
+            except AttributeError as ae:
+                if ae == "'NoneType' object has no attribute 'get'":
+                    ammolite__build_in[key] = None
+        for key in keys:
+            scope["ammolite__" + key] = ammolite__build_in[key]
+
+    return scope
+
+
 @demarcate
-def eval_metric(dfs, dfs_type, sys_info, raw_pmc_df, debug):
+def eval_metric(dfs, dfs_type, sys_info, raw_pmc_df, debug, norm_dfs=None):
     """
-    Execute the expr string for each metric in the df.
+    Execute the expr string for each metric in the df, and in the dfs of
+    each normalization unit in norm_dfs if given.
     """
 
     # confirm no illogical counter values (only consider non-roofline runs)
@@ -687,184 +1128,648 @@ def eval_metric(dfs, dfs_type, sys_info, raw_pmc_df, debug):
         console_warning("Dectected GRBM_GUI_ACTIVE == 0")
         console_error("Hauting execution for warning above.")
 
-    ammolite__se_per_gpu = sys_info.se_per_gpu
-    ammolite__pipes_per_gpu = sys_info.pipes_per_gpu
-    ammolite__cu_per_gpu = sys_info.cu_per_gpu
-    ammolite__simd_per_cu = sys_info.simd_per_cu  # not used
-    ammolite__sqc_per_gpu = sys_info.sqc_per_gpu
-    ammolite__lds_banks_per_cu = sys_info.lds_banks_per_cu
-    ammolite__cur_sclk = sys_info.cur_sclk  # not used
-    ammolite__mclk = sys_info.cur_mclk  # not used
-    ammolite__max_sclk = sys_info.max_sclk
-    ammolite__max_waves_per_cu = sys_info.max_waves_per_cu
-    ammolite__hbm_bw = sys_info.hbm_bw
-    ammolite__total_l2_chan = calc_builtin_var("$total_l2_chan", sys_info)
-    ammolite__num_xcd = sys_info.num_xcd
-    ammolite__wave_size = sys_info.wave_size
+    raw_pmc_df = build_pmc_columns(raw_pmc_df)
 
-    # TODO: fix all $normUnit in Unit column or title
+    # NB:
+    #   Build the scope once, so every metric expression is evaluated against
+    #   the same names below, and every shared sub-expression is evaluated
+    #   once for this workload.
+    metric_values = MetricValues(
+        get_metric_dag(sys_info), build_metric_scope(sys_info, raw_pmc_df)
+    )
 
-    # build and eval all derived build-in global variables
-    ammolite__build_in = {}
+    for unit_dfs in [dfs] + list((norm_dfs or {}).values()):
+        for id, df in unit_dfs.items():
+            if dfs_type[id] == "metric_table":
+                eval_metric_table(df, metric_values, debug)
+
+
+def build_pmc_usecols(dfs, dfs_type):
+    """
+    Build the reverse index of pmc columns needed by the metrics in dfs, as
+    [coll_level: set of counters]. It is used to load only those columns
+    when the metric tables are filtered.
+    """
+    # NB: build-in vars are always evaluated, and only from pmc_perf.csv
+    equations = [(v, schema.pmc_perf_file_prefix) for v in build_in_vars.values()]
+    for id, df in dfs.items():
+        if dfs_type[id] == "metric_table":
+            for expr in df.columns:
+                if expr in schema.supported_field and expr.lower() != "alias":
+                    equations.extend(zip(df[expr], df["coll_level"]))
+
+    usecols = {schema.pmc_perf_file_prefix: set()}
+    for equation, coll_level in equations:
+        if equation:
+            for level, counter in get_eval_counters(equation, coll_level):
+                usecols.setdefault(level, set()).add(counter)
+    return usecols
+
+
+class PmcColumns(dict):
+    """
+    [counter: column] dict of one coll_level, filled on lookup. Compact
+    columns are widened once, by schema.widen_pmc_column(), when first used.
+    """
+
+    def __init__(self, sub_df):
+        super().__init__()
+        self.sub_df = sub_df
+
+    def get(self, counter, default=None):
+        if counter not in self:
+            if counter not in self.sub_df.columns:
+                return default
+            self[counter] = schema.widen_pmc_column(self.sub_df[counter])
+        return self[counter]
+
+
+def build_pmc_columns(raw_pmc_df):
+    """
+    Split the raw pmc df into [coll_level: [counter: column]] dicts.
+    Expressions look up counters with raw_pmc_df.get(coll_level).get(counter),
+    so dicts keep the same semantic (None for missing csv or counter)
+    without slicing the MultiIndex df for every counter reference.
+    """
+    columns = {}
+    for coll_level in raw_pmc_df.columns.get_level_values(0).unique():
+        columns[coll_level] = PmcColumns(raw_pmc_df[coll_level])
+    return columns
+
+
+def eval_single_metric(metric_id, equation, coll_level, metric_values):
+    """
+    Evaluate one equation. Return "" for missing counters, missing csv
+    files and NaN results.
+    """
+    try:
+        out = metric_values.eval(equation, coll_level)
+        # Special exception for unique format of Active CUs in mem chart
+        if metric_id != "19.1.1" and np.isnan(out):
+            return ""
+        return out
+    except TypeError:
+        return ""
+    except AttributeError as ae:
+        if str(ae) == "'NoneType' object has no attribute 'get'":
+            return ""
+        console_error("analysis", str(ae))
+
+
+def print_metric_debug_info(expr, equation, coll_level, metric_scope):
+    """
+    Print the expression, its inputs and its output for -g/--debug.
+    """
+    print("~" * 40 + "\nExpression:")
+    print(expr, "=", equation)
+    print("Inputs:")
+    transformer = CodeTransformer(coll_level)
+    tree = build_eval_tree(equation, coll_level, transformer)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id.startswith("ammolite__"):
+            print("Var ", node.id, ":", metric_scope.get(node.id))
+    for level, counter in transformer.counters:
+        c = metric_scope["raw_pmc_df"].get(level, {}).get(counter)
+        print(level, counter)
+        print(c.to_list() if c is not None else None)
+    print("\nOutput:")
+    try:
+        print(eval(compile_eval_tree(equation, coll_level), globals(), metric_scope))
+        print("~" * 40)
+    except TypeError:
+        console_warning(
+            "Skipping entry. Encountered a missing counter\n{} has been assigned to None\n{}".format(
+                expr, np.nan
+            )
+        )
+    except AttributeError as ae:
+        if str(ae) == "'NoneType' object has no attribute 'get'":
+            console_warning(
+                "Skipping entry. Encountered a missing csv\n{}".format(np.nan)
+            )
+        else:
+            console_error("analysis", str(ae))
 
-    # first pass, we do all per-xcd values, as these are used in subsequent builtins
-    for key, value in build_in_vars.items():
-        if "PER_XCD" not in key:
-            continue
-        # NB: assume all built-in vars from pmc_perf.csv for now
-        s = build_eval_string(value, schema.pmc_perf_file_prefix)
-        try:
-            ammolite__build_in[key] = eval(compile(s, "<string>", "eval"))
-        except TypeError:
-            ammolite__build_in[key] = None
-        except AttributeError as ae:
-            if ae == "'NoneType' object has no attribute 'get'":
-                ammolite__build_in[key] = None
-    ammolite__GRBM_GUI_ACTIVE_PER_XCD = ammolite__build_in["GRBM_GUI_ACTIVE_PER_XCD"]
-    ammolite__GRBM_COUNT_PER_XCD = ammolite__build_in["GRBM_COUNT_PER_XCD"]
-    ammolite__GRBM_SPI_BUSY_PER_XCD = ammolite__build_in["GRBM_SPI_BUSY_PER_XCD"]
 
-    for key, value in build_in_vars.items():
-        # next pass, we evaluate the builtins the depend on the per-XCD values
-        if "PER_XCD" in key:
+def eval_metric_table(df, metric_values, debug):
+    """
+    Evaluate the whole metric_table df, one field column at a time, and
+    write each column back in one shot. Numeric columns are stored as
+    float64 with NaN for missing values, instead of mixed ""/float cells.
+    """
+    for expr in df.columns:
+        if expr not in schema.supported_field or expr.lower() == "alias":
             continue
-        # NB: assume all built-in vars from pmc_perf.csv for now
-        s = build_eval_string(value, schema.pmc_perf_file_prefix)
-        try:
-            ammolite__build_in[key] = eval(compile(s, "<string>", "eval"))
-        except TypeError:
-            ammolite__build_in[key] = None
-        except AttributeError as ae:
-            if ae == "'NoneType' object has no attribute 'get'":
-                ammolite__build_in[key] = None
-    ammolite__numActiveCUs = ammolite__build_in["numActiveCUs"]
-    ammolite__kernelBusyCycles = ammolite__build_in["kernelBusyCycles"]
 
-    # Hmmm... apply + lambda should just work
-    # df['Value'] = df['Value'].apply(lambda s: eval(compile(str(s), '<string>', 'eval')))
+        values = []
+        for metric_id, e, c in zip(df.index, df[expr], df["coll_level"]):
+            if e:
+                if debug:  # debug won't impact the regular calc
+                    print_metric_debug_info(expr, e, c, metric_values.scope)
+                values.append(eval_single_metric(metric_id, e, c, metric_values))
+            else:
+                # If not insert nan, the whole col might be treated
+                # as string but not nubmer if there is NONE
+                values.append("")
+
+        df[expr] = to_metric_column(values)
+
+
+def to_metric_column(values):
+    """
+    Convert evaluated values of a field to a typed column. Fall back to an
+    object column if any value is not a number, e.g. CONCAT results.
+    """
+    if all(
+        (isinstance(v, str) and v == "")
+        or (pd.api.types.is_number(v) and not isinstance(v, bool))
+        for v in values
+    ):
+        return np.array(
+            [np.nan if isinstance(v, str) else v for v in values], dtype=np.float64
+        )
+    return values
+
+
+def eval_metric_columns(dfs, dfs_type, metric_values, index, skip_fields=()):
+    """
+    Evaluate every field of every metric in the metric_table dfs, as float64
+    arrays aligned with index, i.e. the dispatches of raw_pmc.
+    Yield (name, array) pairs. A metric is named by its metric id for its
+    value field, or by "<metric id> <field>" for other fields, e.g.
+    "2.1.7 Pct of Peak". Missing counters give NaN. Non-numeric metrics are
+    skipped.
+    """
     for id, df in dfs.items():
-        if dfs_type[id] == "metric_table":
-            for idx, row in df.iterrows():
-                for expr in df.columns:
-                    if expr in schema.supported_field:
-                        if expr.lower() != "alias":
-                            if row[expr]:
-                                if debug:  # debug won't impact the regular calc
-                                    print("~" * 40 + "\nExpression:")
-                                    print(expr, "=", row[expr])
-                                    print("Inputs:")
-                                    matched_vars = re.findall(r"ammolite__\w+", row[expr])
-                                    if matched_vars:
-                                        for v in matched_vars:
-                                            print(
-                                                "Var ",
-                                                v,
-                                                ":",
-                                                eval(compile(v, "<string>", "eval")),
-                                            )
-                                    matched_cols = re.findall(
-                                        r"raw_pmc_df\['\w+'\]\['\w+'\]", row[expr]
-                                    )
-                                    if matched_cols:
-                                        for c in matched_cols:
-                                            m = re.match(
-                                                r"raw_pmc_df\['(\w+)'\]\['(\w+)'\]", c
-                                            )
-                                            t = raw_pmc_df[m.group(1)][
-                                                m.group(2)
-                                            ].to_list()
-                                            print(c)
-                                            print(
-                                                raw_pmc_df[m.group(1)][
-                                                    m.group(2)
-                                                ].to_list()
-                                            )
-                                            # print(
-                                            #     tabulate(raw_pmc_df[m.group(1)][
-                                            #         m.group(2)],
-                                            #              headers='keys',
-                                            #              tablefmt='fancy_grid'))
-                                    print("\nOutput:")
-                                    try:
-                                        print(
-                                            eval(compile(row[expr], "<string>", "eval"))
-                                        )
-                                        print("~" * 40)
-                                    except TypeError:
-                                        console_warning(
-                                            "Skipping entry. Encountered a missing counter\n{} has been assigned to None\n{}".format(
-                                                expr, np.nan
-                                            )
-                                        )
-                                    except AttributeError as ae:
-                                        if (
-                                            str(ae)
-                                            == "'NoneType' object has no attribute 'get'"
-                                        ):
-                                            console_warning(
-                                                "Skipping entry. Encountered a missing csv\n{}".format(
-                                                    np.nan
-                                                )
-                                            )
-                                        else:
-                                            console_error("analysis", str(ae))
-
-                                # print("eval_metric", id, expr)
-                                try:
-                                    out = eval(compile(row[expr], "<string>", "eval"))
-                                    if row.name != "19.1.1" and np.isnan(
-                                        out
-                                    ):  # Special exception for unique format of Active CUs in mem chart
-                                        row[expr] = ""
-                                    else:
-                                        row[expr] = out
-                                except TypeError:
-                                    row[expr] = ""
-                                except AttributeError as ae:
-                                    if (
-                                        str(ae)
-                                        == "'NoneType' object has no attribute 'get'"
-                                    ):
-                                        row[expr] = ""
-                                    else:
-                                        console_error("analysis", str(ae))
+        if dfs_type[id] != "metric_table":
+            continue
+        fields = [
+            f
+            for f in df.columns
+            if f in schema.supported_field
+            and f.lower() != "alias"
+            and f not in skip_fields
+        ]
+        value_field = next((f for f in per_dispatch_value_fields if f in fields), None)
+        rows = zip(df.index, df["coll_level"], *[df[f] for f in fields])
+        for metric_id, coll_level, *equations in rows:
+            for field, equation in zip(fields, equations):
+                if not equation:
+                    continue
+                name = metric_id if field == value_field else metric_id + " " + field
+                try:
+                    value = metric_values.eval(equation, coll_level)
+                except (TypeError, AttributeError):
+                    # missing counters or csv files
+                    value = None
+                except Exception as ex:
+                    console_warning("Skipping metric {}: {}".format(name, ex))
+                    continue
+
+                if isinstance(value, pd.core.series.Series):
+                    if not value.index.equals(index):
+                        value = value.reindex(index)
+                    if not pd.api.types.is_numeric_dtype(value):
+                        value = pd.to_numeric(value, errors="coerce")
+                    yield name, value.to_numpy(dtype=np.float64, na_value=np.nan)
+                elif value is None:
+                    yield name, np.full(len(index), np.nan)
+                elif pd.api.types.is_number(value) and not isinstance(value, bool):
+                    # per workload constants, e.g. peaks from sys_info
+                    yield name, np.full(len(index), value, dtype=np.float64)
+
+
+def eval_per_dispatch(dfs, dfs_type, sys_info, raw_pmc_df):
+    """
+    Evaluate every metric for each dispatch of raw_pmc_df at once.
+    Return a [dispatch x metric] df. The first columns are the dispatch
+    keys from pmc_perf, followed by eval_metric_columns().
+    """
+    dispatches = raw_pmc_df[schema.pmc_perf_file_prefix]
+    metric_values = MetricValues(
+        get_metric_dag(sys_info),
+        build_metric_scope(sys_info, build_pmc_columns(raw_pmc_df), per_dispatch_call),
+    )
 
-                            else:
-                                # If not insert nan, the whole col might be treated
-                                # as string but not nubmer if there is NONE
-                                row[expr] = ""
+    keys = [
+        k for k in ["Node", "Dispatch_ID", "Kernel_Name", "GPU_ID"] if k in dispatches
+    ]
+    columns = {k: dispatches[k].to_numpy() for k in keys}
+    columns.update(
+        eval_metric_columns(
+            dfs, dfs_type, metric_values, dispatches.index, per_dispatch_skip_fields
+        )
+    )
+    return pd.DataFrame(columns, index=dispatches.index)
 
-            # print(tabulate(df, headers='keys', tablefmt='fancy_grid'))
+
+def eval_per_kernel(dfs, dfs_type, sys_info, raw_pmc_df, keys=("Kernel_Name",)):
+    """
+    Evaluate every metric for each group of dispatches of raw_pmc_df with
+    the same keys, e.g. each kernel, at once.
+    Return a [group x metric] df, in order of the first dispatch of each
+    group. The first columns are the keys and the dispatch Count, followed
+    by eval_metric_columns().
+    """
+    dispatches = raw_pmc_df[schema.pmc_perf_file_prefix]
+    codes, groups = pd.MultiIndex.from_arrays([dispatches[k] for k in keys]).factorize()
+    metric_values = MetricValues(
+        get_metric_dag(sys_info),
+        build_metric_scope(
+            sys_info, build_pmc_columns(raw_pmc_df), build_group_call(codes)
+        ),
+    )
+
+    # All values are constant in a group, so take them from its 1st dispatch
+    first = np.unique(codes, return_index=True)[1]
+    columns = {k: groups.get_level_values(i) for i, k in enumerate(keys)}
+    columns["Count"] = np.bincount(codes)
+    for name, values in eval_metric_columns(
+        dfs, dfs_type, metric_values, dispatches.index
+    ):
+        columns[name] = values[first]
+    return pd.DataFrame(columns)
+
+
+# NB:
+#   Streaming evaluation folds every aggregate of the metric DAG, e.g. the
+#   AVG() of a per-dispatch expression, chunk by chunk into an online
+#   aggregate. Only the per-dispatch expressions under an aggregate touch
+#   the raw pmc data, so once all aggregates are final, every metric is
+#   evaluated from them as usual. An aggregate over a value depending on
+#   other aggregates, e.g. AVG(x / $numActiveCUs), needs those to be final
+#   first, so the chunks are read once per such level of nesting.
+stream_aggr_calls = ["to_avg", "to_median", "to_std", "to_quantile", "to_box"]
+# MIN/MAX only aggregate with a single arg
+stream_extreme_calls = ["to_min", "to_max"]
+
+# Max number of centroids each quantile sketch keeps, about 1 / rank error
+stream_sketch_capacity = 4096
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch of (value, weight) centroids. It keeps every
+    value, and is exact, until it holds more than 2 x capacity of them.
+    Then it merges runs of sorted neighbors into capacity centroids of
+    equal weight. Min and max are always exact.
+    """
+
+    def __init__(self, capacity=stream_sketch_capacity):
+        self.capacity = capacity
+        self.values = []
+        self.weights = []
+        self.size = 0
+        self.exact = True
+        self.min = np.nan
+        self.max = np.nan
+
+    def add(self, x):
+        if not len(x):
+            return
+        self.min = np.fmin(self.min, x.min())
+        self.max = np.fmax(self.max, x.max())
+        self.values.append(x)
+        self.weights.append(np.ones(len(x), dtype=np.int64))
+        self.size += len(x)
+        if self.size > 2 * self.capacity:
+            self.compress()
+
+    def sorted(self):
+        values = np.concatenate(self.values) if self.values else np.empty(0)
+        weights = np.concatenate(self.weights) if self.weights else np.empty(0)
+        order = np.argsort(values, kind="stable")
+        return values[order], weights[order]
+
+    def compress(self):
+        values, weights = self.sorted()
+        total = np.cumsum(weights)
+        bins = (total - 1) * self.capacity // total[-1]
+        new_weights = np.bincount(bins, weights)
+        keep = new_weights > 0
+        new_values = np.bincount(bins, values * weights)[keep] / new_weights[keep]
+        self.values = [new_values]
+        self.weights = [new_weights[keep].astype(np.int64)]
+        self.size = len(new_values)
+        self.exact = False
+
+    def quantile(self, q):
+        values, weights = self.sorted()
+        if not len(values):
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan
+        if self.exact:
+            return np.quantile(values, q)
+        # NB: each centroid sits at the mid rank of the values it merged, so
+        #     all weights of 1 give the same linear interpolation as above
+        ranks = np.cumsum(weights) - (weights + 1) / 2
+        out = np.interp(np.multiply(q, weights.sum() - 1), ranks, values)
+        out = np.where(np.equal(q, 0), self.min, np.where(np.equal(q, 1), self.max, out))
+        return out if np.ndim(q) else out.item()
+
+    def median(self):
+        if self.exact and self.size:
+            return np.median(self.sorted()[0])
+        return self.quantile(0.5)
+
+
+class OnlineAggregate:
+    """
+    Chunk by chunk state of one aggregate call of supported_call, giving the
+    same result as calling it on the concatenated args.
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.count = 0
+        self.total = 0.0
+        self.m2 = 0.0
+        self.extremes = []
+        self.sketch = (
+            QuantileSketch() if func in ["to_median", "to_quantile", "to_box"] else None
+        )
+        # the last args, when they are not a Series, to call func on as is
+        self.scalar_args = None
+        self.args = ()
+
+    def add(self, a, *args):
+        self.args = args
+        if not isinstance(a, pd.core.series.Series):
+            self.scalar_args = (a,) + args
+            return
+        if self.func in stream_extreme_calls:
+            # NB: keep the pandas results, so integer counters stay integers
+            value = a.min() if self.func == "to_min" else a.max()
+            if not pd.isna(value):
+                self.extremes.append(value)
+            return
+
+        x = a.to_numpy(dtype=np.float64, na_value=np.nan)
+        x = x[~np.isnan(x)]
+        if self.sketch is not None:
+            self.sketch.add(x)
+        elif len(x):
+            # Chan et al. merge of (count, mean, M2), as pandas sums them.
+            # NB: inf values give a NaN std, silently as pandas does
+            with np.errstate(invalid="ignore"):
+                mean = x.sum() / len(x)
+                m2 = ((x - mean) ** 2).sum()
+                if self.count:
+                    delta = mean - self.total / self.count
+                    count = self.count + len(x)
+                    self.m2 += m2 + delta**2 * self.count * len(x) / count
+                else:
+                    self.m2 = m2
+            self.total += x.sum()
+            self.count += len(x)
+
+    def result(self):
+        if self.scalar_args is not None:
+            return globals()[self.func](*self.scalar_args)
+        if self.func in stream_extreme_calls:
+            if not self.extremes:
+                return np.nan
+            return min(self.extremes) if self.func == "to_min" else max(self.extremes)
+        if self.func == "to_avg":
+            return self.total / self.count if self.count else np.nan
+        if self.func == "to_std":
+            return np.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else np.nan
+        if self.func == "to_median":
+            return self.sketch.median()
+        if self.func == "to_quantile":
+            return self.sketch.quantile(self.args[0])
+        # to_box
+        return pd.Series(
+            self.sketch.quantile(list(simple_box.values())), index=list(simple_box.keys())
+        )
+
+
+def is_stream_aggregate(node):
+    return (
+        isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Name)
+        and (
+            node.func.id in stream_aggr_calls
+            or (node.func.id in stream_extreme_calls and len(node.args) == 1)
+        )
+    )
+
+
+def get_dag_children(node):
+    """
+    Return the ids of the DAG nodes and the ammolite__ names a folded node
+    refers to.
+    """
+    node_ids = []
+    names = []
+    for n in ast.walk(node):
+        if (
+            isinstance(n, ast.Subscript)
+            and isinstance(n.value, ast.Name)
+            and n.value.id == "ammolite__cse"
+        ):
+            index = get_subscript_index(n)
+            node_ids.append(index.value)
+        elif isinstance(n, ast.Name) and n.id.startswith("ammolite__"):
+            names.append(n.id[len("ammolite__") :])
+    return node_ids, names
+
+
+def build_stream_levels(dag, roots, build_in_roots):
+    """
+    Find the aggregate nodes under roots and the level of each: 1 plus the
+    highest level of the aggregates, or the build-in vars, its args depend
+    on. Return ({node_id: level}, {root: set of levels under it}).
+    """
+    aggregate_levels = {}
+    memo = {}
+
+    def levels_under(node_id):
+        # set of aggregate levels under a node, its own included
+        if node_id not in memo:
+            node = dag.nodes[node_id]
+            children, names = get_dag_children(node)
+            levels = set()
+            for child in children:
+                levels |= levels_under(child)
+            for name in names:
+                if name in build_in_roots:
+                    levels |= levels_under(build_in_roots[name])
+            if is_stream_aggregate(node):
+                aggregate_levels[node_id] = max(levels, default=0) + 1
+                levels = levels | {aggregate_levels[node_id]}
+            memo[node_id] = levels
+        return memo[node_id]
+
+    return aggregate_levels, {root: levels_under(root) for root in roots}
 
 
 @demarcate
-def apply_filters(workload, dir, is_gui, debug):
+def eval_metric_streaming(
+    dfs, dfs_type, sys_info, iter_chunks, debug, norm_dfs=None, filter_chunk=None
+):
     """
-    Apply user's filters to the raw_pmc df.
+    Execute the expr string for each metric in the df, and in the dfs of
+    each normalization unit in norm_dfs if given, like eval_metric(), from
+    raw pmc chunks instead of the whole raw pmc df.
+    iter_chunks(usecols) returns a new iterator of raw pmc chunks, which
+    filter_chunk() may reduce to the dispatches to evaluate. Aggregates are
+    exact, but for medians and quantiles of more than 2 x
+    stream_sketch_capacity dispatches, which are approximate.
     """
+    roof_only_run = sys_info.ip_blocks == "roofline"
+    rocscope_run = sys_info.ip_blocks == "rocscope"
 
-    # TODO: error out properly if filters out of bound
-    ret_df = workload.raw_pmc
+    equations = set()
+    for unit_dfs in [dfs] + list((norm_dfs or {}).values()):
+        for id, df in unit_dfs.items():
+            if dfs_type[id] != "metric_table":
+                continue
+            for expr in df.columns:
+                if expr in schema.supported_field and expr.lower() != "alias":
+                    equations.update(
+                        (e, c) for e, c in zip(df[expr], df["coll_level"]) if e
+                    )
 
-    if workload.filter_nodes:
-        ret_df = ret_df.loc[
-            ret_df[schema.pmc_perf_file_prefix]["Node"]
-            .astype(str)
-            .isin([workload.filter_gpu_ids])
-        ]
-        if ret_df.empty:
-            console_error("analysis", "{} is invalid".format(workload.filter_nodes))
-
-    if workload.filter_gpu_ids:
-        ret_df = ret_df.loc[
-            ret_df[schema.pmc_perf_file_prefix]["GPU_ID"]
-            .astype(str)
-            .isin([workload.filter_gpu_ids])
-        ]
-        if ret_df.empty:
-            console_error(
-                "analysis", "{} is an invalid gpu-id".format(workload.filter_gpu_ids)
+    # NB: build-in vars from aggregates, e.g. numActiveCUs, are DAG roots too
+    metric_dag = get_metric_dag(sys_info)
+    build_in_roots = {
+        key: metric_dag.add(value, schema.pmc_perf_file_prefix)
+        for key, value in build_in_vars.items()
+        if "PER_XCD" not in key
+    }
+    roots = {metric_dag.add(e, c): (e, c) for e, c in equations}
+    for key, root in build_in_roots.items():
+        roots[root] = (build_in_vars[key], schema.pmc_perf_file_prefix)
+    aggregate_levels, root_levels = build_stream_levels(metric_dag, roots, build_in_roots)
+
+    # Only read the counters of the metrics with aggregates of each level
+    per_xcd = [v for k, v in build_in_vars.items() if "PER_XCD" in k]
+    level_usecols = {}
+    for root, levels in root_levels.items():
+        for level in levels:
+            usecols = level_usecols.setdefault(
+                level, {schema.pmc_perf_file_prefix: set()}
             )
+            for equation, coll_level in [roots[root]] + [
+                (e, schema.pmc_perf_file_prefix) for e in per_xcd
+            ]:
+                for c_level, counter in get_eval_counters(equation, coll_level):
+                    usecols.setdefault(c_level, set()).add(counter)
+
+    results = {}
+    build_in = {}
+    for level in sorted(level_usecols):
+        aggregates = {
+            node_id: OnlineAggregate(metric_dag.nodes[node_id].func.id)
+            for node_id, l in aggregate_levels.items()
+            if l == level
+        }
+        arg_codes = {
+            node_id: [
+                compile(
+                    ast.fix_missing_locations(ast.Expression(body=arg)),
+                    "<metric>",
+                    "eval",
+                )
+                for arg in metric_dag.nodes[node_id].args
+            ]
+            for node_id in aggregates
+        }
+        errors = {}
+        num_dispatches = 0
+        for chunk in iter_chunks(level_usecols[level]):
+            if filter_chunk is not None:
+                chunk = filter_chunk(chunk)
+            if chunk.empty:
+                continue
+            num_dispatches += len(chunk)
+            if (
+                (not rocscope_run and not roof_only_run)
+                and hasattr(chunk["pmc_perf"], "GRBM_GUI_ACTIVE")
+                and (chunk["pmc_perf"]["GRBM_GUI_ACTIVE"] == 0).any()
+            ):
+                console_warning("Dectected GRBM_GUI_ACTIVE == 0")
+                console_error("Hauting execution for warning above.")
+
+            # NB: the build-in vars not final yet are not used at this level
+            metric_values = MetricValues(
+                metric_dag,
+                build_metric_scope(
+                    sys_info,
+                    build_pmc_columns(chunk),
+                    build_in=dict(dict.fromkeys(build_in_roots), **build_in),
+                ),
+            )
+            metric_values.results.update(results)
+            for node_id, aggregate in aggregates.items():
+                if node_id in errors:
+                    continue
+                try:
+                    aggregate.add(
+                        *[
+                            eval(code, globals(), metric_values.scope)
+                            for code in arg_codes[node_id]
+                        ]
+                    )
+                except Exception as e:
+                    errors[node_id] = e
+
+        for node_id, aggregate in aggregates.items():
+            if node_id in errors:
+                results[node_id] = (False, errors[node_id])
+                continue
+            try:
+                results[node_id] = (True, aggregate.result())
+            except Exception as e:
+                results[node_id] = (False, e)
+        console_debug(
+            "analysis",
+            "streamed {} aggregates of level {} over {} dispatches".format(
+                len(aggregates), level, num_dispatches
+            ),
+        )
+
+        # The build-in vars, which the next level may depend on
+        metric_values = build_stream_final_values(metric_dag, sys_info, build_in, results)
+        for key, root in build_in_roots.items():
+            if key not in build_in and max(root_levels[root], default=0) <= level:
+                try:
+                    build_in[key] = metric_values[root]
+                except (TypeError, AttributeError):
+                    build_in[key] = None
+
+    metric_values = build_stream_final_values(metric_dag, sys_info, build_in, results)
+    for unit_dfs in [dfs] + list((norm_dfs or {}).values()):
+        for id, df in unit_dfs.items():
+            if dfs_type[id] == "metric_table":
+                eval_metric_table(df, metric_values, debug)
+
+
+def build_stream_final_values(metric_dag, sys_info, build_in, results):
+    """
+    Build the MetricValues of a streamed workload, with all aggregates
+    final. Anything else reading raw pmc data is a missing counter.
+    """
+    metric_values = MetricValues(
+        metric_dag,
+        build_metric_scope(
+            sys_info, {schema.pmc_perf_file_prefix: {}}, build_in=build_in
+        ),
+    )
+    metric_values.results.update(results)
+    return metric_values
+
+
+@demarcate
+def apply_filters(workload, dir, is_gui, debug):
+    """
+    Apply user's filters to the raw_pmc df.
+    """
+
+    index = filter_index.get_filter_index(workload)
+    positions = index.select(
+        workload.filter_gpu_ids, workload.filter_dispatch_ids, workload.filter_nodes
+    )
 
     # NB:
     # Kernel id is unique!
@@ -873,7 +1778,7 @@ def apply_filters(workload, dir, is_gui, debug):
     if workload.filter_kernel_ids:
         if all(type(kid) == int for kid in workload.filter_kernel_ids):
             # Verify valid kernel filter
-            kernels_df = pd.read_csv(os.path.join(dir, "pmc_kernel_top.csv"))
+            kernels_df = workload.top_stats["pmc_kernel_top.csv"]
             for kernel_id in workload.filter_kernel_ids:
                 if kernel_id >= len(kernels_df["Kernel_Name"]):
                     console_error(
@@ -892,35 +1797,22 @@ def apply_filters(workload, dir, is_gui, debug):
                 kernel_top_df.loc[kernel_id, "S"] = "*"
 
             if kernels:
-                # print("fitlered df:", len(df.index))
-                ret_df = ret_df.loc[
-                    ret_df[schema.pmc_perf_file_prefix]["Kernel_Name"].isin(kernels)
-                ]
+                selected = index.select_values("Kernel_Name", kernels, key=None)
+                positions = filter_index.intersect(positions, selected)
         elif all(type(kid) == str for kid in workload.filter_kernel_ids):
-            df_cleaned = ret_df[schema.pmc_perf_file_prefix]["Kernel_Name"].apply(
-                lambda x: x.strip() if isinstance(x, str) else x
+            selected = index.select_values(
+                "Kernel_Name",
+                workload.filter_kernel_ids,
+                key=lambda x: x.strip() if isinstance(x, str) else x,
             )
-            ret_df = ret_df.loc[df_cleaned.isin(workload.filter_kernel_ids)]
+            positions = filter_index.intersect(positions, selected)
         else:
             console_error(
                 "analyze",
                 "Mixing kernel indices and string filters is not currently supported",
             )
 
-    if workload.filter_dispatch_ids:
-        # NB: support ignoring the 1st n dispatched execution by '> n'
-        #     The better way may be parsing python slice string
-        for d in workload.filter_dispatch_ids:
-            if int(d) >= len(ret_df):  # subtract 2 bc of the two header rows
-                console_error("analysis", "{} is an invalid dispatch id.".format(d))
-        if ">" in workload.filter_dispatch_ids[0]:
-            m = re.match(r"\> (\d+)", workload.filter_dispatch_ids[0])
-            ret_df = ret_df[
-                ret_df[schema.pmc_perf_file_prefix]["Dispatch_ID"] > int(m.group(1))
-            ]
-        else:
-            dispatches = [int(x) for x in workload.filter_dispatch_ids]
-            ret_df = ret_df.loc[dispatches]
+    ret_df = workload.raw_pmc if positions is None else workload.raw_pmc.iloc[positions]
     if debug:
         print("~" * 40, "\nraw pmc df info:\n")
         print(workload.raw_pmc.info())
@@ -930,6 +1822,25 @@ def apply_filters(workload, dir, is_gui, debug):
     return ret_df
 
 
+def build_chunk_filter(raw_pmc_df, filtered_df):
+    """
+    Return a function reducing a raw pmc chunk to the dispatches left in
+    filtered_df by apply_filters(), or None if none is filtered out.
+    Dispatches are matched by index, and node for multi-node.
+    """
+
+    def row_keys(df):
+        dispatches = df[schema.pmc_perf_file_prefix]
+        if "Node" in dispatches:
+            return pd.MultiIndex.from_arrays([dispatches["Node"], df.index])
+        return df.index
+
+    selected = row_keys(filtered_df).unique()
+    if len(selected) == len(raw_pmc_df):
+        return None
+    return lambda chunk: chunk[row_keys(chunk).isin(selected)]
+
+
 @demarcate
 def load_kernel_top(workload, dir):
     # NB:
@@ -937,7 +1848,9 @@ def load_kernel_top(workload, dir):
     #   - There might be a better way/timing to load raw_csv_table.
     tmp = {}
     for id, df in workload.dfs.items():
-        if "from_csv" in df.columns:
+        if "from_csv" in df.columns and df.loc[0, "from_csv"] in workload.top_stats:
+            tmp[id] = workload.top_stats[df.loc[0, "from_csv"]].copy()
+        elif "from_csv" in df.columns:
             file = Path.joinpath(Path(dir), df.loc[0, "from_csv"])
             if file.exists():
                 tmp[id] = pd.read_csv(file)
@@ -969,20 +1882,64 @@ def load_kernel_top(workload, dir):
 
 
 @demarcate
-def load_table_data(workload, dir, is_gui, debug, verbose, skipKernelTop=False):
+def load_table_data(
+    workload,
+    dir,
+    is_gui,
+    debug,
+    verbose,
+    skipKernelTop=False,
+    per_dispatch=False,
+    per_kernel_keys=None,
+    stream_chunks=None,
+):
     """
     Load data for all "raw_csv_table".
     Calculate mertric value for all "metric_table".
+    Calculate the per-dispatch metric matrix too if per_dispatch, and the
+    per-kernel one grouped by per_kernel_keys if given.
+    With stream_chunks, as the iter_chunks of eval_metric_streaming(), the
+    metrics are streamed from raw pmc chunks, and workload.raw_pmc only
+    needs the key columns to apply the filters.
     """
     if not skipKernelTop:
         load_kernel_top(workload, dir)
 
+    raw_pmc_df = apply_filters(workload, dir, is_gui, debug)
+
+    if stream_chunks is not None:
+        eval_metric_streaming(
+            workload.dfs,
+            workload.dfs_type,
+            workload.sys_info.iloc[0],
+            stream_chunks,
+            debug,
+            workload.norm_dfs,
+            build_chunk_filter(workload.raw_pmc, raw_pmc_df),
+        )
+        return
+
+    # NB: evaluate them first, eval_metric() overwrites the expr strings
+    if per_dispatch:
+        workload.per_dispatch = eval_per_dispatch(
+            workload.dfs, workload.dfs_type, workload.sys_info.iloc[0], raw_pmc_df
+        )
+    if per_kernel_keys:
+        workload.per_kernel = eval_per_kernel(
+            workload.dfs,
+            workload.dfs_type,
+            workload.sys_info.iloc[0],
+            raw_pmc_df,
+            per_kernel_keys,
+        )
+
     eval_metric(
         workload.dfs,
         workload.dfs_type,
         workload.sys_info.iloc[0],
-        apply_filters(workload, dir, is_gui, debug),
+        raw_pmc_df,
         debug,
+        workload.norm_dfs,
     )
 
 
@@ -27,12 +27,19 @@
 # predifned dict and global functions.
 #
 
+import functools
+import glob
+import os
+import re
 from collections import OrderedDict
 from dataclasses import dataclass, field
 from typing import Dict, Generator, List, Mapping
 
+import numpy as np
 import pandas as pd
 
+import config
+
 
 @dataclass
 class ArchConfig:
@@ -50,6 +57,10 @@ class ArchConfig:
     # [id: df_type] pairs
     dfs_type: Dict[int, str] = field(default_factory=dict)
 
+    # [normal_unit: [id: df]] pairs, only built to evaluate the metric tables
+    # of all normalization units in one pass
+    norm_dfs: Dict[str, Dict[int, pd.DataFrame]] = field(default_factory=dict)
+
     # [Index: Metric name] pairs
     metric_list: Dict[str, str] = field(default_factory=dict)
 
@@ -63,10 +74,21 @@ class Workload:
     raw_pmc: pd.DataFrame = None
     dfs: Dict[int, pd.DataFrame] = field(default_factory=dict)
     dfs_type: Dict[int, str] = field(default_factory=dict)
+    # [normal_unit: [id: df]] pairs, evaluated in one pass
+    norm_dfs: Dict[str, Dict[int, pd.DataFrame]] = field(default_factory=dict)
+    # [source: df] pairs of the Top Stats tables, e.g. pmc_kernel_top.csv,
+    # built in memory by file_io.create_df_kernel_top_stats()
+    top_stats: Dict[str, pd.DataFrame] = field(default_factory=dict)
+    # [dispatch x metric] df, only built for --per-dispatch
+    per_dispatch: pd.DataFrame = None
+    # [kernel x metric] df, only built for --per-kernel
+    per_kernel: pd.DataFrame = None
     filter_kernel_ids: List[int] = field(default_factory=list)
     filter_gpu_ids: List[int] = field(default_factory=list)
     filter_dispatch_ids: List[int] = field(default_factory=list)
     filter_nodes: List[str] = field(default_factory=list)
+    # filter_index.FilterIndex of raw_pmc, shared by all filters
+    filter_index: object = None
     avail_ips: List[int] = field(default_factory=list)
 
 
@@ -120,3 +142,77 @@ supported_field = [
 
 # The prefix of raw pmc_perf.csv
 pmc_perf_file_prefix = "pmc_perf"
+
+# Raw pmc columns stored as categoricals, as they only hold a few distinct
+# values repeated for every dispatch
+pmc_category_columns = ["Node", "Kernel_Name", "GPU_ID"]
+
+# NB:
+#   Raw counters get a fixed dtype by counter class, the same for every file,
+#   chunk and node of a workload, so they concat without promotion:
+#   - per instance counters, e.g. TCC_HIT[0], count the events of one block
+#     instance in one dispatch, and are stored as uint32.
+#   - block wide counters, e.g. TCC_HIT_sum or SQ_WAVES, add up all
+#     instances, and accumulate counters add up levels every cycle, so they
+#     are kept as int64.
+pmc_instance_counter_dtype = np.uint32
+pmc_instance_counter_re = re.compile(r"\[\d+\]$")
+
+
+@functools.lru_cache(maxsize=None)
+def get_pmc_counter_dtypes():
+    """
+    Return the [column: dtype] of the per instance counters listed in the
+    profile configs of all archs.
+    """
+    dtypes = {}
+    configs_dir = os.path.join(
+        str(config.rocprof_compute_home), "rocprof_compute_soc", "profile_configs"
+    )
+    for f in glob.glob(os.path.join(configs_dir, "**", "*.txt"), recursive=True):
+        with open(f) as file:
+            for line in file:
+                if line.startswith("pmc:"):
+                    for c in line.split()[1:]:
+                        if pmc_instance_counter_re.search(c):
+                            dtypes[c] = pmc_instance_counter_dtype
+    return dtypes
+
+
+def compact_pmc_df(df):
+    """
+    Return the raw pmc df with its per instance counter columns as
+    pmc_instance_counter_dtype, and the category columns as categoricals.
+    Other columns are kept as they are.
+    """
+    counter_dtypes = get_pmc_counter_dtypes()
+    dtypes = {
+        c: "category"
+        for c in pmc_category_columns
+        if c in df.columns and df[c].dtype != "category"
+    }
+    limits = np.iinfo(pmc_instance_counter_dtype)
+    for c in df.columns:
+        if c not in counter_dtypes or df[c].dtype != np.int64:
+            continue
+        # NB: a value out of range, e.g. of a counter that wrapped, is not
+        #     cast. The column stays int64, which concats losslessly.
+        if len(df) and not (limits.min <= df[c].min() and df[c].max() <= limits.max):
+            continue
+        dtypes[c] = counter_dtypes[c]
+    # NB: astype() leaves one block per column, consolidate them by copy()
+    return df.astype(dtypes).copy() if dtypes else df
+
+
+def widen_pmc_column(column):
+    """
+    Return a compact raw pmc column as int64, or its categories' dtype, so
+    evaluating metrics on it can not overflow. Other columns are returned as
+    they are.
+    """
+    if isinstance(column, pd.Series):
+        if column.dtype == "category":
+            return column.astype(column.cat.categories.dtype)
+        if column.dtype == pmc_instance_counter_dtype:
+            return column.astype(np.int64)
+    return column
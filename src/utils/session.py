@@ -0,0 +1,143 @@
+##############################################################################bl
+# MIT License
+#
+# Copyright (c) 2021 - 2024 Advanced Micro Devices, Inc. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+##############################################################################el
+
+import json
+import os
+
+from utils import manifest
+from utils.utils import console_error, console_warning
+
+# NB:
+#   A session journal records each profiling pass once its output csv is
+#   written: the checksum of its perfmon file, kernel and dispatch filters
+#   included, and the size and checksum of its output. profile --resume
+#   skips the passes whose perfmon file is unchanged and whose output is
+#   still there and valid, so a run killed on pass 14 of 18 only profiles
+#   the last passes again.
+session_file_name = "profile_session.json"
+
+# Bump it whenever the journal format changes
+session_format_version = 1
+
+
+def get_session_key(args, profiler_mode, mspec):
+    """
+    Return the options a session is resumed with, besides the perfmon files.
+    """
+    return {
+        "command": args.remaining,
+        "profiler": profiler_mode,
+        "gpu_model": mspec.gpu_model,
+        "ipblocks": args.ipblocks,
+        "filter_metrics": args.filter_metrics,
+        "roof_only": args.roof_only,
+        "format_rocprof_output": args.format_rocprof_output,
+    }
+
+
+def save_session(dir, session):
+    f = os.path.join(dir, session_file_name)
+    with open(f + ".tmp", "w") as fp:
+        json.dump(session, fp)
+    os.replace(f + ".tmp", f)
+
+
+def load_session(dir):
+    """
+    Return the session journal of a workload dir, or None if it is missing or
+    of another format.
+    """
+    try:
+        with open(os.path.join(dir, session_file_name)) as fp:
+            session = json.load(fp)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(session, dict) or session.get("format") != session_format_version:
+        return None
+    return session
+
+
+def start_session(dir, key, resume):
+    """
+    Return the journal of a profiling session in dir. With resume, continue
+    the journal of the session that was interrupted there.
+    """
+    if resume:
+        session = load_session(dir)
+        if session is None:
+            console_warning(
+                "profiling", "No session to resume in %s, profiling all passes" % dir
+            )
+        elif session["key"] != key:
+            console_error(
+                "profiling",
+                "%s was profiled with other options, so it cannot be resumed. "
+                "Profile it again without --resume." % dir,
+            )
+        else:
+            return session
+
+    session = {"format": session_format_version, "key": key, "passes": {}}
+    save_session(dir, session)
+    return session
+
+
+def get_pass_output(dir, fname):
+    return os.path.join(dir, os.path.splitext(os.path.basename(fname))[0] + ".csv")
+
+
+def is_pass_done(session, dir, fname, checksum):
+    """
+    Whether the pass of perfmon file fname with checksum was profiled in this
+    session, and its output is still valid.
+    """
+    info = session["passes"].get(os.path.basename(fname))
+    if info is None or info["sha256"] != checksum:
+        return False
+    output = get_pass_output(dir, fname)
+    if not os.path.isfile(output):
+        return False
+    output_info = info["output"]
+    return (
+        manifest.get_file_stat(output)["size"] == output_info["size"]
+        and manifest.get_file_checksum(output) == output_info["sha256"]
+    )
+
+
+def record_pass(session, dir, fname, checksum):
+    """
+    Journal the pass of perfmon file fname with checksum, once its output is
+    written.
+    """
+    output = get_pass_output(dir, fname)
+    if not os.path.isfile(output):
+        return
+    session["passes"][os.path.basename(fname)] = {
+        "sha256": checksum,
+        "output": {
+            "size": manifest.get_file_stat(output)["size"],
+            "sha256": manifest.get_file_checksum(output),
+        },
+    }
+    save_session(dir, session)
@@ -198,7 +198,7 @@ class MachineSpecs:
     ## A. Workload / Spec info
     ##########################################
 
-    # these three fields are special in that they're not included
+    # these fields are special in that they're not included
     # when you use (e.g.,) --specs to view the machinespecs, but they
     # _are_ included in profiling/analysis, so we mark them as 'optional'
     # in the metadata to avoid erroring out on missing fields on
@@ -227,6 +227,14 @@ class MachineSpecs:
             "optional": True,
         },
     )
+    filter_metrics: str = field(
+        default=None,
+        metadata={
+            "doc": "The metric ids profiling only collected the counters of.",
+            "name": "Filter Metrics",
+            "optional": True,
+        },
+    )
     timestamp: str = field(
         default=None,
         metadata={
@@ -51,6 +51,14 @@ def string_multiple_lines(source, width, max_rows):
     return "\n".join(lines)
 
 
+def to_display_df(df):
+    """
+    Typed metric columns store missing values as NaN. Show them as blank
+    cells like any other missing value.
+    """
+    return df.astype(object).where(df.notna(), "")
+
+
 def get_table_string(df, transpose=False, decimal=2):
     return tabulate(
         df.transpose() if transpose else df,
@@ -77,6 +85,8 @@ def show_all(args, runs, archConfigs, output):
                 # take the 1st run as baseline
                 base_run, base_data = next(iter(runs.items()))
                 base_df = base_data.dfs[table_config["id"]]
+                if type == "metric_table":
+                    base_df = to_display_df(base_df)
 
                 df = pd.DataFrame(index=base_df.index)
 
@@ -116,6 +126,8 @@ def show_all(args, runs, archConfigs, output):
                         else:
                             for run, data in runs.items():
                                 cur_df = data.dfs[table_config["id"]]
+                                if type == "metric_table":
+                                    cur_df = to_display_df(cur_df)
                                 if (type == "raw_csv_table") or (
                                     type == "metric_table"
                                     and (not header in hidden_columns)
@@ -42,9 +42,13 @@ from pathlib import Path as path
 import pandas as pd
 
 import config
+from utils import manifest
 
 rocprof_cmd = ""
 
+# Per-user cache dir of analysis configs and kernel names
+user_cache_dir_env = "ROCPROFCOMPUTE_CACHE_DIR"
+
 
 def demarcate(function):
     def wrap_function(*args, **kwargs):
@@ -94,6 +98,15 @@ def trace_logger(message, *args, **kwargs):
     logging.log(logging.TRACE, message, *args, **kwargs)
 
 
+def get_user_cache_dir():
+    if user_cache_dir_env in os.environ:
+        return path(os.environ[user_cache_dir_env])
+    return path(
+        os.environ.get("XDG_CACHE_HOME", path.home().joinpath(".cache")),
+        "rocprofiler-compute",
+    )
+
+
 def get_version(rocprof_compute_home) -> dict:
     """Return ROCm Compute Profiler versioning info"""
 
@@ -559,10 +572,25 @@ def v3_counter_csv_to_v2_csv(counter_file, agent_info_filepath, converted_csv_fi
 
 
 def run_prof(
-    fname, profiler_options, workload_dir, mspec, loglevel, format_rocprof_output
+    fname,
+    profiler_options,
+    workload_dir,
+    mspec,
+    loglevel,
+    format_rocprof_output,
+    out_dir=None,
+    env=None,
+    process_output=True,
 ):
+    """
+    Profile the app for one perfmon file. rocprof writes its results to
+    out_dir, workload_dir/out by default, and env is added to its environment.
+    Without process_output, the results are left in out_dir for the caller to
+    pass to process_prof_output.
+    """
     time_0 = time.time()
-    fbase = os.path.splitext(os.path.basename(fname))[0]
+    if out_dir is None:
+        out_dir = workload_dir + "/out"
 
     console_debug("pmc file: %s" % str(os.path.basename(fname)))
 
@@ -570,21 +598,14 @@ def run_prof(
     default_options = ["-i", fname]
     options = default_options + profiler_options
 
-    # set required env var for mi300
     new_env = None
-    if (
-        mspec.gpu_model.lower() == "mi300x_a0"
-        or mspec.gpu_model.lower() == "mi300x_a1"
-        or mspec.gpu_model.lower() == "mi300a_a0"
-        or mspec.gpu_model.lower() == "mi300a_a1"
-    ) and (
-        os.path.basename(fname) == "pmc_perf_13.txt"
-        or os.path.basename(fname) == "pmc_perf_14.txt"
-        or os.path.basename(fname) == "pmc_perf_15.txt"
-        or os.path.basename(fname) == "pmc_perf_16.txt"
-        or os.path.basename(fname) == "pmc_perf_17.txt"
-    ):
+    if env:
         new_env = os.environ.copy()
+        new_env.update(env)
+
+    # set required env var for mi300
+    if is_xcc_mode(fname, mspec):
+        new_env = new_env or os.environ.copy()
         new_env["ROCPROFILER_INDIVIDUAL_XCC_MODE"] = "1"
 
     time_1 = time.time()
@@ -612,9 +633,36 @@ def run_prof(
                 console_error(output, exit=False)
         console_error("Profiling execution failed.")
 
+    if process_output:
+        process_prof_output(fname, workload_dir, mspec, format_rocprof_output, out_dir)
+
+
+def is_xcc_mode(fname, mspec):
+    """Whether the pass of perfmon file fname collects TCC counters per XCC"""
+    return (
+        mspec.gpu_model.lower() == "mi300x_a0"
+        or mspec.gpu_model.lower() == "mi300x_a1"
+        or mspec.gpu_model.lower() == "mi300a_a0"
+        or mspec.gpu_model.lower() == "mi300a_a1"
+    ) and (
+        os.path.basename(fname) == "pmc_perf_13.txt"
+        or os.path.basename(fname) == "pmc_perf_14.txt"
+        or os.path.basename(fname) == "pmc_perf_15.txt"
+        or os.path.basename(fname) == "pmc_perf_16.txt"
+        or os.path.basename(fname) == "pmc_perf_17.txt"
+    )
+
+
+def process_prof_output(fname, workload_dir, mspec, format_rocprof_output, out_dir):
+    """
+    Convert and combine the rocprof results in out_dir of the pass of perfmon
+    file fname into workload_dir/<pass>.csv, with standard headers.
+    """
+    fbase = os.path.splitext(os.path.basename(fname))[0]
+
     if rocprof_cmd.endswith("v2"):
         # rocprofv2 has separate csv files for each process
-        results_files = glob.glob(workload_dir + "/out/pmc_1/results_*.csv")
+        results_files = glob.glob(out_dir + "/pmc_1/results_*.csv")
 
         # Combine results into single CSV file
         combined_results = pd.concat(
@@ -624,23 +672,19 @@ def run_prof(
         # Overwrite column to ensure unique IDs.
         combined_results["Dispatch_ID"] = range(0, len(combined_results))
 
-        combined_results.to_csv(
-            workload_dir + "/out/pmc_1/results_" + fbase + ".csv", index=False
-        )
+        combined_results.to_csv(out_dir + "/pmc_1/results_" + fbase + ".csv", index=False)
 
     if rocprof_cmd.endswith("v3"):
         results_files_csv = {}
         if format_rocprof_output == "json":
-            results_files_json = glob.glob(workload_dir + "/out/pmc_1/*/*.json")
+            results_files_json = glob.glob(out_dir + "/pmc_1/*/*.json")
 
             for json_file in results_files_json:
                 csv_file = pathlib.Path(json_file).with_suffix(".csv")
                 v3_json_to_csv(json_file, csv_file)
-            results_files_csv = glob.glob(workload_dir + "/out/pmc_1/*/*.csv")
+            results_files_csv = glob.glob(out_dir + "/pmc_1/*/*.csv")
         elif format_rocprof_output == "csv":
-            counter_info_csvs = glob.glob(
-                workload_dir + "/out/pmc_1/*/*_counter_collection.csv"
-            )
+            counter_info_csvs = glob.glob(out_dir + "/pmc_1/*/*_counter_collection.csv")
             existing_counter_files_csv = [
                 d for d in counter_info_csvs if os.path.isfile(d)
             ]
@@ -672,13 +716,9 @@ def run_prof(
                         counter_file, agent_info_filepath, converted_csv_file
                     )
 
-                results_files_csv = glob.glob(
-                    workload_dir + "/out/pmc_1/*/*_converted.csv"
-                )
+                results_files_csv = glob.glob(out_dir + "/pmc_1/*/*_converted.csv")
             else:
-                results_files_csv = glob.glob(
-                    workload_dir + "/out/pmc_1/*/*_kernel_trace.csv"
-                )
+                results_files_csv = glob.glob(out_dir + "/pmc_1/*/*_kernel_trace.csv")
 
         else:
             console_error("The output file of rocprofv3 can only support json or csv!!!")
@@ -691,25 +731,23 @@ def run_prof(
         # Overwrite column to ensure unique IDs.
         combined_results["Dispatch_ID"] = range(0, len(combined_results))
 
-        combined_results.to_csv(
-            workload_dir + "/out/pmc_1/results_" + fbase + ".csv", index=False
-        )
+        combined_results.to_csv(out_dir + "/pmc_1/results_" + fbase + ".csv", index=False)
 
-    if new_env:
+    if is_xcc_mode(fname, mspec):
         # flatten tcc for applicable mi300 input
-        f = path(workload_dir + "/out/pmc_1/results_" + fbase + ".csv")
+        f = path(out_dir + "/pmc_1/results_" + fbase + ".csv")
         xcds = total_xcds(mspec.gpu_model, mspec.compute_partition)
         df = flatten_tcc_info_across_xcds(f, xcds, int(mspec._l2_banks))
         df.to_csv(f, index=False)
 
-    if os.path.exists(workload_dir + "/out"):
+    if os.path.exists(out_dir):
         # copy and remove out directory if needed
         shutil.copyfile(
-            workload_dir + "/out/pmc_1/results_" + fbase + ".csv",
+            out_dir + "/pmc_1/results_" + fbase + ".csv",
             workload_dir + "/" + fbase + ".csv",
         )
         # Remove temp directory
-        shutil.rmtree(workload_dir + "/" + "out")
+        shutil.rmtree(out_dir)
 
     # Standardize rocprof headers via overwrite
     # {<key to remove>: <key to replace>}
@@ -757,7 +795,15 @@ def replace_timestamps(workload_dir):
 
 
 def gen_sysinfo(
-    workload_name, workload_dir, ip_blocks, app_cmd, skip_roof, roof_only, mspec, soc
+    workload_name,
+    workload_dir,
+    ip_blocks,
+    app_cmd,
+    skip_roof,
+    roof_only,
+    mspec,
+    soc,
+    filter_metrics=None,
 ):
     df = mspec.get_class_members()
 
@@ -774,6 +820,10 @@ def gen_sysinfo(
     if hasattr(soc, "roofline_obj") and (not skip_roof):
         blocks.append("roofline")
     df["ip_blocks"] = "|".join(blocks)
+    # NB: -b metric ids only collect their counters, so analyze can tell the
+    #     other metrics are missing
+    if filter_metrics:
+        df["filter_metrics"] = "|".join(filter_metrics)
 
     # Save csv
     df.to_csv(workload_dir + "/" + "sysinfo.csv", index=False)
@@ -1039,19 +1089,32 @@ def get_submodules(package_name):
 
 def is_workload_empty(path):
     """Peek workload directory to verify valid profiling output"""
-    pmc_perf_path = path + "/pmc_perf.csv"
-    if os.path.isfile(pmc_perf_path):
-        temp_df = pd.read_csv(pmc_perf_path)
-        if temp_df.dropna().empty:
-            console_error(
-                "profiling"
-                "Found empty cells in %s.\nProfiling data could be corrupt."
-                % pmc_perf_path
-            )
+    from utils import file_io
 
+    pmc_perf_path = path + "/pmc_perf.csv"
+    pmc_perf_copy = path + "/pmc_perf" + file_io.columnar_suffix
+    pmc_manifest = manifest.load_manifest(path)
+    if pmc_manifest is not None and "complete" in pmc_manifest:
+        complete = pmc_manifest["complete"]
+    elif os.path.isfile(pmc_perf_path):
+        # NB: stop at the 1st chunk with a complete row, not to load it all
+        complete = any(
+            not temp_df.dropna().empty
+            for temp_df in pd.read_csv(pmc_perf_path, chunksize=10000)
+        )
+    elif os.path.isfile(pmc_perf_copy):
+        # a columnar copy whose csv file is gone
+        pmc_perf_path = pmc_perf_copy
+        complete = not file_io.read_columnar(pmc_perf_copy).dropna().empty
     else:
         console_error("profiling", "Cannot find pmc_perf.csv in %s" % path)
 
+    if not complete:
+        console_error(
+            "profiling"
+            "Found empty cells in %s.\nProfiling data could be corrupt." % pmc_perf_path
+        )
+
 
 def print_status(msg):
     msg_length = len(msg)
@@ -1,13 +1,26 @@
+import json
 import os.path
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from importlib.machinery import SourceFileLoader
 from pathlib import Path
 from unittest.mock import patch
 
+import numpy as np
 import pandas as pd
 import pytest
 import test_utils
 
+from utils import (
+    analysis_cache,
+    file_io,
+    filter_index,
+    kernel_name_shortener,
+    manifest,
+    parser,
+    schema,
+)
+
 rocprof_compute = SourceFileLoader("rocprof-compute", "src/rocprof-compute").load_module()
 
 baseline_opts = ["rocprof-compute", "analyze"]
@@ -23,6 +36,22 @@ indirs = [
 ]
 
 
+def list_workload_files():
+    return sorted(
+        (str(f), f.stat().st_size, f.stat().st_mtime_ns)
+        for f in Path("tests/workloads").rglob("*")
+        if f.is_file()
+    )
+
+
+@pytest.fixture(scope="module", autouse=True)
+def workloads_unmodified():
+    # analyze reads workload dirs in place, so it must never write into them
+    workload_files = list_workload_files()
+    yield
+    assert list_workload_files() == workload_files
+
+
 @pytest.mark.misc
 def test_valid_path():
     for dir in indirs:
@@ -456,6 +485,52 @@ def test_dispatch_5():
     test_utils.clean_output_dir(config["cleanup"], workload_dir)
 
 
+@pytest.mark.serial
+def test_dispatch_range(tmp_path):
+    for dir in indirs:
+        workload_dir = test_utils.setup_workload_dir(dir)
+
+        # dispatches 1 and 2, listed, as a comparison and as slices
+        saved_dfs = [
+            test_utils.analyze_saved_dfs(
+                rocprof_compute,
+                workload_dir,
+                tmp_path.joinpath(Path(dir).name + str(i)),
+                ["--no-cache", "--dispatch"] + dispatch_filter,
+            )
+            for i, dispatch_filter in enumerate(
+                [["1", "2"], ["> 0"], ["1:"], ["1:3"], ["1", "2:"]]
+            )
+        ]
+        assert saved_dfs[0] and all(dfs == saved_dfs[0] for dfs in saved_dfs)
+
+        for dispatch_filter in ["3:", "2:1", "x"]:
+            e = test_utils.launch_analyze(
+                rocprof_compute,
+                ["--path", workload_dir, "--no-cache", "--dispatch", dispatch_filter],
+                check_success=False,
+            )
+            assert e.value.code == 1
+
+    test_utils.clean_output_dir(config["cleanup"], workload_dir)
+
+
+def test_filter_intersection():
+    raw_pmc = pd.DataFrame(
+        {
+            ("pmc_perf", "Dispatch_ID"): [0, 1, 2, 3, 4, 5],
+            ("pmc_perf", "GPU_ID"): [0, 0, 0, 1, 1, 1],
+        }
+    )
+    index = filter_index.FilterIndex(raw_pmc)
+    assert list(index.select(filter_gpu_ids=["1"], filter_dispatch_ids=["3:5"])) == [3, 4]
+
+    # Each filter matches, but not together
+    with pytest.raises(SystemExit) as e:
+        index.select(filter_gpu_ids=["1"], filter_dispatch_ids=["2"])
+    assert e.value.code == 1
+
+
 @pytest.mark.misc
 def test_gpu_ids():
     for dir in indirs:
@@ -809,8 +884,8 @@ def test_decimal_3():
 
 
 @pytest.mark.misc
-def test_save_dfs():
-    output_path = "tests/workloads/vcopy/saved_analysis"
+def test_save_dfs(tmp_path):
+    output_path = str(tmp_path / "saved_analysis")
     for dir in indirs:
         workload_dir = test_utils.setup_workload_dir(dir)
         with pytest.raises(SystemExit) as e:
@@ -959,6 +1034,508 @@ def test_g():
     test_utils.clean_output_dir(config["cleanup"], workload_dir)
 
 
+@pytest.mark.misc
+def test_analysis_cache(tmp_path, monkeypatch):
+    cache_dir = tmp_path.joinpath("cache", "analysis_results")
+    monkeypatch.setenv("ROCPROFCOMPUTE_CACHE_DIR", str(cache_dir.parent))
+
+    def get_cache_key(*args):
+        raise AssertionError("hashed the raw data on a stat key hit")
+
+    for dir in indirs:
+        workload_dir = tmp_path.joinpath(Path(dir).name)
+        shutil.copytree(dir, workload_dir)
+
+        def analyze(i, opts=[], workload_dir=workload_dir):
+            return test_utils.analyze_saved_dfs(
+                rocprof_compute,
+                workload_dir,
+                tmp_path.joinpath(Path(dir).name + str(i)),
+                opts,
+            )
+
+        # 1st run writes the cache, 2nd run reads it without hashing the raw
+        # data again
+        saved_dfs = [analyze(0)]
+        with monkeypatch.context() as m:
+            m.setattr(analysis_cache, "get_cache_key", get_cache_key)
+            saved_dfs.append(analyze(1))
+        saved_dfs.append(analyze(2, ["--no-cache"]))
+        assert saved_dfs[0] and saved_dfs[0] == saved_dfs[1] == saved_dfs[2]
+        assert len(list(cache_dir.glob("*.json.gz"))) == 1
+
+        # nothing is written into the workload dir
+        assert sorted(os.listdir(workload_dir)) == sorted(os.listdir(dir))
+
+        # a copy of the workload misses the stat key, but hits by content
+        copy_dir = tmp_path.joinpath(Path(dir).name + "_copy")
+        shutil.copytree(dir, copy_dir)
+        assert analyze(3, workload_dir=copy_dir) == saved_dfs[0]
+        assert len(list(cache_dir.glob("*.json.gz"))) == 1
+        assert len(list(cache_dir.glob("*.link"))) == 2
+
+        shutil.rmtree(cache_dir)
+
+
+@pytest.mark.misc
+def test_config_cache(tmp_path, monkeypatch):
+    config_cache_dir = tmp_path.joinpath("cache")
+    monkeypatch.setenv("ROCPROFCOMPUTE_CACHE_DIR", str(config_cache_dir))
+    for dir in indirs:
+        workload_dir = test_utils.setup_workload_dir(dir)
+
+        saved_dfs = [
+            test_utils.analyze_saved_dfs(
+                rocprof_compute,
+                workload_dir,
+                tmp_path.joinpath(Path(dir).name + str(i)),
+                opts,
+            )
+            for i, opts in enumerate([[], [], ["--no-cache"]])
+        ]
+        assert saved_dfs[0] and saved_dfs[0] == saved_dfs[1] == saved_dfs[2]
+
+    # at most one config bundle per arch
+    bundles = list(config_cache_dir.joinpath("analysis_configs").glob("*.json.gz"))
+    assert 0 < len(bundles) <= len(indirs)
+
+    test_utils.clean_output_dir(config["cleanup"], workload_dir)
+
+
+def get_saved_metric_values(saved_dfs, fields=("Avg", "Value", "Mean")):
+    """
+    Return the [metric id: value] pairs of the metric tables saved with
+    --save-dfs, from the first of fields each table has.
+    """
+    values = {}
+    for name, df in saved_dfs.items():
+        table_id = name.split("_")[0]
+        field = next((f for f in fields if f in df.columns), None)
+        if table_id.count(".") != 1 or field is None:
+            continue
+        for i, value in enumerate(pd.to_numeric(df[field], errors="coerce")):
+            values["{}.{}".format(table_id, i)] = value
+    return values
+
+
+def assert_metric_values_close(expected, actual, min_compared=100):
+    """
+    Assert that the numeric metric values in both match, as the saved
+    tables round them.
+    """
+    compared = 0
+    for metric_id, value in expected.items():
+        if metric_id not in actual or np.isnan(value):
+            continue
+        assert np.isclose(actual[metric_id], value, rtol=1e-3, atol=0.01), (
+            metric_id,
+            value,
+            actual[metric_id],
+        )
+        compared += 1
+    assert compared >= min_compared
+
+
+@pytest.mark.misc
+def test_per_dispatch(tmp_path):
+    for dir in indirs:
+        workload_dir = test_utils.setup_workload_dir(dir)
+
+        # all dispatches, then dispatch 1 only next to its metric tables
+        matrices = []
+        for opts in [[], ["--dispatch", "1"]]:
+            output_path = tmp_path.joinpath(Path(dir).name + str(len(matrices)))
+            saved_dfs = test_utils.analyze_saved_dfs(
+                rocprof_compute,
+                workload_dir,
+                output_path.with_suffix(".dfs"),
+                ["--no-cache", "--per-dispatch", str(output_path)] + opts,
+                read=pd.read_csv,
+            )
+            metrics = pd.read_csv(output_path.joinpath("metrics.csv"))["Metric"]
+            values = np.load(output_path.joinpath("values.npy"), mmap_mode="r")
+            matrices.append(
+                pd.DataFrame(
+                    values,
+                    index=pd.read_csv(output_path.joinpath("dispatches.csv"))[
+                        "Dispatch_ID"
+                    ],
+                    columns=metrics,
+                )
+            )
+
+        pmc_perf = pd.read_csv(Path(workload_dir, "pmc_perf.csv"))
+        assert list(matrices[0].index) == list(pmc_perf["Dispatch_ID"])
+        assert list(matrices[1].index) == [1]
+        pd.testing.assert_frame_equal(matrices[0].loc[[1]], matrices[1])
+
+        # a single dispatch is its own aggregate
+        assert_metric_values_close(
+            get_saved_metric_values(saved_dfs), matrices[1].iloc[0].to_dict()
+        )
+
+    test_utils.clean_output_dir(config["cleanup"], workload_dir)
+
+
+@pytest.mark.misc
+def test_per_kernel(tmp_path):
+    for dir in indirs:
+        # a copy of the workload whose last dispatch runs another kernel
+        workload_dir = tmp_path.joinpath(Path(dir).name)
+        shutil.copytree(dir, workload_dir)
+        for f in workload_dir.glob("*.csv"):
+            df = pd.read_csv(f)
+            if {"Dispatch_ID", "Kernel_Name"} <= set(df.columns):
+                df.loc[df["Dispatch_ID"] == df["Dispatch_ID"].max(), "Kernel_Name"] = (
+                    "vecCopy2(double*, double*, double*, int, int) [clone .kd]"
+                )
+                df.to_csv(f, index=False)
+        for f in ["pmc_kernel_top.csv", "pmc_dispatch_info.csv"]:
+            Path(workload_dir, f).unlink(missing_ok=True)
+
+        output_file = tmp_path.joinpath(Path(dir).name + ".csv")
+        saved_dfs = test_utils.analyze_saved_dfs(
+            rocprof_compute,
+            workload_dir,
+            tmp_path.joinpath(Path(dir).name + "_dfs"),
+            [
+                "--no-cache",
+                "--per-kernel",
+                str(output_file),
+                "--per-kernel-keys",
+                "GPU_ID",
+            ],
+            read=pd.read_csv,
+        )
+        per_kernel = pd.read_csv(output_file)
+        pmc_perf = pd.read_csv(Path(workload_dir, "pmc_perf.csv"))
+        assert len(per_kernel) == 2
+        assert per_kernel["Count"].sum() == len(pmc_perf)
+
+        # each row matches the metric tables of that kernel alone, with -k
+        top_kernels = saved_dfs["0.1_Top_Kernels.csv"]
+        for kernel_id, count in enumerate(top_kernels["Count"]):
+            kernel_dfs = test_utils.analyze_saved_dfs(
+                rocprof_compute,
+                workload_dir,
+                tmp_path.joinpath(Path(dir).name + "_k" + str(kernel_id)),
+                ["--no-cache", "-k", str(kernel_id)],
+                read=pd.read_csv,
+            )
+            row = per_kernel[per_kernel["Count"] == count].iloc[0]
+            assert_metric_values_close(get_saved_metric_values(kernel_dfs), row.to_dict())
+            for field in ["Min", "Max", "Pct of Peak"]:
+                assert_metric_values_close(
+                    {
+                        metric_id + " " + field: value
+                        for metric_id, value in get_saved_metric_values(
+                            kernel_dfs, [field]
+                        ).items()
+                    },
+                    row.to_dict(),
+                    min_compared=10,
+                )
+
+
+@pytest.mark.misc
+def test_stream(tmp_path):
+    for dir in indirs:
+        workload_dir = test_utils.setup_workload_dir(dir)
+
+        # each streamed run must match the one before it
+        saved_dfs = [
+            test_utils.analyze_saved_dfs(
+                rocprof_compute,
+                workload_dir,
+                tmp_path.joinpath(Path(dir).name + str(i)),
+                ["--no-cache"] + opts,
+                read=pd.read_csv,
+            )
+            for i, opts in enumerate(
+                [
+                    [],
+                    ["--stream", "1"],
+                    ["--dispatch", "1", "2"],
+                    ["--stream", "2", "--dispatch", "1", "2"],
+                ]
+            )
+        ]
+        for expected, streamed in [saved_dfs[0:2], saved_dfs[2:4]]:
+            assert expected and expected.keys() == streamed.keys()
+            for name, df in expected.items():
+                pd.testing.assert_frame_equal(df, streamed[name], rtol=1e-9)
+
+    test_utils.clean_output_dir(config["cleanup"], workload_dir)
+
+
+@pytest.mark.misc
+def test_compact_schema():
+    # the dtypes depend on the counters, not on their values
+    dfs = [
+        schema.compact_pmc_df(
+            pd.DataFrame({"TCC_HIT[0]": [value], "SQ_WAVES": [value], "Dispatch_ID": [0]})
+        )
+        for value in [1, 70000, 2**31]
+    ]
+    for df in dfs:
+        assert df.dtypes.to_dict() == dfs[0].dtypes.to_dict()
+    assert dfs[0]["TCC_HIT[0]"].dtype == np.uint32
+    assert dfs[0]["SQ_WAVES"].dtype == np.int64
+
+    chunks = list(file_io.iter_df_pmc_chunks("tests/workloads/vcopy/MI200", None, 5, 1))
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunk.dtypes.equals(chunks[0].dtypes)
+
+
+@pytest.mark.misc
+def test_stream_row_mismatch(tmp_path):
+    workload_dir = tmp_path.joinpath("MI200")
+    shutil.copytree("tests/workloads/vcopy/MI200", workload_dir)
+    # lose the last dispatch of one pmc file
+    f = workload_dir.joinpath("SQ_LEVEL_WAVES.csv")
+    pd.read_csv(f).iloc[:-1].to_csv(f, index=False)
+
+    for chunk_size in [1, 2]:
+        with pytest.raises(SystemExit) as e:
+            list(file_io.iter_df_pmc_chunks(str(workload_dir), None, 5, chunk_size))
+        assert e.value.code == 1
+
+
+@pytest.mark.misc
+def test_convert(tmp_path):
+    pytest.importorskip("pyarrow")
+    for dir in indirs:
+        workload_dir = tmp_path.joinpath(Path(dir).name)
+        shutil.copytree(dir, workload_dir)
+
+        saved_dfs = []
+        for mode in ["analyze", "convert", "analyze", "analyze"]:
+            if len(saved_dfs) == 2:
+                # mix csv files with copies whose csv files are gone
+                Path(workload_dir, "pmc_perf.parquet").unlink()
+                for f in workload_dir.glob("*.parquet"):
+                    f.with_suffix(".csv").unlink()
+            if mode == "analyze":
+                output_path = tmp_path.joinpath(Path(dir).name + str(len(saved_dfs)))
+                saved_dfs.append(
+                    test_utils.analyze_saved_dfs(
+                        rocprof_compute, workload_dir, output_path, ["--no-cache"]
+                    )
+                )
+            else:
+                test_utils.launch_analyze(
+                    rocprof_compute, ["--path", str(workload_dir)], mode
+                )
+                assert Path(workload_dir, "pmc_perf.parquet").is_file()
+
+        assert saved_dfs[0] and saved_dfs[0] == saved_dfs[1] == saved_dfs[2]
+
+
+@pytest.mark.misc
+def test_convert_copies_only(tmp_path):
+    pytest.importorskip("pyarrow")
+    for dir in indirs:
+        workload_dir = tmp_path.joinpath(Path(dir).name)
+        shutil.copytree(dir, workload_dir)
+        expected = test_utils.analyze_saved_dfs(
+            rocprof_compute,
+            workload_dir,
+            tmp_path.joinpath(Path(dir).name + "_csv"),
+            ["--no-cache"],
+        )
+
+        # keep only the columnar copies of the raw pmc data, and no manifest
+        test_utils.launch_analyze(
+            rocprof_compute, ["--path", str(workload_dir)], "convert"
+        )
+        for f in workload_dir.glob("*.parquet"):
+            f.with_suffix(".csv").unlink()
+        Path(workload_dir, "pmc_manifest.json").unlink(missing_ok=True)
+        assert not Path(workload_dir, "pmc_perf.csv").exists()
+
+        saved_dfs = test_utils.analyze_saved_dfs(
+            rocprof_compute,
+            workload_dir,
+            tmp_path.joinpath(Path(dir).name + "_parquet"),
+            ["--no-cache"],
+        )
+        assert expected and saved_dfs == expected
+
+
+@pytest.mark.misc
+def test_manifest(tmp_path, capsys):
+    for dir in indirs:
+        workload_dir = tmp_path.joinpath(Path(dir).name)
+        shutil.copytree(dir, workload_dir)
+        manifest_file = Path(workload_dir, "pmc_manifest.json")
+        generated_files = ["pmc_kernel_top.csv", "pmc_dispatch_info.csv"]
+        for f in generated_files + [manifest_file.name]:
+            Path(workload_dir, f).unlink(missing_ok=True)
+
+        # --list-stats from the raw data, as analyze only reads manifests,
+        # then from the manifest convert writes
+        listed = []
+        for mode in ["analyze", "convert", "analyze"]:
+            test_utils.launch_analyze(
+                rocprof_compute,
+                ["--path", str(workload_dir)]
+                + (["--list-stats", "--no-cache"] if mode == "analyze" else []),
+                mode,
+            )
+            out = capsys.readouterr().out
+            if mode == "analyze":
+                listed.append(out[out.index("Detected Kernels") :])
+                assert manifest_file.is_file() == (len(listed) == 2)
+
+        assert listed[0] == listed[1]
+        # the Top Stats tables are built in memory, not written to the workload
+        assert not any(Path(workload_dir, f).exists() for f in generated_files)
+
+
+@pytest.mark.misc
+def test_manifest_empty_csv(tmp_path):
+    workload_dir = tmp_path.joinpath("MI200")
+    shutil.copytree("tests/workloads/vcopy/MI200", workload_dir)
+    workload_dir.joinpath("SQ_LEVEL_WAVES.csv").write_text("")
+
+    pmc_manifest = manifest.build_manifest(str(workload_dir))
+    assert pmc_manifest["files"]["SQ_LEVEL_WAVES.csv"]["rows"] == 0
+    assert pmc_manifest["files"]["pmc_perf.csv"]["rows"] > 0
+
+
+@pytest.mark.misc
+def test_convert_without_pyarrow(tmp_path, monkeypatch):
+    workload_dir = tmp_path.joinpath("MI200")
+    shutil.copytree("tests/workloads/vcopy/MI200", workload_dir)
+    Path(workload_dir, "pmc_manifest.json").unlink(missing_ok=True)
+
+    # manifests need no pyarrow, only the columnar copies do
+    monkeypatch.setattr(file_io, "has_columnar_support", lambda: False)
+    test_utils.launch_analyze(rocprof_compute, ["--path", str(workload_dir)], "convert")
+    assert Path(workload_dir, "pmc_manifest.json").is_file()
+    assert not list(workload_dir.glob("*.parquet"))
+
+
+@pytest.mark.misc
+def test_metric_dag_threads():
+    # GUI callbacks add to the shared DAG from threads
+    dag = parser.MetricDAG()
+    equations = ["AVG((SQ_WAVES + {}) / GRBM_GUI_ACTIVE)".format(i) for i in range(200)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        roots = list(pool.map(lambda eq: dag.add(eq, "pmc_perf"), equations * 4))
+
+    assert roots == roots[: len(equations)] * 4
+    assert len(set(dag.node_ids.values())) == len(dag.node_ids) == len(dag.codes)
+
+
+@pytest.mark.misc
+def test_partial_workload(tmp_path, capsys):
+    workload_dir = tmp_path.joinpath("MI200")
+    shutil.copytree("tests/workloads/vcopy/MI200", workload_dir)
+    sys_info = pd.read_csv(workload_dir.joinpath("sysinfo.csv"))
+    sys_info["filter_metrics"] = "2|17"
+    sys_info.to_csv(workload_dir.joinpath("sysinfo.csv"), index=False)
+
+    test_utils.launch_analyze(rocprof_compute, ["--path", str(workload_dir), "-b", "2"])
+    captured = capsys.readouterr()
+    assert "profiled for metrics 2, 17 only" in captured.out + captured.err
+
+
+@pytest.mark.misc
+def test_nodes(tmp_path, capsys):
+    for node in ["node0", "node1"]:
+        shutil.copytree("tests/workloads/vcopy/MI200", tmp_path.joinpath(node))
+
+    # the 2nd run misses the analysis cache the 1st one left in tmp_path
+    for opts in [["--nodes"], ["--nodes", "node1", "node0", "-b", "2"], ["--list-nodes"]]:
+        test_utils.launch_analyze(rocprof_compute, ["--path", str(tmp_path)] + opts)
+
+    node_list = capsys.readouterr().out.splitlines()[-1]
+    assert sorted(node_list.split()[2:]) == ["node0", "node1"]
+
+
+@pytest.mark.misc
+def test_no_nodes(tmp_path):
+    # --nodes with no node sub dir to load
+    with pytest.raises(SystemExit) as e:
+        file_io.create_df_pmc(str(tmp_path), [], 0, 0)
+    assert e.value.code == 1
+
+
+@pytest.mark.misc
+def test_baseline_workers(capsys):
+    # a comparison prepared serially, then in worker processes
+    outputs = []
+    for cpu_count in [1, 2]:
+        with patch("os.cpu_count", return_value=cpu_count):
+            test_utils.launch_analyze(
+                rocprof_compute,
+                [
+                    "--path",
+                    "tests/workloads/vcopy/MI200",
+                    "--path",
+                    "tests/workloads/vcopy/MI100",
+                    "--no-cache",
+                ],
+            )
+        out = capsys.readouterr().out
+        outputs.append(out[out.index("0. Top Stats") :])
+
+    assert outputs[0] == outputs[1]
+
+
+@pytest.mark.kernel_verbose
+def test_kernel_name_cache(tmp_path, monkeypatch, capsys):
+    cache_dir = tmp_path.joinpath("cache")
+    monkeypatch.setenv("ROCPROFCOMPUTE_CACHE_DIR", str(cache_dir))
+    listed = []
+    for _ in range(2):
+        test_utils.launch_analyze(
+            rocprof_compute,
+            [
+                "--path",
+                "tests/workloads/vcopy/MI200",
+                "--list-stats",
+                "--kernel-verbose",
+                "0",
+                "--no-cache",
+            ],
+        )
+        out = capsys.readouterr().out
+        listed.append(out[out.index("Detected Kernels") :])
+
+    assert listed[0] == listed[1]
+    names = json.loads(cache_dir.joinpath("kernel_names.json").read_text())["names"]
+    assert names["0"] and all(name in listed[0] for name in names["0"].values())
+
+
+def test_kernel_name_cache_merge(tmp_path, monkeypatch):
+    cache_dir = tmp_path.joinpath("cache")
+    monkeypatch.setenv("ROCPROFCOMPUTE_CACHE_DIR", str(cache_dir))
+    monkeypatch.setattr(kernel_name_shortener, "disk_cache", None)
+    monkeypatch.setattr(kernel_name_shortener, "new_disk_names", {})
+
+    kernel_name_shortener.shorten_names(["kernel_a"], 0)
+    assert not cache_dir.joinpath("kernel_names.json").exists()
+
+    # Another process saves its names in the meantime
+    cache_dir.mkdir(parents=True)
+    cache_dir.joinpath("kernel_names.json").write_text(
+        json.dumps(
+            {
+                "format": kernel_name_shortener.disk_cache_format_version,
+                "names": {"0": {"kernel_b": "kernel_b"}},
+            }
+        )
+    )
+    kernel_name_shortener.save_disk_cache()
+
+    names = json.loads(cache_dir.joinpath("kernel_names.json").read_text())["names"]
+    assert sorted(names["0"]) == ["kernel_a", "kernel_b"]
+    assert not kernel_name_shortener.new_disk_names
+
+
 @pytest.mark.kernel_verbose
 def test_kernel_verbose_0():
     for dir in indirs:
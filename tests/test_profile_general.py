@@ -1,4 +1,5 @@
 import inspect
+import json
 import os.path
 import re
 import shutil
@@ -582,6 +583,60 @@ def test_kernel_names():
     test_utils.clean_output_dir(config["cleanup"], workload_dir)
 
 
+@pytest.mark.misc
+def test_plan(capsys):
+    options = baseline_opts + ["--plan"]
+    workload_dir = test_utils.get_output_dir()
+    test_utils.launch_rocprof_compute(config, options, workload_dir)
+
+    # assert that the passes were printed but not profiled
+    assert "Profiling plan:" in capsys.readouterr().out
+    assert not os.path.exists(os.path.join(workload_dir, "perfmon"))
+    assert not os.path.exists(os.path.join(workload_dir, "pmc_perf.csv"))
+
+    test_utils.clean_output_dir(config["cleanup"], workload_dir)
+
+
+@pytest.mark.misc
+def test_resume():
+    # -V keeps the output of each pass
+    options = baseline_opts + ["-V"]
+    workload_dir = test_utils.get_output_dir()
+    test_utils.launch_rocprof_compute(config, options, workload_dir)
+
+    # assert that every pass was journaled
+    session_file = os.path.join(workload_dir, "profile_session.json")
+    with open(session_file) as fp:
+        passes = json.load(fp)["passes"]
+    assert sorted(passes) == sorted(os.listdir(os.path.join(workload_dir, "perfmon")))
+
+    # lose the last pass, as if profiling was interrupted, then resume
+    last_pass = sorted(passes)[-1].replace(".txt", ".csv")
+    os.remove(os.path.join(workload_dir, last_pass))
+    os.remove(os.path.join(workload_dir, "pmc_perf.csv"))
+    test_utils.launch_rocprof_compute(config, options + ["--resume"], workload_dir)
+
+    with open(session_file) as fp:
+        assert sorted(json.load(fp)["passes"]) == sorted(passes)
+    assert os.path.isfile(os.path.join(workload_dir, last_pass))
+    assert os.path.isfile(os.path.join(workload_dir, "pmc_perf.csv"))
+
+    test_utils.clean_output_dir(config["cleanup"], workload_dir)
+
+
+@pytest.mark.misc
+def test_gpus_spatial_multiplexing():
+    options = baseline_opts + ["--gpus", "0", "1", "--spatial-multiplexing", "0", "2"]
+    workload_dir = test_utils.get_output_dir()
+    e = test_utils.launch_rocprof_compute(
+        config, options, workload_dir, check_success=False
+    )
+    assert e.value.code == 1
+    assert not os.path.exists(os.path.join(workload_dir, "perfmon"))
+
+    test_utils.clean_output_dir(config["cleanup"], workload_dir)
+
+
 @pytest.mark.misc
 def test_device_filter():
     device_id = "0"
@@ -1249,6 +1304,22 @@ def test_block_SQ_SPI_TA_TCC_CPF():
     test_utils.clean_output_dir(config["cleanup"], workload_dir)
 
 
+@pytest.mark.block
+def test_block_metrics():
+    # Speed-of-Light and L2 Cache metric ids
+    options = baseline_opts + ["--block", "2", "17"]
+    workload_dir = test_utils.get_output_dir()
+    test_utils.launch_rocprof_compute(config, options, workload_dir)
+
+    file_dict = test_utils.check_csv_files(workload_dir, num_devices, num_kernels)
+    counters = file_dict["pmc_perf.csv"].columns
+    assert "SQ_WAVES" in counters
+    # assert that only the counters of those metrics were collected
+    assert not any(c.startswith(("TA_", "TD_", "SPI_", "CPC_", "CPF_")) for c in counters)
+
+    test_utils.clean_output_dir(config["cleanup"], workload_dir)
+
+
 @pytest.mark.dispatch
 def test_dispatch_0():
     options = baseline_opts + ["--dispatch", "0"]
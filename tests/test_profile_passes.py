@@ -0,0 +1,324 @@
+import os.path
+import stat
+import sys
+import threading
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from rocprof_compute_profile import profiler_base
+from rocprof_compute_profile.profiler_rocprof_v2 import rocprof_v2_profiler
+from rocprof_compute_soc import soc_base
+from rocprof_compute_soc.soc_gfx90a import gfx90a_soc
+from utils import logger, manifest, utils
+
+# Stands in for rocprofv2, so the counter passes run without a GPU. Every
+# pass reports 3 dispatches with one value per counter of its perfmon file,
+# the GPU it was pinned to, and when it ran as the dispatch timestamps.
+FAKE_ROCPROF = """#!{python}
+import csv
+import os
+import sys
+import time
+
+argv = sys.argv[1:]
+pmc_file = argv[argv.index("-i") + 1]
+out_dir = argv[argv.index("-d") + 1]
+
+counters = []
+for line in open(pmc_file).read().splitlines():
+    if line.startswith("pmc:"):
+        counters += line[len("pmc:") :].split()
+
+start = time.time_ns()
+time.sleep(0.5)
+end = time.time_ns()
+
+header = [
+    "Dispatch_ID",
+    "GPU_ID",
+    "Grid_Size",
+    "Kernel_Name",
+    "Workgroup_Size",
+    "LDS_Per_Workgroup",
+    "Scratch_Per_Workitem",
+    "Arch_VGPR",
+    "Accum_VGPR",
+    "SGPR",
+    "Start_Timestamp",
+    "End_Timestamp",
+]
+gpu_id = os.environ.get("ROCR_VISIBLE_DEVICES", "0")
+os.makedirs(os.path.join(out_dir, "pmc_1"))
+with open(os.path.join(out_dir, "pmc_1", "results_%d.csv" % os.getpid()), "w") as fp:
+    writer = csv.writer(fp)
+    writer.writerow(header + counters)
+    for id in range(3):
+        writer.writerow(
+            [id, gpu_id, 1048576, "vecCopy", 256, 0, 0, 8, 0, 16, start, end]
+            + [i + id for i in range(len(counters))]
+        )
+"""
+
+logger.setup_console_handler()
+
+
+def run_passes(workload_dir, monkeypatch, gpus, pipeline=False, resume=False):
+    rocprof = os.path.join(os.path.dirname(workload_dir), "rocprofv2")
+    with open(rocprof, "w") as fp:
+        fp.write(FAKE_ROCPROF.format(python=sys.executable))
+    os.chmod(rocprof, os.stat(rocprof).st_mode | stat.S_IEXEC)
+    monkeypatch.setattr(utils, "rocprof_cmd", rocprof)
+
+    args = SimpleNamespace(
+        path=workload_dir,
+        name="app_1",
+        remaining="./app",
+        kernel=None,
+        dispatch=None,
+        ipblocks=["TCP", "TA"],
+        filter_metrics=None,
+        roof_only=False,
+        spatial_multiplexing=None,
+        resume=resume,
+        gpus=gpus,
+        pipeline=pipeline,
+        loglevel=40,
+        format_rocprof_output="csv",
+        columnar=False,
+        join_type="grid",
+        verbose=1,
+    )
+    mspec = SimpleNamespace(gpu_arch="gfx90a", gpu_model="MI200", total_l2_chan="32")
+    soc = gfx90a_soc(args, mspec)
+    soc.perfmon_filter(args.roof_only)
+
+    profiler = rocprof_v2_profiler(args, "rocprofv2", soc)
+    profiler.run_profiling("1.0.0", "rocprof-compute")
+    passes = {
+        f: pd.read_csv(os.path.join(workload_dir, f.replace(".txt", ".csv")))
+        for f in sorted(os.listdir(os.path.join(workload_dir, "perfmon")))
+    }
+    profiler.join_prof()
+    profiler.index_workload()
+    return passes, pd.read_csv(os.path.join(workload_dir, "pmc_perf.csv"))
+
+
+@pytest.mark.misc
+def test_concurrent_passes(tmp_path, monkeypatch):
+    passes, pmc_perf = run_passes(str(tmp_path / "serial"), monkeypatch, None)
+    concurrent_passes, concurrent_pmc_perf = run_passes(
+        str(tmp_path / "concurrent"), monkeypatch, ["1", "2", "3"]
+    )
+    assert len(passes) > 2
+    assert sorted(concurrent_passes) == sorted(passes)
+
+    # assert that profiling indexed the joined pmc_perf.csv
+    pmc_manifest = manifest.load_manifest(str(tmp_path / "serial"))
+    assert pmc_manifest["files"]["pmc_perf.csv"]["rows"] == len(pmc_perf)
+    assert not os.path.exists(tmp_path / "concurrent" / "out")
+
+    # assert that each pass ran on one of the gpus, and that some overlapped
+    spans = []
+    for df in concurrent_passes.values():
+        assert df["GPU_ID"].nunique() == 1 and df["GPU_ID"].iloc[0] in (1, 2, 3)
+        spans.append((df["Start_Timestamp"].iloc[0], df["End_Timestamp"].iloc[0]))
+    spans.sort()
+    assert any(b[0] < a[1] for a, b in zip(spans, spans[1:]))
+
+    # assert that the timestamps pass ran alone
+    df = concurrent_passes["timestamps.txt"]
+    timestamps_span = (df["Start_Timestamp"].iloc[0], df["End_Timestamp"].iloc[0])
+    assert (
+        sum(s[0] < timestamps_span[1] and timestamps_span[0] < s[1] for s in spans) == 1
+    )
+
+    # assert that the merged counters match those of passes run one by one
+    counters = [c for c in pmc_perf.columns if c.isupper() and c != "GPU_ID"]
+    assert counters
+    pd.testing.assert_frame_equal(pmc_perf[counters], concurrent_pmc_perf[counters])
+
+
+@pytest.mark.misc
+def test_pipelined_passes(tmp_path, monkeypatch):
+    passes, pmc_perf = run_passes(str(tmp_path / "serial"), monkeypatch, None)
+
+    # record the order the app runs and the results of each pass are
+    # processed in, holding the processing of a pass until the app runs for
+    # the next one
+    events = []
+    runs = []
+    ran = threading.Condition()
+
+    def run_prof(**kwargs):
+        fname = os.path.basename(kwargs["fname"])
+        with ran:
+            events.append(("run", fname))
+            runs.append(fname)
+            ran.notify_all()
+        utils.run_prof(**kwargs)
+
+    def process_prof_output(**kwargs):
+        fname = os.path.basename(kwargs["fname"])
+        events.append(("process", fname))
+        with ran:
+            ran.wait_for(
+                lambda: len(runs) > runs.index(fname) + 1 or len(runs) == len(passes),
+                timeout=10,
+            )
+        utils.process_prof_output(**kwargs)
+        events.append(("processed", fname))
+
+    monkeypatch.setattr(profiler_base, "run_prof", run_prof)
+    monkeypatch.setattr(profiler_base, "process_prof_output", process_prof_output)
+    pipelined_passes, pipelined_pmc_perf = run_passes(
+        str(tmp_path / "pipelined"), monkeypatch, None, pipeline=True
+    )
+    assert sorted(pipelined_passes) == sorted(passes)
+    assert sorted(runs) == sorted(passes)
+    assert not os.path.exists(tmp_path / "pipelined" / "out")
+
+    # assert that the app ran for the next pass before the results of a pass
+    # were processed
+    for fname, next_fname in zip(runs, runs[1:]):
+        assert events.index(("run", fname)) < events.index(("process", fname))
+        assert events.index(("run", next_fname)) < events.index(("processed", fname))
+    assert events[-1] == ("processed", runs[-1])
+
+    counters = [c for c in pmc_perf.columns if c.isupper() and c != "GPU_ID"]
+    assert counters
+    pd.testing.assert_frame_equal(pmc_perf[counters], pipelined_pmc_perf[counters])
+
+
+@pytest.mark.misc
+def test_resume_without_session(tmp_path, monkeypatch):
+    workload_dir = str(tmp_path / "workload")
+    passes, pmc_perf = run_passes(workload_dir, monkeypatch, None)
+
+    # an output left by other passes, and no journal to tell them apart
+    stale = os.path.join(workload_dir, "pmc_perf_99.csv")
+    pd.read_csv(os.path.join(workload_dir, "pmc_perf_0.csv")).assign(
+        STALE_COUNTER=1
+    ).to_csv(stale, index=False)
+    os.remove(os.path.join(workload_dir, "profile_session.json"))
+
+    resumed_passes, resumed_pmc_perf = run_passes(
+        workload_dir, monkeypatch, None, resume=True
+    )
+    assert sorted(resumed_passes) == sorted(passes)
+    assert not os.path.exists(stale)
+    assert list(resumed_pmc_perf.columns) == list(pmc_perf.columns)
+
+
+@pytest.mark.misc
+def test_join_current_passes(tmp_path, monkeypatch):
+    workload_dir = str(tmp_path / "workload")
+    passes, pmc_perf = run_passes(workload_dir, monkeypatch, None)
+
+    # an output the resumed session keeps, from a pass no longer profiled
+    stale = os.path.join(workload_dir, "pmc_perf_99.csv")
+    pd.read_csv(os.path.join(workload_dir, "pmc_perf_0.csv")).assign(
+        STALE_COUNTER=1
+    ).to_csv(stale, index=False)
+
+    _, resumed_pmc_perf = run_passes(workload_dir, monkeypatch, None, resume=True)
+    assert os.path.exists(stale)
+    pd.testing.assert_frame_equal(resumed_pmc_perf, pmc_perf)
+
+
+def plan_passes(workload_dir, filter_metrics):
+    args = SimpleNamespace(
+        path=workload_dir,
+        ipblocks=None,
+        filter_metrics=filter_metrics,
+        roof_only=False,
+        spatial_multiplexing=None,
+        resume=False,
+        loglevel=40,
+    )
+    mspec = SimpleNamespace(gpu_arch="gfx90a", gpu_model="MI200", total_l2_chan="32")
+    soc = gfx90a_soc(args, mspec)
+    soc.perfmon_filter(args.roof_only)
+    passes = [
+        f
+        for f in os.listdir(os.path.join(workload_dir, "perfmon"))
+        if f != "timestamps.txt"
+    ]
+    return soc, len(passes)
+
+
+@pytest.mark.misc
+def test_metric_counters(tmp_path):
+    soc, pass_count = plan_passes(str(tmp_path / "all"), None)
+    all_accumulate_counters, all_normal_counters = soc.get_perfmon_counters(False)
+    assert pass_count == 14
+    assert len(all_accumulate_counters) == 5
+
+    # Speed-of-Light and L2 Cache
+    soc, pass_count = plan_passes(str(tmp_path / "sol_l2"), ["2", "17"])
+    counters, coll_levels = soc.get_metric_counters()
+    accumulate_counters, normal_counters = soc.get_perfmon_counters(False)
+    assert pass_count == 8
+    assert coll_levels == {"SQ_IFETCH_LEVEL", "SQ_LEVEL_WAVES"}
+    assert [accus[-2] for accus in accumulate_counters] == [
+        "SQ_LEVEL_WAVES",
+        "SQ_IFETCH_LEVEL",
+    ]
+    assert len(normal_counters) == 73
+    assert set(normal_counters) <= set(all_normal_counters)
+    assert {"TCC_HIT_sum", "TCC_MISS_sum", "TCC_EA_RDREQ_sum", "SQ_INSTS"} <= set(
+        normal_counters
+    )
+    assert not any(ctr.startswith(("TA_", "TD_", "SPI_")) for ctr in normal_counters)
+
+    # One metric of the L2 Cache Speed-of-Light
+    soc, pass_count = plan_passes(str(tmp_path / "l2_util"), ["17.1.0"])
+    counters, coll_levels = soc.get_metric_counters()
+    assert pass_count == 2
+    assert counters == {
+        "TCC_BUSY",
+        "SQ_BUSY_CU_CYCLES",
+        "GRBM_SPI_BUSY",
+        "GRBM_COUNT",
+        "GRBM_GUI_ACTIVE",
+        "SQ_WAVES",
+    }
+    assert coll_levels == set()
+    assert soc.get_perfmon_counters(False) == (
+        [],
+        {
+            "TCC_BUSY_sum": 1,
+            "SQ_BUSY_CU_CYCLES": 5,
+            "GRBM_SPI_BUSY": 1,
+            "GRBM_COUNT": 1,
+            "GRBM_GUI_ACTIVE": 1,
+            "SQ_WAVES": 1,
+        },
+    )
+
+
+@pytest.mark.misc
+def test_schedule_counters_twice(tmp_path, monkeypatch):
+    # v3 swaps SQ_ACCUM_PREV_HIRES for the _ACCUM counters while scheduling
+    monkeypatch.setenv("ROCPROF", "rocprofv3")
+    soc, _ = plan_passes(str(tmp_path / "all"), None)
+    accumulate_counters, normal_counters = soc.get_perfmon_counters(False)
+    lines = [list(ctrs) for ctrs in accumulate_counters]
+
+    schedules = []
+    for _ in range(2):
+        output_files = soc_base.schedule_counters(
+            accumulate_counters, normal_counters, soc.get_perfmon_config()
+        )
+        schedules.append(
+            [
+                (f.file_name, sum((b.elements for b in f.blocks.values()), []))
+                for f in output_files
+            ]
+        )
+    assert accumulate_counters == lines
+    assert schedules[0] == schedules[1]
+    for file_name, ctrs in schedules[0][: len(lines)]:
+        assert file_name.replace(".txt", "_ACCUM") in ctrs
+    assert not any("SQ_ACCUM_PREV_HIRES" in ctrs for _, ctrs in schedules[0])
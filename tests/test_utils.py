@@ -26,6 +26,7 @@
 import inspect
 import os
 import shutil
+from pathlib import Path
 from unittest.mock import patch
 
 import pandas as pd
@@ -150,3 +151,47 @@ def launch_rocprof_compute(config, options, workload_dir, check_success=True):
         assert e.value.code == 0
 
     return e
+
+
+def launch_analyze(rocprof_compute, options, mode="analyze", check_success=True):
+    """Launch ROCm Compute Profiler in analyze (or another non-profiling) mode
+
+    Args:
+        rocprof_compute (module): loaded rocprof-compute script
+        options (list): command line options, --path included
+        mode (str, optional): rocprof-compute mode. Defaults to "analyze".
+        check_success (bool, optional): Whether to verify successful exit condition. Defaults to True.
+
+    Returns:
+       exception: SystemExit exception
+    """
+    with pytest.raises(SystemExit) as e:
+        with patch("sys.argv", ["rocprof-compute", mode] + options):
+            rocprof_compute.main()
+
+    # verify run status
+    if check_success:
+        assert e.value.code == 0
+
+    return e
+
+
+def analyze_saved_dfs(rocprof_compute, workload_dir, output_dir, options=[], read=None):
+    """Analyze a workload with --save-dfs and read back the saved csv files
+
+    Args:
+        rocprof_compute (module): loaded rocprof-compute script
+        workload_dir (string): workload directory to analyze
+        output_dir (string): directory to save the analysis dataframes to
+        options (list, optional): additional analyze options. Defaults to [].
+        read (callable, optional): reader of each csv file. Defaults to its text.
+
+    Returns:
+        dict: dictionary housing each saved csv file, by file name
+    """
+    launch_analyze(
+        rocprof_compute,
+        ["--path", str(workload_dir), "--save-dfs", str(output_dir)] + options,
+    )
+    read = read or (lambda f: f.read_text())
+    return {f.name: read(f) for f in sorted(Path(output_dir).glob("*.csv"))}